@@ -6,3 +6,7 @@ except ImportError:
     version = "0.0.0.dev0"
 
 from .api import run_cmd
+from .batch import run_cmd_batch
+from .fanout import HostResult, run_cmd_many
+from .pool import ShellPool
+from .runner import run_cmd_sharded
@@ -0,0 +1,187 @@
+""" Run a command on many hosts.
+
+Examples:
+
+    python -m aiowinrm -u vagrant host1 host2 -- ipconfig /all
+    python -m aiowinrm -u 'DOMAIN\\admin' -f hosts.txt --processes 8 \\
+        --rate 100 --json -- hostname > results.jsonl
+
+The password is read from the AIOWINRM_PASSWORD environment variable, or
+prompted for.
+"""
+import argparse
+import asyncio
+import getpass
+import json
+import os
+import sys
+
+import aiohttp
+
+from .runner import run_cmd_sharded
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m aiowinrm", usage="%(prog)s [options] HOST... -- "
+        "COMMAND [ARG...]", description=__doc__.splitlines()[0],
+        epilog="\n".join(__doc__.splitlines()[1:]),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "hosts", nargs="*", metavar="HOST",
+        help="Hosts, as accepted by parse_host"
+    )
+    parser.add_argument(
+        "-f", "--hosts-file",
+        help="File with one host per line, - for stdin"
+    )
+    parser.add_argument("-u", "--user", help="User name (basic auth)")
+    parser.add_argument(
+        "-p", "--processes", type=int, default=None,
+        help="Number of worker processes (default: number of CPUs)"
+    )
+    parser.add_argument(
+        "--limit", type=int, default=100,
+        help="Maximum number of commands in flight"
+    )
+    parser.add_argument(
+        "--limit-per-host", type=int, default=1,
+        help="Maximum number of commands in flight per host"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=None,
+        help="Maximum number of commands started per second"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=None,
+        help="Overall deadline in seconds"
+    )
+    parser.add_argument(
+        "--unordered", action="store_true",
+        help="Print results as they come, instead of in the order of hosts"
+    )
+    parser.add_argument(
+        "--json", action="store_true",
+        help="Print one JSON object per host"
+    )
+    parser.add_argument(
+        "--progress", action="store_true",
+        help="Report progress on stderr"
+    )
+
+    if argv is None:
+        argv = sys.argv[1:]
+    # Everything after -- is the command line, which hosts cannot be told
+    # apart from otherwise
+    position = argv.index("--") if "--" in argv else len(argv)
+    args = parser.parse_args(argv[:position])
+    command_line = argv[position + 1:]
+    if not command_line:
+        parser.error("the command must be given after --")
+    args.command, args.args = command_line[0], tuple(command_line[1:])
+    return args
+
+
+def _read_hosts(args):
+    hosts = list(args.hosts)
+    if args.hosts_file == "-":
+        hosts.extend(sys.stdin.read().split())
+    elif args.hosts_file is not None:
+        with open(args.hosts_file) as fp:
+            hosts.extend(fp.read().split())
+    return hosts
+
+
+def _auth(user):
+    if user is None:
+        return None
+    password = os.environ.get("AIOWINRM_PASSWORD")
+    if password is None:
+        password = getpass.getpass("Password for {}: ".format(user))
+    return aiohttp.BasicAuth(user, password)
+
+
+def _text(response):
+    """ Return the stdout and stderr of response as text.
+
+    Output not matching the codepage of the shell, e.g. of a program
+    writing in another one, is replaced rather than failing the run.
+    """
+    return (
+        str(response.stdout_bytes, response.encoding, "replace"),
+        str(response.stderr_bytes, response.encoding, "replace"),
+    )
+
+
+def _format(result, as_json):
+    if as_json:
+        record = {"host": result.host, "ok": result.ok}
+        if result.ok:
+            response = result.response
+            record["returncode"] = response.returncode
+            record["stdout"], record["stderr"] = _text(response)
+        else:
+            record["error"] = "{}: {}".format(
+                type(result.exception).__name__, result.exception
+            )
+        return json.dumps(record)
+
+    if not result.ok:
+        return "{}: failed: {}: {}".format(
+            result.host, type(result.exception).__name__, result.exception
+        )
+
+    response = result.response
+    stdout, stderr = _text(response)
+    lines = [
+        "{}: {}".format(result.host, line) for line in stdout.splitlines()
+    ]
+    lines.extend(
+        "{} [stderr]: {}".format(result.host, line)
+        for line in stderr.splitlines()
+    )
+    lines.append("{}: exit code {}".format(result.host, response.returncode))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """ Entry point, returns the exit status: 0 if the command succeeded on
+    every host, 1 otherwise.
+    """
+    args = _parse_args(argv)
+    hosts = _read_hosts(args)
+    if not hosts:
+        print("No hosts given", file=sys.stderr)
+        return 2
+    auth = _auth(args.user)
+
+    def progress(done, total):
+        print("\r{}/{}".format(done, total), end="", file=sys.stderr)
+        if done == total:
+            print(file=sys.stderr)
+
+    async def run():
+        failed = 0
+        async for result in run_cmd_sharded(
+            hosts, auth, args.command, args.args,
+            processes=args.processes, limit=args.limit,
+            limit_per_host=args.limit_per_host, timeout=args.timeout,
+            rate=args.rate, ordered=not args.unordered,
+            progress=progress if args.progress else None,
+        ):
+            print(_format(result, args.json), flush=True)
+            if not result.ok or result.response.returncode != 0:
+                failed += 1
+        return failed
+
+    loop = asyncio.new_event_loop()
+    try:
+        failed = loop.run_until_complete(run())
+    finally:
+        loop.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
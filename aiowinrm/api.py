@@ -4,19 +4,46 @@ from .core import CommandContext, ShellContext
 
 
 async def run_cmd(host, auth, command, args=(), env=None, cwd=None,
-                        stdout_callback=None, stderr_callback=None):
+                        stdout_callback=None, stderr_callback=None,
+                        shell_pool=None, stdin=None):
     """ Run the given command on the given host asynchronously.
+
+    If stdin is given (bytes, iterable or async iterable of bytes), it is
+    streamed to the command while its output is being received.
+
+    If shell_pool is given, the shell is taken from (and given back to) the
+    pool, and auth is ignored in favor of the pool's session.
     """
+    if shell_pool is not None:
+        async with shell_pool.shell(host, env=env, cwd=cwd) as shell_context:
+            await _run_in_shell(
+                shell_context, command, args, stdout_callback,
+                stderr_callback, stdin
+            )
+        return
+
     async with aiohttp.ClientSession(auth=auth) as session:
         async with ShellContext(session, host, env=env, cwd=cwd) as shell_context:
-            async with CommandContext(
-                session, host, shell_context.shell_id, command, args
-            ) as command_context:
-                is_done = False
-                while not is_done:
-                    stdout, stderr, return_code, is_done = await command_context._output_request()
-                    for out, callback in (
-                        (stdout, stderr_callback), (stderr, stderr_callback)
-                    ):
-                        if out and callback:
-                            callback(out)
+            await _run_in_shell(
+                shell_context, command, args, stdout_callback,
+                stderr_callback, stdin
+            )
+
+
+async def _run_in_shell(shell_context, command, args, stdout_callback,
+                        stderr_callback, stdin=None):
+    async with CommandContext.from_shell_context(
+        shell_context, command, args
+    ) as command_context:
+        if stdin is None:
+            output = command_context.stream(encoding="utf8")
+        else:
+            output = command_context.stream_with_stdin(
+                stdin, encoding="utf8"
+            )
+
+        callbacks = {"stdout": stdout_callback, "stderr": stderr_callback}
+        async for stream, chunk in output:
+            callback = callbacks[stream]
+            if callback:
+                callback(chunk)
@@ -0,0 +1,235 @@
+""" Running many small commands on a host in a few round trips.
+
+Every command run through CommandContext costs at least three requests
+(Command, Receive, Signal), each with its envelope to build and parse. A
+batch instead runs its commands one after the other under a single
+PowerShell wrapper command: each of them through cmd.exe, as WinRM would,
+with a marker and its exit code written to stdout and stderr once it exits.
+The output of the wrapper is then split back per command.
+
+Batches whose command line would exceed the limit of cmd.exe are split,
+and the parts run one after the other, so that commands still run in order
+across parts.
+
+Commands of a batch share the stdin of the wrapper, i.e. none.
+"""
+import re
+import uuid
+
+import aiohttp
+
+from .core import CommandContext, ShellContext
+from .errors import BatchError
+from .response import Response
+from .utils import powershell_command, quote_powershell
+
+
+# Longest command line of a single batch command, in characters. WinRM runs
+# commands through cmd.exe, which rejects command lines longer than this.
+MAX_COMMAND_LINE_SIZE = 8191
+
+_BATCH_SCRIPT = """\
+$ErrorActionPreference = 'Stop'
+$marker = {marker}
+$commands = @(
+{commands}
+)
+$stdout = [Console]::OpenStandardOutput()
+$stderr = [Console]::OpenStandardError()
+for ($i = 0; $i -lt $commands.Length; $i++) {{
+    $psi = New-Object Diagnostics.ProcessStartInfo(
+        'cmd.exe', '/c ' + $commands[$i]
+    )
+    $psi.UseShellExecute = $false
+    $p = [Diagnostics.Process]::Start($psi)
+    $p.WaitForExit()
+    $end = [Text.Encoding]::ASCII.GetBytes("$marker $i $($p.ExitCode);")
+    $stdout.Write($end, 0, $end.Length)
+    $stdout.Flush()
+    $stderr.Write($end, 0, $end.Length)
+    $stderr.Flush()
+}}
+"""
+
+
+def batch_command(command_lines, marker):
+    """ Return the (command, args) running every command line in order.
+
+    Parameters
+    ----------
+    command_lines : sequence of str
+        Command lines, run through cmd.exe.
+    marker : str
+        ASCII string found in the output of none of the commands, which
+        separates their output.
+    """
+    return powershell_command(_batch_script(command_lines, marker))
+
+
+def split_output(stdout, stderr, marker, count):
+    """ Split the output of a batch_command of count commands.
+
+    Returns
+    -------
+    outputs : list
+        (stdout, stderr, returncode) of every command which ran. Fewer than
+        count if the batch was interrupted.
+    """
+    r_end = re.compile(re.escape(marker.encode("ascii")) + rb" (\d+) (-?\d+);")
+
+    stdout_parts = _split(r_end, stdout)
+    stderr_parts = _split(r_end, stderr)
+
+    outputs = []
+    for i, (out, returncode) in enumerate(stdout_parts[:count]):
+        if i < len(stderr_parts):
+            err = stderr_parts[i][0]
+        else:
+            err = b""
+        outputs.append((out, err, returncode))
+    return outputs
+
+
+def _split(r_end, data):
+    parts = []
+    start = 0
+    for i, match in enumerate(r_end.finditer(data)):
+        if int(match.group(1)) != i:
+            raise BatchError(
+                "Unexpected batch marker for command {}, expected {}".format(
+                    match.group(1).decode("ascii"), i
+                )
+            )
+        parts.append((data[start:match.start()], int(match.group(2))))
+        start = match.end()
+    return parts
+
+
+def _batch_script(command_lines, marker):
+    return _BATCH_SCRIPT.format(
+        marker=quote_powershell(marker),
+        commands="\n".join(
+            quote_powershell(command_line) for command_line in command_lines
+        ),
+    )
+
+
+def _plan(command_lines, marker, max_command_line_size):
+    """ Group consecutive command lines so that the command line of every
+    batch_command stays within max_command_line_size characters.
+
+    A command line too long on its own still gets a batch of its own.
+    """
+    command, args = powershell_command("")
+    # Up to the base64 of the script
+    prefix_size = len(" ".join((command,) + args))
+    empty_size = len(_batch_script([], marker).encode("utf-16-le"))
+
+    def command_line_size(script_size):
+        return prefix_size + 4 * ((script_size + 2) // 3)
+
+    batches = []
+    batch = []
+    # Size of the UTF-16 script, in bytes
+    size = empty_size
+    for command_line in command_lines:
+        command_size = len(
+            (quote_powershell(command_line) + "\n").encode("utf-16-le")
+        )
+        if batch and (
+            command_line_size(size + command_size) > max_command_line_size
+        ):
+            batches.append(batch)
+            batch = []
+            size = empty_size
+        batch.append(command_line)
+        size += command_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def run_batch(shell_context, commands,
+                    max_command_line_size=MAX_COMMAND_LINE_SIZE):
+    """ Run commands one after the other in the given shell, in as few
+    commands as possible.
+
+    Parameters
+    ----------
+    shell_context : ShellContext
+        An open shell.
+    commands : iterable
+        Commands to run, each one either a string or a (command, args) pair.
+    max_command_line_size : int
+        Longest command line of a single batch command, in characters.
+
+    Returns
+    -------
+    responses : list of Response
+        Responses, in the order of commands, with their own exit code.
+    """
+    command_lines = []
+    for command in commands:
+        if isinstance(command, str):
+            command_lines.append(command)
+        else:
+            command, args = command
+            command_lines.append(" ".join((command,) + tuple(args)))
+
+    marker = "aiowinrm-batch-{}".format(uuid.uuid4().hex)
+    responses = []
+    # A part starts running as soon as it is created: the next one is only
+    # created once it is done.
+    for batch in _plan(command_lines, marker, max_command_line_size):
+        responses.extend(await _run_one_batch(shell_context, batch, marker))
+    return responses
+
+
+async def _run_one_batch(shell_context, command_lines, marker):
+    command, args = batch_command(command_lines, marker)
+    output = {"stdout": bytearray(), "stderr": bytearray()}
+    # The batch command line is sized after the limit of cmd.exe on its
+    # own: it cannot take the gzip wrapper of compress_output on top of it.
+    async with CommandContext.from_shell_context(
+        shell_context, command, args, compress_output=False
+    ) as command_context:
+        async for stream, chunk in command_context.stream():
+            output[stream] += chunk
+
+    outputs = split_output(
+        output["stdout"], output["stderr"], marker, len(command_lines)
+    )
+    if len(outputs) < len(command_lines):
+        stderr = output["stderr"][-1000:].decode(
+            shell_context.encoding, "replace"
+        )
+        raise BatchError(
+            "Batch stopped after {} of {} commands, with exit code {}: "
+            "{}".format(
+                len(outputs), len(command_lines),
+                command_context.return_code, stderr
+            )
+        )
+    return [
+        Response(stdout, stderr, returncode, shell_context.encoding)
+        for stdout, stderr, returncode in outputs
+    ]
+
+
+async def run_cmd_batch(host, auth, commands, env=None, cwd=None,
+                        shell_pool=None):
+    """ Run the given commands on the given host, in a single shell and as
+    few commands as possible, and return their Responses.
+
+    If shell_pool is given, the shell is taken from (and given back to) the
+    pool, and auth is ignored in favor of the pool's session.
+    """
+    if shell_pool is not None:
+        async with shell_pool.shell(host, env=env, cwd=cwd) as shell_context:
+            return await run_batch(shell_context, commands)
+
+    async with aiohttp.ClientSession(auth=auth) as session:
+        async with ShellContext(
+            session, host, env=env, cwd=cwd
+        ) as shell_context:
+            return await run_batch(shell_context, commands)
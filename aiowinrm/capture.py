@@ -0,0 +1,149 @@
+""" Bounded-memory capture of command output.
+
+Output is written as raw bytes to a SpooledTemporaryFile: it stays in memory
+up to max_memory bytes, and is moved to a temporary file beyond that. It is
+only decoded when accessed, either at once or line by line.
+"""
+import codecs
+import tempfile
+
+from attr import attributes, attr
+
+from .constants import DEFAULT_CAPTURE_MEMORY
+
+
+_READ_SIZE = 64 * 1024
+
+
+class OutputCapture(object):
+    """ Output of one stream of a command.
+
+    Parameters
+    ----------
+    max_memory : int
+        Bytes kept in memory before spilling to a temporary file.
+    directory : str or None
+        Directory of the temporary file, the default temporary directory if
+        None.
+    """
+    def __init__(self, max_memory=DEFAULT_CAPTURE_MEMORY, directory=None):
+        self.max_memory = max_memory
+        self.size = 0
+
+        self._file = tempfile.SpooledTemporaryFile(
+            max_size=max_memory, dir=directory
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a, **kw):
+        self.close()
+
+    @property
+    def spilled(self):
+        """ True if the output was moved to a temporary file.
+        """
+        return self.size > self.max_memory
+
+    def write(self, data):
+        self._file.seek(0, 2)
+        self._file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        self._file.close()
+
+    def getvalue(self):
+        """ Return the whole output, as bytes.
+        """
+        self._file.seek(0)
+        return self._file.read()
+
+    def iter_chunks(self, chunk_size=_READ_SIZE):
+        """ Iterate over the output, as bytes of at most chunk_size bytes.
+        """
+        position = 0
+        while position < self.size:
+            self._file.seek(position)
+            chunk = self._file.read(chunk_size)
+            position += len(chunk)
+            yield chunk
+
+    def text(self, encoding="utf8", errors="strict"):
+        """ Return the whole output, decoded.
+        """
+        return self.getvalue().decode(encoding, errors)
+
+    def iter_lines(self, encoding="utf8", errors="strict"):
+        """ Iterate over the decoded lines of the output, without their
+        line ending ("\\n" or "\\r\\n").
+
+        Only one chunk of the output is held in memory at a time.
+        """
+        decoder = codecs.getincrementaldecoder(encoding)(errors)
+        pending = ""
+        for chunk in self.iter_chunks():
+            pending += decoder.decode(chunk)
+            lines = pending.split("\n")
+            pending = lines.pop()
+            for line in lines:
+                yield _strip_cr(line)
+
+        pending += decoder.decode(b"", final=True)
+        if pending:
+            yield _strip_cr(pending)
+
+
+@attributes
+class CapturedResponse:
+    """ Response of a command whose output was captured in OutputCapture
+    instances.
+
+    stdout and stderr are decoded on access: use stdout_capture and
+    stderr_capture directly to avoid holding the whole output in memory.
+    """
+    stdout_capture = attr()
+    stderr_capture = attr()
+    returncode = attr()
+    encoding = attr(default="utf-8")
+
+    @property
+    def stdout(self):
+        return self.stdout_capture.text(self.encoding)
+
+    @property
+    def stderr(self):
+        return self.stderr_capture.text(self.encoding)
+
+    @property
+    def stdout_bytes(self):
+        return self.stdout_capture.getvalue()
+
+    @property
+    def stderr_bytes(self):
+        return self.stderr_capture.getvalue()
+
+    def iter_stdout_lines(self):
+        return self.stdout_capture.iter_lines(self.encoding)
+
+    def iter_stderr_lines(self):
+        return self.stderr_capture.iter_lines(self.encoding)
+
+    def close(self):
+        """ Release the memory or temporary files of the output.
+        """
+        self.stdout_capture.close()
+        self.stderr_capture.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a, **kw):
+        self.close()
+
+
+def _strip_cr(line):
+    if line.endswith("\r"):
+        return line[:-1]
+    return line
@@ -0,0 +1,93 @@
+""" Compression of requests and command output.
+
+Two independent mechanisms:
+
+* HTTP compression: request bodies are sent gzipped (Content-Encoding) when
+  large enough, and gzipped responses are accepted. This needs a server, or
+  a proxy in front of it, handling Content-Encoding.
+* Output compression: the command runs under a PowerShell wrapper gzipping
+  its stdout, which is decompressed on the fly as it is received. This works
+  with any WinRM server, and mostly pays off for large text output, whose
+  base64 encoding in the SOAP envelopes costs a third more.
+"""
+import zlib
+
+from .errors import AIOWinRMException
+from .utils import powershell_command, quote_powershell
+
+
+# wbits of zlib for the gzip format
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Largest chunk of output yielded per call of OutputDecompressor.decompress,
+# so that small compressed chunks cannot expand to huge buffers.
+MAX_DECOMPRESSED_CHUNK = 1024 ** 2
+
+_GZIP_OUTPUT_SCRIPT = """\
+$ErrorActionPreference = 'Stop'
+$command = {command}
+$psi = New-Object Diagnostics.ProcessStartInfo('cmd.exe', '/c ' + $command)
+$psi.UseShellExecute = $false
+$psi.RedirectStandardOutput = $true
+$p = [Diagnostics.Process]::Start($psi)
+$gz = New-Object IO.Compression.GZipStream(
+    [Console]::OpenStandardOutput(), [IO.Compression.CompressionMode]::Compress
+)
+$p.StandardOutput.BaseStream.CopyTo($gz)
+$gz.Close()
+$p.WaitForExit()
+exit $p.ExitCode
+"""
+
+
+def compress_payload(payload, level=6):
+    """ Return payload compressed in the gzip format.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(payload) + compressor.flush()
+
+
+def gzip_command(command, args=()):
+    """ Return the (command, args) running command through cmd.exe, with its
+    stdout gzipped.
+
+    stderr and the exit code of the command are passed through unchanged.
+    """
+    command_line = " ".join((command,) + tuple(args))
+    return powershell_command(
+        _GZIP_OUTPUT_SCRIPT.format(command=quote_powershell(command_line))
+    )
+
+
+class OutputDecompressor(object):
+    """ Incremental decompressor of the stdout of a gzip_command.
+    """
+    def __init__(self, max_chunk=MAX_DECOMPRESSED_CHUNK):
+        self.max_chunk = max_chunk
+        self._decompressor = zlib.decompressobj(GZIP_WBITS)
+        self._received = False
+
+    def decompress(self, data):
+        """ Yield the output decompressed from data, in chunks of at most
+        max_chunk bytes.
+        """
+        decompressor = self._decompressor
+        if data:
+            self._received = True
+        while data:
+            chunk = decompressor.decompress(data, self.max_chunk)
+            data = decompressor.unconsumed_tail
+            if chunk:
+                yield chunk
+
+    def flush(self):
+        """ Return the remaining output, once the compressed stream is over.
+
+        Raises an AIOWinRMException if the stream is truncated, e.g. because
+        the wrapper was killed. A stream without any data is taken as empty
+        output.
+        """
+        chunk = self._decompressor.flush()
+        if self._received and not self._decompressor.eof:
+            raise AIOWinRMException("Truncated compressed output")
+        return chunk
@@ -4,3 +4,41 @@ import enum
 class TranportKind(enum.Enum):
     http = 1
     ssl = 2
+
+
+# Default MaxEnvelopeSizekb of WinRM servers since Windows Server 2008 R2,
+# in bytes.
+DEFAULT_MAX_ENVELOPE_SIZE = 150 * 1024
+
+# Default MaxEnvelopeSizekb of WinRM servers since Windows Server 2012, and
+# the largest envelope size adaptive tuning asks for by default.
+MAX_ADAPTIVE_ENVELOPE_SIZE = 500 * 1024
+
+# Room left in an envelope for the SOAP headers and body structure.
+ENVELOPE_OVERHEAD = 2 * 1024
+
+# Default MaxProcessesPerShell of WinRM servers since Windows Server 2012.
+DEFAULT_MAX_COMMANDS_PER_SHELL = 25
+
+# OperationTimeout of requests, in seconds, unless given otherwise.
+DEFAULT_OPERATION_TIMEOUT = 60
+
+# Bytes of output of a captured stream kept in memory before spilling to a
+# temporary file.
+DEFAULT_CAPTURE_MEMORY = 8 * 1024 ** 2
+
+# WINRS_CODEPAGE asked for when creating shells, i.e. the encoding of the
+# output of commands: UTF-8.
+DEFAULT_CODEPAGE = 65001
+
+# Request bodies smaller than this are sent uncompressed when HTTP
+# compression is enabled: a SOAP envelope without stdin data barely shrinks.
+HTTP_COMPRESSION_THRESHOLD = 4 * 1024
+
+# Payloads an Offloader processes inline rather than in its executor, in
+# bytes.
+DEFAULT_OFFLOAD_THRESHOLD = 64 * 1024
+
+# Seconds host name resolutions are cached for by fan-outs, long enough for
+# hosts not to be resolved again every time a connection is opened.
+DEFAULT_DNS_TTL = 300
@@ -1,114 +1,672 @@
-import lxml.etree as etree
-
-from .constants import TranportKind
-from .errors import AIOWinRMException
-from .soap.protocol import (
-    create_shell_payload, close_shell_payload, parse_create_shell_response,
-    create_command, parse_create_command_response, cleanup_command,
-    command_output, parse_command_output
+import asyncio
+import codecs
+import collections
+import itertools
+
+from .capture import CapturedResponse, OutputCapture
+from .compression import OutputDecompressor, compress_payload, gzip_command
+from .constants import (
+    DEFAULT_CAPTURE_MEMORY, DEFAULT_CODEPAGE, DEFAULT_MAX_COMMANDS_PER_SHELL,
+    ENVELOPE_OVERHEAD, HTTP_COMPRESSION_THRESHOLD, TranportKind
+)
+from .response import Response
+from .sansio import (
+    COMMAND_OPTIONS, CommandProtocol, ShellProtocol, protocol_property
 )
+from .tracing import NULL_TRACER
 from .utils import parse_host
 
 
 class ShellContext(object):
-    def __init__(self, session, host, env=None, cwd=None):
+    """ Async context manager for a remote shell.
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        Session used for every request.
+    host : str
+        Host, as accepted by parse_host.
+    env : dict or None
+        Key/value pairs for the running environment
+    cwd : str or None
+        Current directory in the created shell
+    max_envelope_size : int or None
+        MaxEnvelopeSize, in bytes, asked for when receiving output of the
+        commands created through from_shell_context. If None, the server
+        default is used.
+    operation_timeout : float or None
+        OperationTimeout, in seconds, of Receive requests.
+    adaptive_envelope_size : bool
+        If True, commands grow the envelope size while the output fills the
+        envelopes, starting from max_envelope_size.
+    pipeline_depth : int
+        Number of Receive requests kept in flight by the commands created
+        through from_shell_context. Values above 1 hide the network latency
+        for commands with a lot of output, at the cost of one connection per
+        outstanding request.
+    max_commands : int or None
+        Maximum number of commands created through from_shell_context
+        running at once in this shell. Further commands wait for a slot, so
+        that the shell stays under the MaxProcessesPerShell quota of the
+        server. If None, the number is not limited.
+    codepage : int
+        WINRS_CODEPAGE of the shell, which gives the encoding of the output
+        of its commands.
+    tracer : aiowinrm.tracing.Tracer or None
+        Tracer of every request of the shell and of the commands created
+        through from_shell_context. If None, requests are not traced.
+    http_compression : bool
+        If True, large request bodies of the shell and of its commands are
+        sent gzipped, which the server (or a proxy in front of it) must
+        accept. Not supported with an EncryptedSession.
+    compress_output : bool
+        If True, commands created through from_shell_context run under
+        PowerShell, which gzips their stdout, decompressed as it arrives.
+        Worth it for large text output over slow links.
+    offloader : aiowinrm.offload.Offloader or None
+        If given, large Receive responses and Send requests of the commands
+        created through from_shell_context are parsed and serialized in its
+        executor, off the event loop.
+    """
+    def __init__(self, session, host, env=None, cwd=None,
+                 max_envelope_size=None, operation_timeout=None,
+                 adaptive_envelope_size=False, pipeline_depth=1,
+                 max_commands=DEFAULT_MAX_COMMANDS_PER_SHELL,
+                 codepage=DEFAULT_CODEPAGE, tracer=None,
+                 http_compression=False, compress_output=False,
+                 offloader=None):
         self._session = session
+        self.tracer = NULL_TRACER if tracer is None else tracer
+        self.http_compression = http_compression
+        self.compress_output = compress_output
+        self.offloader = offloader
 
         self.host = parse_host(host, transport=TranportKind.http)
 
-        self.env = env
-        self.cwd = cwd
+        self.max_commands = max_commands
+        if max_commands is None:
+            self._command_slots = None
+        else:
+            self._command_slots = asyncio.Semaphore(max_commands)
 
-        self.shell_id = None
+        self.protocol = ShellProtocol(
+            env, cwd, max_envelope_size, operation_timeout,
+            adaptive_envelope_size, pipeline_depth, codepage
+        )
 
-    async def __aenter__(self):
-        payload = etree.tostring(create_shell_payload(self.env, self.cwd))
+    env = protocol_property("env")
+    cwd = protocol_property("cwd")
+    max_envelope_size = protocol_property("max_envelope_size")
+    operation_timeout = protocol_property("operation_timeout")
+    adaptive_envelope_size = protocol_property("adaptive_envelope_size")
+    pipeline_depth = protocol_property("pipeline_depth")
+    codepage = protocol_property("codepage")
+    encoding = protocol_property("encoding")
+    shell_id = protocol_property("shell_id")
 
-        resp = await _make_winrm_request(
-            self._session, self.host, payload
+    async def __aenter__(self):
+        status, data = await _post(
+            self._session, self.host, self.protocol.create_request(),
+            self.tracer, self.http_compression
         )
-        if resp.status != 200:
-            await resp.release()
-            raise AIOWinRMException(
-                "Unhandled http error {}".format(resp.status)
-            )
-
-        try:
-            data = await resp.text()
-            self.shell_id = parse_create_shell_response(data)
-            return self
-        finally:
-            await resp.release()
+        self.protocol.create_response(status, data)
+        return self
 
     async def __aexit__(self, *a, **kw):
         if self.shell_id is None:
             raise RuntimeError("__aexit__ called without __aenter__")
 
-        payload = etree.tostring(close_shell_payload(self.shell_id))
-        resp = await _make_winrm_request(self._session, self.host, payload)
-        await resp.release()
+        status, data = await _post(
+            self._session, self.host, self.protocol.close_request(),
+            self.tracer, self.http_compression
+        )
+        self.protocol.close_response(status, data)
+
+    async def is_alive(self):
+        """ Return True if the server still knows about this shell.
+        """
+        if self.shell_id is None:
+            return False
 
+        status, data = await _post(
+            self._session, self.host, self.protocol.get_request(),
+            self.tracer, self.http_compression
+        )
+        return self.protocol.get_response(status, data)
 
-class CommandContext(object):
-    def __init__(self, session, host, shell_id, command, args=()):
-        self._session = session
+    async def run(self, command, args=()):
+        """ Run a command in this shell, and return its Response.
 
-        self.host = parse_host(host, transport=TranportKind.http)
-        self.command = command
-        self.args = args
+        Output is kept as bytes, and decoded with the encoding of the shell
+        when accessed.
+        """
+        output = {"stdout": bytearray(), "stderr": bytearray()}
 
-        self.shell_id = shell_id
-        self.command_id = None
+        async with CommandContext.from_shell_context(
+            self, command, args
+        ) as command_context:
+            async for stream, chunk in command_context.stream():
+                output[stream] += chunk
 
-    async def __aenter__(self):
-        payload = etree.tostring(
-            create_command(self.shell_id, self.command, self.args)
+        return Response(
+            output["stdout"], output["stderr"], command_context.return_code,
+            self.encoding
         )
 
-        resp = await _make_winrm_request(self._session, self.host, payload)
-        if resp.status != 200:
-            await resp.release()
-            raise AIOWinRMException(
-                "Unhandled http error {}".format(resp.status)
-            )
+    async def capture(self, command, args=(),
+                      max_memory=DEFAULT_CAPTURE_MEMORY):
+        """ Run a command in this shell, keeping at most max_memory bytes of
+        each output stream in memory, and return its CapturedResponse.
+        """
+        stdout = OutputCapture(max_memory)
+        stderr = OutputCapture(max_memory)
+        captures = {"stdout": stdout, "stderr": stderr}
+        try:
+            async with CommandContext.from_shell_context(
+                self, command, args
+            ) as command_context:
+                async for stream, chunk in command_context.stream():
+                    captures[stream].write(chunk)
+        except BaseException:
+            stdout.close()
+            stderr.close()
+            raise
+
+        return CapturedResponse(
+            stdout, stderr, command_context.return_code, self.encoding
+        )
+
+    async def run_many(self, commands, return_exceptions=False):
+        """ Run commands concurrently in this shell.
+
+        Every command gets its own CommandId and Receive loop. At most
+        max_commands of them run at once.
+
+        Parameters
+        ----------
+        commands : iterable
+            Commands to run, each one either a string or a (command, args)
+            pair.
+        return_exceptions : bool
+            As for asyncio.gather: if True, the exception of a failed command
+            is returned in place of its Response. Otherwise, the first
+            exception is raised.
+
+        Returns
+        -------
+        responses : list of Response
+            Responses, in the order of commands.
+        """
+        tasks = []
+        for command in commands:
+            if isinstance(command, str):
+                command, args = command, ()
+            else:
+                command, args = command
+            tasks.append(asyncio.ensure_future(self.run(command, args)))
 
         try:
-            data = await resp.text()
-            self.command_id = parse_create_command_response(data)
-            return self
+            return await asyncio.gather(
+                *tasks, return_exceptions=return_exceptions
+            )
         finally:
-            await resp.release()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class CommandContext(object):
+    """ Async context manager for a command in a remote shell.
+
+    See ShellContext for most parameters. With compress_output, the command
+    actually created is the PowerShell wrapper of
+    aiowinrm.compression.gzip_command, and stream() decompresses stdout.
+    If protocol is given, it is the CommandProtocol of the command, e.g. as
+    created by ShellProtocol.command, and the protocol settings are taken
+    from it.
+    """
+    @classmethod
+    def from_shell_context(cls, shell_context, command, args=(), **kw):
+        """ Create a command in the given shell, with the shell's envelope
+        size and timeout settings.
+        """
+        protocol_kw = dict(
+            (name, kw.pop(name)) for name in COMMAND_OPTIONS if name in kw
+        )
+        kw.setdefault("slots", shell_context._command_slots)
+        kw.setdefault("tracer", shell_context.tracer)
+        kw.setdefault("http_compression", shell_context.http_compression)
+        kw.setdefault("compress_output", shell_context.compress_output)
+        kw.setdefault("offloader", shell_context.offloader)
+        if kw["compress_output"]:
+            command, args = gzip_command(command, args)
+        protocol = shell_context.protocol.command(command, args, **protocol_kw)
+        return cls(
+            shell_context._session, shell_context.host, protocol.shell_id,
+            protocol.command, protocol.args, protocol=protocol, **kw
+        )
+
+    def __init__(self, session, host, shell_id, command, args=(),
+                 max_envelope_size=None, operation_timeout=None,
+                 adaptive_envelope_size=False, console_mode_stdin=True,
+                 pipeline_depth=1, slots=None, tracer=None,
+                 http_compression=False, compress_output=False,
+                 offloader=None, protocol=None):
+        self._session = session
+        self.tracer = NULL_TRACER if tracer is None else tracer
+        self.http_compression = http_compression
+        self.compress_output = compress_output
+        self.offloader = offloader
+        # Semaphore held from the creation to the cleanup of the command
+        self._slots = slots
+
+        self.host = parse_host(host, transport=TranportKind.http)
+
+        if protocol is None:
+            if compress_output:
+                command, args = gzip_command(command, args)
+            protocol = CommandProtocol(
+                shell_id, command, args, max_envelope_size,
+                operation_timeout, adaptive_envelope_size,
+                console_mode_stdin, pipeline_depth
+            )
+        self.protocol = protocol
+
+    command = protocol_property("command")
+    args = protocol_property("args")
+    max_envelope_size = protocol_property("max_envelope_size")
+    operation_timeout = protocol_property("operation_timeout")
+    console_mode_stdin = protocol_property("console_mode_stdin")
+    pipeline_depth = protocol_property("pipeline_depth")
+    shell_id = protocol_property("shell_id")
+    command_id = protocol_property("command_id")
+    return_code = protocol_property("return_code")
+    is_done = protocol_property("is_done")
+    poll_stats = protocol_property("poll_stats")
+
+    async def __aenter__(self):
+        if self._slots is not None:
+            await self._slots.acquire()
+        try:
+            status, data = await _post(
+                self._session, self.host, self.protocol.create_request(),
+                self.tracer, self.http_compression
+            )
+            self.protocol.create_response(status, data)
+        except BaseException:
+            if self._slots is not None:
+                self._slots.release()
+            raise
+        return self
 
     async def __aexit__(self, *a, **kw):
         if self.command_id is None:
             raise RuntimeError("__aexit__ called without __aenter__")
 
-        payload = etree.tostring(cleanup_command(self.shell_id, self.command_id))
-        resp = await _make_winrm_request(self._session, self.host, payload)
-        await resp.release()
+        try:
+            status, data = await _post(
+                self._session, self.host, self.protocol.cleanup_request(),
+                self.tracer, self.http_compression
+            )
+            self.protocol.cleanup_response(status, data)
+        finally:
+            if self._slots is not None:
+                self._slots.release()
 
     async def _output_request(self):
-        payload = etree.tostring(command_output(self.shell_id, self.command_id))
-        resp = await _make_winrm_request(self._session, self.host, payload)
+        await self._receive()
+        stdout, stderr, return_code, is_done = self.protocol.receive_result()
+        return bytes(stdout), bytes(stderr), return_code, is_done
+
+    async def _receive(self, sequence_id=None):
+        """ Send a Receive request, and feed its response to the protocol.
+        """
+        protocol = self.protocol
+        for retry in itertools.count():
+            payload = protocol.receive_request(sequence_id)
+            span = self.tracer.start_request(self.host, payload, retry)
+            try:
+                status, size, error_body = await self._receive_once(
+                    payload, sequence_id
+                )
+            except BaseException as e:
+                span.finish(error=e)
+                raise
+            span.finish(status, size)
+
+            if error_body is None:
+                return
+            # Raises unless the request should be sent again
+            protocol.receive_failed(status, error_body, sequence_id)
+
+    async def _receive_once(self, payload, sequence_id):
+        """ Send a Receive request, and feed its response to the protocol if
+        successful.
+
+        Returns
+        -------
+        status : int
+        size : int
+            Size of the response body.
+        error_body : bytes or None
+            Body of the response if unsuccessful.
+        """
+        resp = await _make_winrm_request(
+            self._session, self.host, payload, self.http_compression
+        )
         try:
             if resp.status != 200:
-                raise AIOWinRMException(
-                    "Unhandled http error {}".format(resp.status)
-                )
+                body = await resp.read()
+                return resp.status, len(body), body
 
-            data = await resp.text()
-            stdout, stderr, return_code, is_done = parse_command_output(data)
-            return (
-                stdout.decode("utf8"), stderr.decode("utf8"), return_code, is_done
-            )
+            if self.offloader is not None:
+                body = await resp.read()
+                output = await self.offloader.parse_command_output(body)
+                self.protocol.receive_parsed(output, len(body), sequence_id)
+                return resp.status, len(body), None
+
+            size = 0
+            async for data in resp.content.iter_any():
+                size += len(data)
+                self.protocol.receive_feed(data, sequence_id)
+            return resp.status, size, None
         finally:
             await resp.release()
 
+    async def _serial_output(self):
+        protocol = self.protocol
+        while not self.is_done:
+            delay = protocol.poll_delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield await self._output_request()
+
+    async def _pipelined_output(self):
+        """ Keep pipeline_depth Receive requests in flight, and yield their
+        results in sequence order.
+        """
+        protocol = self.protocol
+        sequence_ids = itertools.count()
+        pending = collections.deque()
+        try:
+            while not self.is_done:
+                while len(pending) < protocol.pipeline_depth:
+                    sequence_id = next(sequence_ids)
+                    pending.append((
+                        sequence_id,
+                        asyncio.ensure_future(self._receive(sequence_id)),
+                    ))
+
+                sequence_id, task = pending.popleft()
+                await task
+                stdout, stderr, return_code, is_done = \
+                    protocol.receive_result(sequence_id)
+                yield bytes(stdout), bytes(stderr), return_code, is_done
+        finally:
+            # Requests sent past the end of the command are not needed, and
+            # may fail once the command is done.
+            for sequence_id, task in pending:
+                task.cancel()
+                protocol.receive_discard(sequence_id)
+            await asyncio.gather(
+                *(task for _, task in pending), return_exceptions=True
+            )
+
+    async def send_stdin(self, source):
+        """ Send data to the command stdin, and close it.
+
+        The data is split in chunks as large as the envelope size allows.
+        The next chunk is read from source while the previous one is being
+        sent, and only one Send request is in flight at a time so that
+        chunks reach the process in order. Run this concurrently with
+        stream() to overlap Send and Receive requests.
+
+        Parameters
+        ----------
+        source : bytes-like, iterable or async iterable of bytes-like
+            Data to send.
+        """
+        chunk_size = _stdin_chunk_size(self.protocol.send_envelope_size)
+
+        pending = None
+        previous = None
+        try:
+            async for chunk in _rechunk(source, chunk_size):
+                if previous is not None:
+                    if pending is not None:
+                        await pending
+                    pending = asyncio.ensure_future(
+                        self._send_request(previous)
+                    )
+                previous = chunk
+
+            if pending is not None:
+                await pending
+            pending = None
+            await self._send_request(
+                b"" if previous is None else previous, end=True
+            )
+        finally:
+            if pending is not None and not pending.done():
+                pending.cancel()
+
+    async def _send_request(self, data, end=False):
+        if self.offloader is None:
+            payload = self.protocol.send_request(data, end)
+        else:
+            payload = await self.offloader.send_payload(
+                self.shell_id, self.command_id, data, end
+            )
+        status, body = await _post(
+            self._session, self.host, payload, self.tracer,
+            self.http_compression
+        )
+        self.protocol.send_response(status, body)
+
+    async def stream_with_stdin(self, source, encoding=None,
+                                errors="strict"):
+        """ Asynchronously iterate over the command output as stream()
+        does, while sending source to its stdin as send_stdin() does.
+
+        If sending fails, the iteration stops and the error is raised right
+        away: the command would otherwise wait for its input, and Receive
+        requests keep polling forever. Leaving the CommandContext then
+        terminates the command. If the command ends before reading all its
+        input, sending is cancelled.
+        """
+        send_task = asyncio.ensure_future(self.send_stdin(source))
+        output = self.stream(encoding, errors)
+        next_chunk = None
+        try:
+            while True:
+                next_chunk = asyncio.ensure_future(_anext(output))
+                if not send_task.done():
+                    await asyncio.wait(
+                        (next_chunk, send_task),
+                        return_when=asyncio.FIRST_COMPLETED
+                    )
+                if not next_chunk.done() and (
+                    send_task.cancelled()
+                    or send_task.exception() is not None
+                ):
+                    # Raises the error of the send
+                    send_task.result()
+                try:
+                    chunk = await next_chunk
+                except StopAsyncIteration:
+                    # The task holds the exception, whose traceback holds
+                    # this frame and source: break the cycle so that source
+                    # is freed right away.
+                    next_chunk = None
+                    break
+                next_chunk = None
+                yield chunk
+
+            if send_task.done():
+                send_task.result()
+        finally:
+            pending = [
+                task for task in (next_chunk, send_task)
+                if task is not None and not task.done()
+            ]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            await output.aclose()
+
+    async def stream(self, encoding=None, errors="strict"):
+        """ Asynchronously iterate over the command output as it arrives.
 
-def _make_winrm_request(session, url, payload):
+        A new Receive request is only sent once every chunk of the previous
+        response has been consumed, so a slow consumer throttles the
+        requests sent to the server. With a pipeline_depth above 1, up to
+        pipeline_depth requests are sent ahead, and their chunks are yielded
+        in order. Once the iteration is over, return_code is set.
+
+        Parameters
+        ----------
+        encoding : str or None
+            If None, chunks are bytes. Otherwise, chunks are decoded with an
+            incremental decoder per stream, so that multi-byte characters
+            split across responses are decoded correctly.
+        errors : str
+            Error handling scheme of the decoder.
+
+        Yields
+        ------
+        stream : str
+            Name of the stream, either "stdout" or "stderr".
+        chunk : bytes or str
+            Output data.
+        """
+        if encoding is None:
+            decoders = None
+        else:
+            decoder_factory = codecs.getincrementaldecoder(encoding)
+            decoders = {
+                "stdout": decoder_factory(errors),
+                "stderr": decoder_factory(errors),
+            }
+
+        if self.compress_output:
+            decompressor = OutputDecompressor()
+        else:
+            decompressor = None
+
+        if self.pipeline_depth > 1:
+            results = self._pipelined_output()
+        else:
+            results = self._serial_output()
+
+        try:
+            async for stdout, stderr, _, _ in results:
+                if decompressor is None:
+                    stdout_chunks = (stdout,)
+                else:
+                    stdout_chunks = decompressor.decompress(stdout)
+                for name, chunks in (
+                    ("stdout", stdout_chunks), ("stderr", (stderr,))
+                ):
+                    for chunk in chunks:
+                        if decoders is not None:
+                            chunk = decoders[name].decode(chunk)
+                        if chunk:
+                            yield name, chunk
+        finally:
+            await results.aclose()
+
+        if decompressor is not None:
+            chunk = decompressor.flush()
+            if decoders is not None:
+                chunk = decoders["stdout"].decode(chunk)
+            if chunk:
+                yield "stdout", chunk
+
+        if decoders is not None:
+            for name, decoder in decoders.items():
+                chunk = decoder.decode(b"", final=True)
+                if chunk:
+                    yield name, chunk
+
+
+def _stdin_chunk_size(max_envelope_size):
+    # Raw bytes per Send envelope, after base64 encoding
+    return (max_envelope_size - ENVELOPE_OVERHEAD) // 4 * 3
+
+
+async def _rechunk(source, chunk_size):
+    """ Yield chunk_size long memoryviews out of source, the last one
+    possibly shorter.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+        return
+
+    if not hasattr(source, "__aiter__"):
+        source = _aiter(source)
+
+    buf = bytearray()
+    async for data in source:
+        buf += data
+        if len(buf) >= chunk_size:
+            view = memoryview(buf)
+            full = len(buf) - len(buf) % chunk_size
+            for start in range(0, full, chunk_size):
+                yield bytes(view[start:start + chunk_size])
+            view.release()
+            del buf[:full]
+    if buf:
+        yield bytes(buf)
+
+
+async def _anext(iterator):
+    return await iterator.__anext__()
+
+
+async def _aiter(iterable):
+    for item in iterable:
+        yield item
+
+
+def _make_winrm_request(session, url, payload, compress=False):
+    """ Send payload to url.
+
+    session is an aiohttp.ClientSession, or an
+    aiowinrm.encryption.EncryptedSession, which replaces the headers by the
+    ones of encrypted messages and decrypts the response (and cannot be
+    combined with compress).
+
+    If compress is True, payloads of at least HTTP_COMPRESSION_THRESHOLD
+    bytes are sent gzipped, and compressed responses are asked for. These
+    are decompressed by aiohttp as they are read.
+    """
     headers = {
         'Content-Type': 'application/soap+xml; charset=utf-8',
-        'Content-Length': str(len(payload)),
     }
+    if compress:
+        headers['Accept-Encoding'] = 'gzip, deflate'
+        if len(payload) >= HTTP_COMPRESSION_THRESHOLD:
+            payload = compress_payload(payload)
+            headers['Content-Encoding'] = 'gzip'
+    headers['Content-Length'] = str(len(payload))
 
     return session.post(url, data=payload, headers=headers)
+
+
+async def _post(session, url, payload, tracer=NULL_TRACER, compress=False):
+    """ Send a WinRM request, and return its status and body.
+    """
+    span = tracer.start_request(url, payload)
+    try:
+        resp = await _make_winrm_request(session, url, payload, compress)
+        try:
+            status, body = resp.status, await resp.read()
+        finally:
+            await resp.release()
+    except BaseException as e:
+        span.finish(error=e)
+        raise
+    span.finish(status, len(body))
+    return status, body
@@ -0,0 +1,373 @@
+""" Message level encryption of WinRM over HTTP (NTLM or Kerberos sealing).
+
+Over plain HTTP, WinRM servers usually require SOAP envelopes to be
+encrypted with the security context established by the Negotiate
+authentication. Every envelope is then sent as a multipart/encrypted body:
+
+    --Encrypted Boundary
+        Content-Type: application/HTTP-SPNEGO-session-encrypted
+        OriginalContent: type=application/soap+xml;charset=UTF-8;Length=N
+    --Encrypted Boundary
+        Content-Type: application/octet-stream
+    <signature length, 4 bytes LE><signature><encrypted envelope>
+    --Encrypted Boundary--
+
+(the closing boundary immediately follows the encrypted envelope).
+
+The security context belongs to the TCP connection it was established on:
+EncryptedSession keeps a small pool of connections per host, each with its
+own context, so that the handshake only happens when a connection is opened.
+
+Authentication uses the pyspnego package, which is only imported when an
+EncryptedSession is created without a context_factory.
+"""
+import asyncio
+import base64
+import collections
+import functools
+import re
+import struct
+import urllib.parse
+
+import aiohttp
+
+from .errors import AIOWinRMException, AuthenticationError
+
+
+PROTOCOL_SPNEGO = "application/HTTP-SPNEGO-session-encrypted"
+
+BOUNDARY = "Encrypted Boundary"
+
+CONTENT_TYPE = 'multipart/encrypted;protocol="{}";boundary="{}"'.format(
+    PROTOCOL_SPNEGO, BOUNDARY
+)
+
+_PREFIX = (
+    "--{boundary}\r\n"
+    "\tContent-Type: {protocol}\r\n"
+    "\tOriginalContent: type=application/soap+xml;charset=UTF-8;"
+    "Length={length}\r\n"
+    "--{boundary}\r\n"
+    "\tContent-Type: application/octet-stream\r\n"
+)
+
+_SUFFIX = "--{}--\r\n".format(BOUNDARY).encode("ascii")
+
+_DATA_START = b"\tContent-Type: application/octet-stream\r\n"
+
+_R_ORIGINAL_LENGTH = re.compile(rb"OriginalContent:[^\r\n]*Length=(\d+)")
+
+_SIGNATURE_LENGTH = struct.Struct("<I")
+
+
+def wrap_message(context, payload):
+    """ Encrypt a SOAP envelope into a multipart/encrypted body.
+
+    Parameters
+    ----------
+    context : object
+        Established security context, with a pyspnego-like
+        wrap_winrm(data) method.
+    payload : bytes
+        SOAP envelope.
+
+    Returns
+    -------
+    body : bytes
+        Body of the request, to be sent with CONTENT_TYPE.
+    """
+    wrapped = context.wrap_winrm(payload)
+    prefix = _PREFIX.format(
+        boundary=BOUNDARY, protocol=PROTOCOL_SPNEGO, length=len(payload)
+    ).encode("ascii")
+    # Single copy of the encrypted envelope
+    return b"".join((
+        prefix, _SIGNATURE_LENGTH.pack(len(wrapped.header)), wrapped.header,
+        wrapped.data, _SUFFIX,
+    ))
+
+
+def unwrap_message(context, body):
+    """ Decrypt a multipart/encrypted body into its SOAP envelope.
+    """
+    view = memoryview(body)
+
+    start = body.find(_DATA_START)
+    end = body.rfind(_SUFFIX)
+    match = _R_ORIGINAL_LENGTH.search(body, 0, max(start, 0))
+    if start < 0 or end < 0 or match is None:
+        raise AIOWinRMException("Malformed encrypted message")
+    start += len(_DATA_START)
+
+    signature_length, = _SIGNATURE_LENGTH.unpack_from(body, start)
+    start += _SIGNATURE_LENGTH.size
+    signature = bytes(view[start:start + signature_length])
+    data = bytes(view[start + signature_length:end])
+
+    payload = context.unwrap_winrm(signature, data)
+    if len(payload) != int(match.group(1)):
+        raise AIOWinRMException(
+            "Encrypted message length mismatch: expected {}, got {}".format(
+                int(match.group(1)), len(payload)
+            )
+        )
+    return payload
+
+
+def spnego_context(hostname, username=None, password=None,
+                   protocol="negotiate", service="WSMAN"):
+    """ Create a pyspnego client context for the given host.
+
+    protocol is one of "negotiate", "ntlm" or "kerberos". Without username
+    and password, the credentials of the current user are used (Kerberos
+    ticket cache, or the logon session on Windows).
+    """
+    try:
+        import spnego
+    except ImportError:
+        raise ImportError(
+            "Message encryption requires the pyspnego package"
+        )
+    return spnego.client(
+        username, password, hostname=hostname, service=service,
+        protocol=protocol
+    )
+
+
+class EncryptedSession(object):
+    """ HTTP session encrypting every WinRM message, to be used in place of
+    aiohttp.ClientSession by ShellContext, CommandContext, RunspacePool...
+
+    Parameters
+    ----------
+    username, password : str or None
+        Credentials, see spnego_context.
+    protocol : str
+        "negotiate", "ntlm" or "kerberos".
+    service : str
+        Service of the Kerberos SPN of the hosts, i.e. WSMAN/<host>.
+    max_connections_per_host : int
+        Maximum number of connections, hence of requests in flight, to a
+        single host.
+    context_factory : callable or None
+        Called with the host name of a new connection, returns a security
+        context with pyspnego's step, complete, wrap_winrm and
+        unwrap_winrm. Defaults to spnego_context with the given credentials.
+
+    Example
+    -------
+    >>> async with EncryptedSession("DOMAIN\\\\user", "password") as session:
+    ...     async with ShellContext(session, host) as shell_context:
+    ...         response = await shell_context.run("ipconfig")
+    """
+    def __init__(self, username=None, password=None, protocol="negotiate",
+                 service="WSMAN", max_connections_per_host=4,
+                 context_factory=None):
+        if context_factory is None:
+            context_factory = functools.partial(
+                spnego_context, username=username, password=password,
+                protocol=protocol, service=service
+            )
+        self._context_factory = context_factory
+        self.max_connections_per_host = max_connections_per_host
+
+        # host -> _ChannelPool
+        self._pools = collections.defaultdict(
+            lambda: _ChannelPool(max_connections_per_host)
+        )
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *a, **kw):
+        await self.close()
+
+    async def close(self):
+        self.closed = True
+        pools = list(self._pools.values())
+        self._pools.clear()
+        for pool in pools:
+            await pool.close()
+
+    def post(self, url, data, headers=None):
+        """ Send data encrypted to url, with the same calling convention as
+        aiohttp.ClientSession.post in aiowinrm.core. headers are ignored:
+        the ones of encrypted messages are used.
+
+        Raises ValueError for compressed requests (http_compression), whose
+        Content-Encoding would be lost: the server would read gzip data as
+        the SOAP message.
+        """
+        if headers and any(
+            name in headers
+            for name in ("Accept-Encoding", "Content-Encoding")
+        ):
+            raise ValueError(
+                "http_compression is not supported with EncryptedSession"
+            )
+        return self._post(url, data)
+
+    async def _post(self, url, data):
+        if self.closed:
+            raise RuntimeError("Session is closed")
+
+        parsed = urllib.parse.urlsplit(url)
+        pool = self._pools[parsed.netloc]
+        channel = await pool.acquire(
+            lambda: _Channel(self._context_factory, parsed.hostname)
+        )
+        try:
+            status, body = await channel.post(url, data)
+        except BaseException:
+            await pool.discard(channel)
+            raise
+        pool.release(channel)
+        return _Response(status, body)
+
+
+class _ChannelPool(object):
+    def __init__(self, max_channels):
+        self._idle = []
+        self._slots = asyncio.Semaphore(max_channels)
+
+    async def acquire(self, channel_factory):
+        await self._slots.acquire()
+        if self._idle:
+            return self._idle.pop()
+        return channel_factory()
+
+    def release(self, channel):
+        self._idle.append(channel)
+        self._slots.release()
+
+    async def discard(self, channel):
+        self._slots.release()
+        await channel.close()
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for channel in idle:
+            await channel.close()
+
+
+class _Channel(object):
+    """ One connection, and its security context.
+    """
+    def __init__(self, context_factory, hostname):
+        self._context_factory = context_factory
+        self._hostname = hostname
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=1)
+        )
+        self.context = None
+
+    async def close(self):
+        await self._session.close()
+
+    async def post(self, url, payload):
+        if self.context is None:
+            await self._authenticate(url)
+
+        status, body, content_type = await self._send(url, payload)
+        if status == 401:
+            # The connection was closed, and its security context lost
+            await self._authenticate(url)
+            status, body, content_type = await self._send(url, payload)
+
+        if content_type.startswith("multipart/encrypted"):
+            body = unwrap_message(self.context, body)
+        elif status == 200:
+            # Trusting it would silently downgrade the session to plaintext
+            raise AIOWinRMException(
+                "Unencrypted response from {} (Content-Type {!r})".format(
+                    url, content_type
+                )
+            )
+        return status, body
+
+    async def _send(self, url, payload):
+        body = wrap_message(self.context, payload)
+        headers = {
+            "Content-Type": CONTENT_TYPE,
+            "Content-Length": str(len(body)),
+        }
+        async with self._session.post(
+            url, data=body, headers=headers
+        ) as resp:
+            return (
+                resp.status, await resp.read(),
+                resp.headers.get("Content-Type", "")
+            )
+
+    async def _authenticate(self, url):
+        """ Run the Negotiate handshake on this connection, with empty
+        messages.
+        """
+        self.context = None
+        context = self._context_factory(self._hostname)
+        token = context.step()
+        while True:
+            headers = {
+                "Authorization": "Negotiate {}".format(
+                    base64.b64encode(token).decode("ascii")
+                ),
+                "Content-Length": "0",
+            }
+            async with self._session.post(
+                url, data=b"", headers=headers
+            ) as resp:
+                status = resp.status
+                server_token = _negotiate_token(
+                    resp.headers.getall("WWW-Authenticate", [])
+                )
+                await resp.read()
+
+            if server_token is not None and not context.complete:
+                token = context.step(server_token)
+            if status == 200:
+                break
+            if status != 401 or server_token is None or token is None:
+                raise AuthenticationError(
+                    "Negotiate authentication to {} failed".format(url),
+                    status
+                )
+
+        if not context.complete:
+            raise AuthenticationError(
+                "Negotiate authentication to {} did not complete".format(
+                    url
+                ),
+                status
+            )
+        self.context = context
+
+
+def _negotiate_token(values):
+    for value in values:
+        scheme, _, token = value.strip().partition(" ")
+        if scheme.lower() == "negotiate" and token:
+            return base64.b64decode(token)
+    return None
+
+
+class _Response(object):
+    """ Decrypted response, with the part of the aiohttp.ClientResponse
+    interface used by aiowinrm.core.
+    """
+    def __init__(self, status, body):
+        self.status = status
+        self._body = body
+
+    @property
+    def content(self):
+        return self
+
+    async def iter_any(self):
+        yield self._body
+
+    async def read(self):
+        return self._body
+
+    async def release(self):
+        pass
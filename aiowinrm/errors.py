@@ -1,2 +1,143 @@
 class AIOWinRMException(Exception):
+    # True if the same request may succeed when sent again later
+    transient = False
+
+
+class TransferError(AIOWinRMException):
     pass
+
+
+class PSRPError(AIOWinRMException):
+    pass
+
+
+class BatchError(AIOWinRMException):
+    """ The output of a batch of commands could not be split per command,
+    see aiowinrm.batch.
+    """
+
+
+class TransportError(AIOWinRMException):
+    """ Unsuccessful HTTP response without a SOAP fault.
+    """
+    def __init__(self, message, status):
+        super(TransportError, self).__init__(message)
+        self.status = status
+
+    def __reduce__(self):
+        return type(self), (str(self), self.status)
+
+    @property
+    def transient(self):
+        return self.status in (502, 503, 504)
+
+
+class AuthenticationError(TransportError):
+    """ The server refused the credentials (HTTP 401).
+    """
+
+
+class CircuitOpenError(AIOWinRMException):
+    """ Requests to a host are refused without being sent, because of its
+    recent failures, see aiowinrm.retry.CircuitBreaker.
+    """
+    def __init__(self, message, host):
+        super(CircuitOpenError, self).__init__(message)
+        self.host = host
+
+    def __reduce__(self):
+        return type(self), (str(self), self.host)
+
+
+class WSManFault(AIOWinRMException):
+    """ SOAP fault returned by the server.
+
+    Attributes
+    ----------
+    status : int
+        HTTP status of the response.
+    code : str
+        Fault code, e.g. "Sender" or "Receiver".
+    subcode : str or None
+        Fault subcode, e.g. "TimedOut". Subclasses of WSManFault exist for
+        the common ones.
+    reason : str or None
+        Human readable description of the fault.
+    wsman_code : int or None
+        Windows error code of the fault.
+    machine : str or None
+        Machine reporting the fault.
+    """
+    def __init__(self, status, code, subcode, reason=None, wsman_code=None,
+                 machine=None):
+        super(WSManFault, self).__init__(
+            "{} fault (HTTP {}, code {}): {}".format(
+                subcode, status, wsman_code, reason
+            )
+        )
+        self.status = status
+        self.code = code
+        self.subcode = subcode
+        self.reason = reason
+        self.wsman_code = wsman_code
+        self.machine = machine
+
+    def __reduce__(self):
+        return type(self), (
+            self.status, self.code, self.subcode, self.reason,
+            self.wsman_code, self.machine
+        )
+
+
+class OperationTimeoutFault(WSManFault):
+    """ The operation did not complete within its OperationTimeout. For
+    Receive requests, this only means there was no output yet.
+    """
+    transient = True
+
+
+class EncodingLimitFault(WSManFault):
+    """ The response would exceed the MaxEnvelopeSize of the request.
+    """
+
+
+class QuotaLimitFault(WSManFault):
+    """ A quota of the server was exceeded, e.g. too many concurrent shells
+    or operations.
+    """
+    transient = True
+
+
+class AccessDeniedFault(WSManFault):
+    pass
+
+
+class InvalidSelectorsFault(WSManFault):
+    """ The server does not know about the shell (or command) the request
+    refers to, e.g. because it timed out.
+    """
+
+
+class InternalErrorFault(WSManFault):
+    transient = True
+
+
+_FAULT_CLASSES = {
+    "TimedOut": OperationTimeoutFault,
+    "EncodingLimit": EncodingLimitFault,
+    "QuotaLimit": QuotaLimitFault,
+    "AccessDenied": AccessDeniedFault,
+    "InvalidSelectors": InvalidSelectorsFault,
+    "InternalError": InternalErrorFault,
+}
+
+
+def wsman_fault(status, fault):
+    """ Return the WSManFault exception for the given
+    aiowinrm.soap.protocol.Fault.
+    """
+    klass = _FAULT_CLASSES.get(fault.subcode, WSManFault)
+    return klass(
+        status, fault.code, fault.subcode, fault.message or fault.reason,
+        fault.wsman_code, fault.machine
+    )
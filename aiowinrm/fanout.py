@@ -0,0 +1,186 @@
+import asyncio
+import collections
+
+import aiohttp
+
+from .constants import DEFAULT_DNS_TTL, TranportKind
+from .core import ShellContext
+from .response import HostResult
+from .retry import call_with_retry
+from .utils import parse_host
+
+
+async def run_cmd_many(hosts, auth, command, args=(), env=None, cwd=None,
+                       limit=100, limit_per_host=1, timeout=None,
+                       session=None, shell_pool=None, tracer=None,
+                       retry_policy=None, circuit_breaker=None, rate=None,
+                       dns_ttl=DEFAULT_DNS_TTL):
+    """ Run the given command on every host, yielding results as they come.
+
+    All hosts share a single connection pool, so the number of sockets is
+    bounded by limit regardless of the number of hosts.
+
+    Parameters
+    ----------
+    hosts : iterable of str
+        Hosts to run the command on.
+    auth : aiohttp.BasicAuth
+        Credentials used for every host.
+    command : str
+        Command to run.
+    args : sequence of str
+        Command arguments.
+    env : dict or None
+        Key/value pairs for the running environment.
+    cwd : str or None
+        Current directory in the created shell.
+    limit : int
+        Maximum number of commands in flight across all hosts.
+    limit_per_host : int
+        Maximum number of commands in flight on a single host.
+    timeout : float or None
+        Overall deadline in seconds. Hosts which have not finished by then
+        are cancelled and reported with an asyncio.TimeoutError.
+    session : aiohttp.ClientSession or None
+        Session to use. If None, a session with a connector sized after
+        limit and limit_per_host is created and closed on exit.
+    shell_pool : ShellPool or None
+        If given, shells are taken from this pool, and its session is used
+        when session is None.
+    tracer : aiowinrm.tracing.Tracer or None
+        Tracer of the requests of the shells created for each host. Shells
+        of shell_pool use the tracer of its shell_options instead.
+    retry_policy : aiowinrm.retry.RetryPolicy or None
+        If given, the command is run again on hosts where it failed with a
+        transient error, e.g. a connection error or a QuotaLimit fault.
+        Only use it for commands which can safely run twice.
+    circuit_breaker : aiowinrm.retry.CircuitBreaker or None
+        If given, hosts whose circuit is open are reported right away with
+        a CircuitOpenError. Sharing a breaker across fan-outs makes hosts
+        which keep failing fail fast.
+    rate : float or None
+        Maximum number of commands started per second, retries included.
+        If None, commands start as soon as a slot is free.
+    dns_ttl : float or None
+        Seconds host name resolutions are cached for by the session created
+        when session is None. If None, they are cached for its lifetime.
+
+    Yields
+    ------
+    result : HostResult
+        One result per host, in completion order.
+    """
+    if session is None and shell_pool is not None:
+        session = shell_pool.session
+
+    owns_session = session is None
+    if owns_session:
+        connector = aiohttp.TCPConnector(
+            limit=limit, limit_per_host=limit_per_host,
+            ttl_dns_cache=dns_ttl,
+        )
+        session = aiohttp.ClientSession(auth=auth, connector=connector)
+
+    loop = asyncio.get_event_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+
+    semaphore = asyncio.Semaphore(limit)
+    host_semaphores = collections.defaultdict(
+        lambda: asyncio.Semaphore(limit_per_host)
+    )
+    results = asyncio.Queue()
+    rate_limiter = None if rate is None else RateLimiter(rate)
+
+    async def worker(host):
+        key = parse_host(host, transport=TranportKind.http)
+
+        async def attempt():
+            # Slots are not held while waiting between attempts. The host
+            # slot comes first, so that commands queued behind a busy host
+            # do not hold global slots other hosts could use.
+            async with host_semaphores[key]:
+                async with semaphore:
+                    if rate_limiter is not None:
+                        await rate_limiter.wait()
+                    return await _run_on_host(
+                        session, shell_pool, host, command, args, env, cwd,
+                        tracer
+                    )
+
+        try:
+            response = await call_with_retry(
+                attempt, key, retry_policy, circuit_breaker
+            )
+            result = HostResult(host, response=response)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result = HostResult(host, exception=e)
+        results.put_nowait(result)
+
+    tasks = collections.OrderedDict(
+        (asyncio.ensure_future(worker(host)), host) for host in hosts
+    )
+    try:
+        for _ in range(len(tasks)):
+            if deadline is None:
+                result = await results.get()
+            else:
+                try:
+                    result = await asyncio.wait_for(
+                        results.get(), max(deadline - loop.time(), 0)
+                    )
+                except asyncio.TimeoutError:
+                    break
+            yield result
+
+        # Deadline reached: cancel the hosts still running before yielding
+        # anything, as others may finish while the consumer holds a result.
+        timed_out = [host for task, host in tasks.items() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        while not results.empty():
+            yield results.get_nowait()
+        for host in timed_out:
+            yield HostResult(host, exception=asyncio.TimeoutError())
+    finally:
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if owns_session:
+            await session.close()
+
+
+class RateLimiter(object):
+    """ Space out events so that at most rate of them happen per second.
+    """
+    def __init__(self, rate):
+        if rate <= 0:
+            raise ValueError("rate must be positive, got {}".format(rate))
+        self.interval = 1.0 / rate
+        self._next = None
+
+    async def wait(self):
+        """ Wait until the next event is allowed.
+        """
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        if self._next is None or self._next < now:
+            self._next = now
+        delay = self._next - now
+        self._next += self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def _run_on_host(session, shell_pool, host, command, args, env, cwd,
+                       tracer=None):
+    if shell_pool is not None:
+        async with shell_pool.shell(host, env=env, cwd=cwd) as shell_context:
+            return await shell_context.run(command, args)
+
+    async with ShellContext(
+        session, host, env=env, cwd=cwd, tracer=tracer
+    ) as shell_context:
+        return await shell_context.run(command, args)
@@ -0,0 +1,146 @@
+""" Offloading of SOAP parsing and serialization to an executor.
+
+When a single event loop drives thousands of commands, parsing large
+Receive responses (and serializing large Send envelopes) on the loop thread
+delays every other request. An Offloader runs this work in an executor
+instead, once payloads reach a size threshold: smaller ones are handled
+inline, as moving them around costs more than processing them.
+
+Responses to parse are batched: those arriving within one iteration of the
+event loop go to the executor in a single call, which amortizes the
+pickling and IPC overhead of a ProcessPoolExecutor. A ProcessPoolExecutor
+is the one actually relieving the loop: lxml holds the GIL while calling
+back into the Receive parser, so threads mostly help with the base64
+decoding.
+
+Example
+-------
+>>> with concurrent.futures.ProcessPoolExecutor(4) as executor:
+...     offloader = Offloader(executor)
+...     async with ShellContext(session, host, offloader=offloader) as shell:
+...         ...
+"""
+import asyncio
+import functools
+
+import lxml.etree as etree
+
+from .constants import DEFAULT_OFFLOAD_THRESHOLD
+from .soap.protocol import parse_command_output, send_input
+
+
+class Offloader(object):
+    """ Run parsing and serialization of large payloads in executor.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        Thread or process pool doing the work.
+    threshold : int
+        Payloads smaller than this many bytes are processed inline.
+    max_batch : int
+        Maximum number of responses parsed per call to the executor.
+    """
+    def __init__(self, executor, threshold=DEFAULT_OFFLOAD_THRESHOLD,
+                 max_batch=32):
+        self.executor = executor
+        self.threshold = threshold
+        self.max_batch = max_batch
+
+        # (data, future) of the responses waiting to be sent to the executor
+        self._pending = []
+        self._flush_handle = None
+
+    async def parse_command_output(self, data):
+        """ Parse a Receive response, as soap.protocol.parse_command_output.
+        """
+        if len(data) < self.threshold:
+            return parse_command_output(data)
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((bytes(data), future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            # Gather the responses arriving in this iteration of the loop
+            self._flush_handle = loop.call_soon(self._flush)
+        return await future
+
+    async def send_payload(self, shell_id, command_id, data, end=False):
+        """ Serialize a Send request, as
+        sansio.CommandProtocol.send_request.
+        """
+        if len(data) < self.threshold:
+            return _send_payload(shell_id, command_id, data, end)
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, _send_payload, shell_id, command_id, bytes(data),
+            end
+        )
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        loop = asyncio.get_event_loop()
+        batch = loop.run_in_executor(
+            self.executor, _parse_batch, [data for data, _ in pending]
+        )
+        batch.add_done_callback(functools.partial(_resolve, pending))
+
+
+def _parse_batch(responses):
+    """ Parse Receive responses in the executor.
+
+    Returns a list of (ok, output) pairs, so that a malformed response only
+    fails its own request. The exceptions themselves are not returned: some
+    of them, like lxml's XMLSyntaxError, cannot be pickled back from a
+    ProcessPoolExecutor.
+    """
+    results = []
+    for response in responses:
+        try:
+            results.append((True, parse_command_output(response)))
+        except Exception:
+            results.append((False, None))
+    return results
+
+
+def _resolve(pending, batch):
+    if batch.cancelled():
+        for _, future in pending:
+            future.cancel()
+        return
+
+    error = batch.exception()
+    if error is not None:
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(error)
+        return
+
+    for (data, future), (ok, output) in zip(pending, batch.result()):
+        if future.done():
+            continue
+        if ok:
+            future.set_result(output)
+            continue
+        # Parse again inline, to fail with the same exception as a small
+        # response would
+        try:
+            output = parse_command_output(data)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(output)
+
+
+def _send_payload(shell_id, command_id, data, end):
+    return etree.tostring(send_input(shell_id, command_id, data, end))
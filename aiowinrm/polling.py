@@ -0,0 +1,112 @@
+import time
+
+from attr import attributes, attr
+
+from .constants import DEFAULT_OPERATION_TIMEOUT
+
+
+@attributes
+class PollStats:
+    """ Counters of the Receive requests of a command.
+    """
+    polls = attr(default=0)
+    # Polls which returned some output
+    productive_polls = attr(default=0)
+    # Polls which returned no output, timed out ones included
+    empty_polls = attr(default=0)
+    # Polls answered by an OperationTimeout fault
+    timed_out_polls = attr(default=0)
+    bytes_received = attr(default=0)
+    # Seconds spent waiting between polls
+    wait_time = attr(default=0.0)
+
+    @property
+    def empty_ratio(self):
+        if self.polls == 0:
+            return 0.0
+        return self.empty_polls / self.polls
+
+
+class PollScheduler(object):
+    """ Decide how long to wait before the next Receive request.
+
+    While output flows, or while the server holds requests until output is
+    available (long-polling up to the OperationTimeout), requests are sent
+    back to back. When the server answers quickly without output, the delay
+    between requests grows exponentially up to max_delay, and drops back to
+    0 as soon as output comes again.
+
+    Parameters
+    ----------
+    operation_timeout : float or None
+        OperationTimeout of the Receive requests, in seconds.
+    initial_delay : float
+        Delay after the first quick, empty response.
+    max_delay : float
+        Largest delay between two requests.
+    backoff : float
+        Factor applied to the delay after each quick, empty response.
+    long_poll_ratio : float
+        An empty response taking at least this fraction of the
+        OperationTimeout means the server is long-polling.
+    clock : callable
+        Returns the current time, in seconds.
+    """
+    def __init__(self, operation_timeout=None, initial_delay=0.01,
+                 max_delay=1.0, backoff=2.0, long_poll_ratio=0.5,
+                 clock=time.monotonic):
+        if operation_timeout is None:
+            operation_timeout = DEFAULT_OPERATION_TIMEOUT
+        self.operation_timeout = operation_timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.long_poll_ratio = long_poll_ratio
+        self.clock = clock
+
+        self.delay = 0.0
+        self.stats = PollStats()
+
+    def next_delay(self):
+        """ Return the number of seconds to wait before the next request.
+        """
+        self.stats.wait_time += self.delay
+        return self.delay
+
+    def sent(self):
+        """ Account for a Receive request being sent, and return the time it
+        was sent at, to be given back to received.
+        """
+        return self.clock()
+
+    def received(self, size, sent_at):
+        """ Account for a response with size bytes of output, to a request
+        sent at sent_at.
+        """
+        stats = self.stats
+        stats.polls += 1
+        if size:
+            stats.productive_polls += 1
+            stats.bytes_received += size
+            self.delay = 0.0
+            return
+
+        stats.empty_polls += 1
+        elapsed = self.clock() - sent_at
+        if elapsed >= self.operation_timeout * self.long_poll_ratio:
+            # The server waited for output already
+            self.delay = 0.0
+        else:
+            self.delay = min(
+                max(self.delay * self.backoff, self.initial_delay),
+                self.max_delay
+            )
+
+    def timed_out(self):
+        """ Account for a response being an OperationTimeout fault, i.e. no
+        output within the timeout.
+        """
+        self.stats.polls += 1
+        self.stats.empty_polls += 1
+        self.stats.timed_out_polls += 1
+        self.delay = 0.0
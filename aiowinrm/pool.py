@@ -0,0 +1,244 @@
+import asyncio
+import collections
+
+from .constants import TranportKind
+from .core import ShellContext
+from .utils import parse_host
+
+
+async def _default_health_check(shell_context):
+    return await shell_context.is_alive()
+
+
+class ShellPool(object):
+    """ Keep WinRM shells open across commands.
+
+    Shells are keyed by (host, env, cwd): a command only reuses a shell
+    created with the same environment and working directory.
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        Session used to create and close shells.
+    max_idle : float
+        Idle shells older than this many seconds are closed.
+    max_per_host : int
+        Maximum number of open shells (idle or in use) per host.
+    health_check : coroutine function or None
+        Called with a ShellContext before handing out a shell which has been
+        idle for more than health_check_after seconds. A falsy result
+        discards the shell. Defaults to a WS-Transfer Get on the shell.
+    health_check_after : float
+        See health_check.
+    shell_options : dict or None
+        Extra keyword arguments for ShellContext, e.g. max_envelope_size.
+    """
+    def __init__(self, session, max_idle=60.0, max_per_host=4,
+                 health_check=_default_health_check, health_check_after=5.0,
+                 shell_options=None):
+        self._session = session
+        self._shell_options = shell_options or {}
+
+        self.max_idle = max_idle
+        self.max_per_host = max_per_host
+        self.health_check = health_check
+        self.health_check_after = health_check_after
+
+        # key -> list of (shell_context, last_used), most recent last
+        self._idle = collections.defaultdict(list)
+        # host -> number of open shells, idle or not
+        self._counts = collections.defaultdict(int)
+        self._condition = asyncio.Condition()
+
+        self._closed = False
+
+    @property
+    def session(self):
+        return self._session
+
+    def shell(self, host, env=None, cwd=None):
+        """ Return an async context manager handing out a ShellContext.
+
+        The shell goes back to the pool on exit, unless the block raised, in
+        which case it is closed.
+        """
+        return _PooledShell(self, _make_key(host, env, cwd))
+
+    async def close(self):
+        """ Close every idle shell. Shells in use are closed on release.
+        """
+        self._closed = True
+        async with self._condition:
+            to_close = [
+                shell_context
+                for idle in self._idle.values()
+                for shell_context, _ in idle
+            ]
+            self._idle.clear()
+        for shell_context in to_close:
+            await self._discard(shell_context)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *a, **kw):
+        await self.close()
+
+    async def _acquire(self, key):
+        if self._closed:
+            raise RuntimeError("ShellPool is closed")
+
+        host, env, cwd = key
+        while True:
+            shell_context, last_used, evicted = await self._reserve(key)
+            for old in evicted:
+                await self._close(old)
+
+            if shell_context is None:
+                shell_context = ShellContext(
+                    self._session, host, env=_thaw_env(env), cwd=cwd,
+                    **self._shell_options
+                )
+                try:
+                    await shell_context.__aenter__()
+                except BaseException:
+                    await self._forget(host)
+                    raise
+                return shell_context
+
+            if await self._is_healthy(shell_context, last_used):
+                return shell_context
+            await self._discard(shell_context)
+
+    async def _release(self, key, shell_context, reuse):
+        if not reuse or self._closed:
+            await self._discard(shell_context)
+            return
+
+        loop = asyncio.get_event_loop()
+        async with self._condition:
+            self._idle[key].append((shell_context, loop.time()))
+            self._condition.notify_all()
+
+    async def _reserve(self, key):
+        """ Pick an idle shell for key, or reserve a slot to create one.
+
+        Returns (shell_context, last_used, evicted), where shell_context is
+        None when a slot was reserved, and evicted lists idle shells the
+        caller must close. Slots of evicted shells are already released.
+        """
+        host = key[0]
+        async with self._condition:
+            while True:
+                evicted = self._pop_expired()
+
+                idle = self._idle.get(key)
+                if idle:
+                    shell_context, last_used = idle.pop()
+                    return shell_context, last_used, evicted
+
+                if self._counts[host] < self.max_per_host:
+                    self._counts[host] += 1
+                    return None, None, evicted
+
+                # Host is at capacity: take over the slot of the least
+                # recently used idle shell of this host, if any.
+                victim = self._pop_idle_for_host(host)
+                if victim is not None:
+                    evicted.append(victim)
+                    return None, None, evicted
+
+                await self._condition.wait()
+
+    def _pop_expired(self):
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+
+        expired = []
+        for key, idle in list(self._idle.items()):
+            keep = []
+            for shell_context, last_used in idle:
+                if now - last_used > self.max_idle:
+                    expired.append(shell_context)
+                    self._counts[shell_context.host] -= 1
+                else:
+                    keep.append((shell_context, last_used))
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+        return expired
+
+    def _pop_idle_for_host(self, host):
+        candidates = [
+            (idle[0][1], key)
+            for key, idle in self._idle.items()
+            if key[0] == host and idle
+        ]
+        if not candidates:
+            return None
+
+        _, key = min(candidates)
+        shell_context, _ = self._idle[key].pop(0)
+        if not self._idle[key]:
+            del self._idle[key]
+        return shell_context
+
+    async def _is_healthy(self, shell_context, last_used):
+        if self.health_check is None:
+            return True
+
+        loop = asyncio.get_event_loop()
+        if loop.time() - last_used < self.health_check_after:
+            return True
+
+        try:
+            return bool(await self.health_check(shell_context))
+        except Exception:
+            return False
+
+    async def _discard(self, shell_context):
+        try:
+            await self._close(shell_context)
+        finally:
+            await self._forget(shell_context.host)
+
+    async def _close(self, shell_context):
+        try:
+            await shell_context.__aexit__(None, None, None)
+        except Exception:
+            # The shell is gone either way; the server reaps it eventually.
+            pass
+
+    async def _forget(self, host):
+        async with self._condition:
+            self._counts[host] -= 1
+            self._condition.notify_all()
+
+
+class _PooledShell(object):
+    def __init__(self, pool, key):
+        self._pool = pool
+        self._key = key
+        self._shell_context = None
+
+    async def __aenter__(self):
+        self._shell_context = await self._pool._acquire(self._key)
+        return self._shell_context
+
+    async def __aexit__(self, exc_type, exc, tb):
+        shell_context, self._shell_context = self._shell_context, None
+        await self._pool._release(
+            self._key, shell_context, reuse=exc_type is None
+        )
+
+
+def _make_key(host, env, cwd):
+    host = parse_host(host, transport=TranportKind.http)
+    if env is not None:
+        env = tuple(sorted(env.items()))
+    return host, env, cwd
+
+
+def _thaw_env(env):
+    return None if env is None else dict(env)
@@ -0,0 +1,8 @@
+""" PowerShell Remoting Protocol (MS-PSRP) client.
+
+Scripts run in the warm runspaces of a RunspacePool, instead of a new
+powershell.exe per command, and their output comes back as deserialized
+objects.
+"""
+from .clixml import PSObject  # noqa
+from .runspace import Pipeline, RunspacePool  # noqa
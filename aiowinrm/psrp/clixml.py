@@ -0,0 +1,283 @@
+""" Minimal CLIXML (MS-PSRP 2.2.5) support.
+
+Only the messages sent by the client are serialized, from fixed templates.
+Deserialization covers primitive types, collections, and objects with
+properties, which is enough for pipeline output, error records and state
+messages.
+"""
+import base64
+import decimal
+import re
+import uuid
+
+from xml.sax.saxutils import escape
+
+import lxml.etree as etree
+
+from attr import Factory, attributes, attr
+
+
+PROTOCOL_VERSION = "2.3"
+
+_SESSION_CAPABILITY = """\
+<Obj RefId="0"><MS>\
+<Version N="protocolversion">{protocol_version}</Version>\
+<Version N="PSVersion">2.0</Version>\
+<Version N="SerializationVersion">1.1.0.1</Version>\
+</MS></Obj>"""
+
+_HOST_INFO = """\
+<Obj N="HostInfo" RefId="{ref_id}"><MS>\
+<B N="_isHostNull">true</B>\
+<B N="_isHostUINull">true</B>\
+<B N="_isHostRawUINull">true</B>\
+<B N="_useRunspaceHost">true</B>\
+</MS></Obj>"""
+
+_INIT_RUNSPACEPOOL = """\
+<Obj RefId="0"><MS>\
+<I32 N="MinRunspaces">{min_runspaces}</I32>\
+<I32 N="MaxRunspaces">{max_runspaces}</I32>\
+<Obj N="PSThreadOptions" RefId="1"><TN RefId="0">\
+<T>System.Management.Automation.Runspaces.PSThreadOptions</T>\
+<T>System.Enum</T><T>System.ValueType</T><T>System.Object</T></TN>\
+<ToString>Default</ToString><I32>0</I32></Obj>\
+<Obj N="ApartmentState" RefId="2"><TN RefId="1">\
+<T>System.Threading.ApartmentState</T>\
+<T>System.Enum</T><T>System.ValueType</T><T>System.Object</T></TN>\
+<ToString>Unknown</ToString><I32>2</I32></Obj>\
+{host_info}\
+<Nil N="ApplicationArguments"/>\
+</MS></Obj>"""
+
+_RESULT_TYPES = """\
+<Obj N="{name}" RefId="{ref_id}"><TNRef RefId="2"/>\
+<ToString>None</ToString><I32>0</I32></Obj>"""
+
+_CREATE_PIPELINE = """\
+<Obj RefId="0"><MS>\
+<Obj N="PowerShell" RefId="1"><MS>\
+<Obj N="Cmds" RefId="2"><TN RefId="0">\
+<T>System.Collections.Generic.List`1[[System.Management.Automation.PSObject, \
+System.Management.Automation, Version=1.0.0.0, Culture=neutral, \
+PublicKeyToken=31bf3856ad364e35]]</T><T>System.Object</T></TN><LST>\
+<Obj RefId="3"><MS>\
+<S N="Cmd">{script}</S>\
+<B N="IsScript">true</B>\
+<Nil N="UseLocalScope"/>\
+<Obj N="MergeMyResult" RefId="4"><TN RefId="2">\
+<T>System.Management.Automation.Runspaces.PipelineResultTypes</T>\
+<T>System.Enum</T><T>System.ValueType</T><T>System.Object</T></TN>\
+<ToString>None</ToString><I32>0</I32></Obj>\
+{result_types}\
+<Obj N="Args" RefId="5"><TNRef RefId="0"/><LST/></Obj>\
+</MS></Obj>\
+</LST></Obj>\
+<B N="IsNested">false</B>\
+<Nil N="History"/>\
+<B N="RedirectShellErrorOutputPipe">true</B>\
+</MS></Obj>\
+<B N="NoInput">true</B>\
+<Obj N="ApartmentState" RefId="6"><TN RefId="1">\
+<T>System.Threading.ApartmentState</T>\
+<T>System.Enum</T><T>System.ValueType</T><T>System.Object</T></TN>\
+<ToString>Unknown</ToString><I32>2</I32></Obj>\
+<Obj N="RemoteStreamOptions" RefId="7"><TN RefId="3">\
+<T>System.Management.Automation.RemoteStreamOptions</T>\
+<T>System.Enum</T><T>System.ValueType</T><T>System.Object</T></TN>\
+<ToString>0</ToString><I32>0</I32></Obj>\
+<B N="AddToHistory">false</B>\
+{host_info}\
+<B N="IsNested">false</B>\
+</MS></Obj>"""
+
+# Merge settings of a command, after MergeMyResult
+_MERGE_NAMES = (
+    "MergeToResult", "MergePreviousResults", "MergeError", "MergeWarning",
+    "MergeVerbose", "MergeDebug", "MergeInformation",
+)
+
+# Characters PowerShell escapes as _xHHHH_, "_x" itself included
+_R_ESCAPE = re.compile(u"_(?=x)|[\x00-\x1f\x7f-\x9f\ufffe\uffff]")
+_R_UNESCAPE = re.compile(r"_x([0-9A-Fa-f]{4})_")
+
+
+def session_capability():
+    return _SESSION_CAPABILITY.format(
+        protocol_version=PROTOCOL_VERSION
+    ).encode("utf8")
+
+
+def init_runspace_pool(min_runspaces, max_runspaces):
+    return _INIT_RUNSPACEPOOL.format(
+        min_runspaces=min_runspaces, max_runspaces=max_runspaces,
+        host_info=_HOST_INFO.format(ref_id=3),
+    ).encode("utf8")
+
+
+def create_pipeline(script):
+    """ Serialize a CREATE_PIPELINE message running the given script.
+    """
+    result_types = "".join(
+        _RESULT_TYPES.format(name=name, ref_id=ref_id)
+        for ref_id, name in enumerate(_MERGE_NAMES, start=8)
+    )
+    return _CREATE_PIPELINE.format(
+        script=escape(encode_string(script)), result_types=result_types,
+        host_info=_HOST_INFO.format(ref_id=8 + len(_MERGE_NAMES)),
+    ).encode("utf8")
+
+
+def encode_string(s):
+    """ Escape the characters of s which cannot appear as is in CLIXML.
+    """
+    return _R_ESCAPE.sub(lambda m: "_x{:04X}_".format(ord(m.group())), s)
+
+
+def decode_string(s):
+    """ Reverse encode_string.
+    """
+    if "_x" not in s:
+        return s
+    s = _R_UNESCAPE.sub(lambda m: chr(int(m.group(1), 16)), s)
+    # Characters outside the BMP come as escaped surrogate pairs
+    return s.encode("utf-16-le", "surrogatepass").decode("utf-16-le")
+
+
+@attributes
+class PSObject:
+    """ A deserialized complex object.
+
+    Attributes
+    ----------
+    type_names : list of str
+        Type hierarchy of the object, most specific first.
+    properties : dict
+        Adapted and extended properties.
+    to_string : str or None
+        Result of ToString() on the remote object.
+    value : object
+        Wrapped value, e.g. the integer of an enum, or None.
+    """
+    type_names = attr(default=Factory(list))
+    properties = attr(default=Factory(dict))
+    to_string = attr(default=None)
+    value = attr(default=None)
+
+    def __str__(self):
+        if self.to_string is not None:
+            return self.to_string
+        return str(self.value)
+
+
+def _parse_bool(text):
+    return text.strip().lower() == "true"
+
+
+_PRIMITIVES = {
+    "S": decode_string,
+    "C": lambda text: chr(int(text)),
+    "B": _parse_bool,
+    "DT": str,
+    "TS": str,
+    "By": int,
+    "SB": int,
+    "U16": int,
+    "I16": int,
+    "U32": int,
+    "I32": int,
+    "U64": int,
+    "I64": int,
+    "Sg": float,
+    "Db": float,
+    "D": decimal.Decimal,
+    "BA": base64.b64decode,
+    "G": uuid.UUID,
+    "URI": decode_string,
+    "Version": str,
+    "XD": decode_string,
+    "SBK": decode_string,
+    "SS": str,
+}
+
+_LISTS = frozenset(("LST", "IE", "STK", "QUE"))
+_PROPERTIES = frozenset(("MS", "Props"))
+
+
+def _local_name(tag):
+    # Documents written by Export-Clixml are in a namespace, PSRP messages
+    # are not.
+    return tag.rpartition("}")[2]
+
+
+def loads(data):
+    """ Deserialize a CLIXML document holding a single value.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf8")
+    return _Deserializer().value(etree.fromstring(data))
+
+
+class _Deserializer(object):
+    def __init__(self):
+        # RefId -> deserialized object, and list of type names
+        self._objects = {}
+        self._type_names = {}
+
+    def value(self, element):
+        tag = _local_name(element.tag)
+        if tag == "Obj":
+            return self._object(element)
+        elif tag == "Ref":
+            return self._objects[element.get("RefId")]
+        elif tag == "Nil":
+            return None
+
+        parse = _PRIMITIVES.get(tag)
+        text = element.text or ""
+        if parse is None:
+            return text
+        return parse(text)
+
+    def _object(self, element):
+        obj = PSObject()
+        collection = None
+        for child in element:
+            tag = _local_name(child.tag)
+            if tag == "TN":
+                obj.type_names = [t.text for t in child]
+                self._type_names[child.get("RefId")] = obj.type_names
+            elif tag == "TNRef":
+                obj.type_names = self._type_names[child.get("RefId")]
+            elif tag in _PROPERTIES:
+                for prop in child:
+                    obj.properties[prop.get("N")] = self.value(prop)
+            elif tag == "ToString":
+                obj.to_string = decode_string(child.text or "")
+            elif tag in _LISTS:
+                collection = [self.value(item) for item in child]
+            elif tag == "DCT":
+                collection = dict(
+                    self._entry(entry) for entry in child
+                )
+            else:
+                obj.value = self.value(child)
+
+        # Plain collections are returned as such
+        if collection is not None and not obj.properties:
+            result = collection
+        else:
+            if collection is not None:
+                obj.value = collection
+            result = obj
+        self._objects[element.get("RefId")] = result
+        return result
+
+    def _entry(self, entry):
+        key = value = None
+        for child in entry:
+            if child.get("N") == "Key":
+                key = self.value(child)
+            else:
+                value = self.value(child)
+        return key, value
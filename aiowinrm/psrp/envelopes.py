@@ -0,0 +1,152 @@
+""" SOAP envelopes of the PowerShell remoting endpoint.
+
+These are the WinRS messages of aiowinrm.soap.protocol, addressed to the
+Microsoft.PowerShell resource, with PSRP fragments as payload.
+"""
+import binascii
+
+import lxml.etree as etree
+
+from ..soap.header import Header
+from ..soap.namespaces import NAMESPACE, SOAP_ENV, WIN_SHELL
+from ..soap.protocol import format_duration
+
+
+RESOURCE_URI = "http://schemas.microsoft.com/powershell/Microsoft.PowerShell"
+
+NS_POWERSHELL = "http://schemas.microsoft.com/powershell"
+
+SIGNAL_STOP = "powershell/signal/crtl_c"
+
+
+def create_runspace_pool(shell_id, creation_xml, protocol_version):
+    """ Create the XML payload to open a runspace pool.
+
+    Parameters
+    ----------
+    shell_id : str
+        Id of the shell, the RPID of the runspace pool.
+    creation_xml : bytes
+        Fragments of the SESSION_CAPABILITY and INIT_RUNSPACEPOOL messages.
+    protocol_version : str
+        PSRP protocol version of the client.
+
+    Returns
+    -------
+    envelope : etree.Element
+        lxml node for the whole envelope
+    """
+    header = Header(
+        action="http://schemas.xmlsoap.org/ws/2004/09/transfer/Create",
+        resource_uri=RESOURCE_URI,
+        options={"protocolversion": protocol_version},
+    )
+
+    body = etree.Element(SOAP_ENV + "Body")
+    shell = etree.SubElement(body, WIN_SHELL + "Shell", ShellId=shell_id)
+    input_streams = etree.SubElement(shell, WIN_SHELL + "InputStreams")
+    input_streams.text = "stdin pr"
+    output_streams = etree.SubElement(shell, WIN_SHELL + "OutputStreams")
+    output_streams.text = "stdout"
+    creation = etree.SubElement(
+        shell, "{%s}creationXml" % NS_POWERSHELL, nsmap={None: NS_POWERSHELL}
+    )
+    creation.text = _b64encode(creation_xml)
+
+    return _envelope(header, body)
+
+
+def close_runspace_pool(shell_id):
+    header = Header(
+        action="http://schemas.xmlsoap.org/ws/2004/09/transfer/Delete",
+        resource_uri=RESOURCE_URI,
+        shell_id=shell_id,
+    )
+    return _envelope(header, etree.Element(SOAP_ENV + "Body"))
+
+
+def create_pipeline(shell_id, pipeline_id, arguments):
+    """ Create the XML payload to start a pipeline.
+
+    Parameters
+    ----------
+    shell_id : str
+        Id of the runspace pool shell.
+    pipeline_id : str
+        Id of the command, the PID of the pipeline.
+    arguments : bytes
+        Fragments of the CREATE_PIPELINE message.
+    """
+    header = Header(
+        action="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Command",  # NOQA
+        resource_uri=RESOURCE_URI,
+        shell_id=shell_id,
+    )
+
+    body = etree.Element(SOAP_ENV + "Body")
+    command_line = etree.SubElement(
+        body, WIN_SHELL + "CommandLine", CommandId=pipeline_id
+    )
+    command = etree.SubElement(command_line, WIN_SHELL + "Command")
+    command.text = "Invoke-Expression"
+    arguments_node = etree.SubElement(command_line, WIN_SHELL + "Arguments")
+    arguments_node.text = _b64encode(arguments)
+
+    return _envelope(header, body)
+
+
+def receive(shell_id, command_id=None, max_envelope_size=None,
+            operation_timeout=None):
+    """ Create the XML payload to receive the output of the runspace pool,
+    or of one of its pipelines if command_id is given.
+    """
+    kw = {}
+    if operation_timeout is not None:
+        kw["timeout"] = format_duration(operation_timeout)
+
+    header = Header(
+        action="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Receive",  # NOQA
+        resource_uri=RESOURCE_URI,
+        shell_id=shell_id,
+        max_envelope_size=max_envelope_size,
+        **kw
+    )
+
+    body = etree.Element(SOAP_ENV + "Body")
+    receive_node = etree.SubElement(body, WIN_SHELL + "Receive")
+    desired_stream = etree.SubElement(
+        receive_node, WIN_SHELL + "DesiredStream"
+    )
+    desired_stream.text = "stdout"
+    if command_id is not None:
+        desired_stream.set("CommandId", command_id)
+
+    return _envelope(header, body)
+
+
+def signal(shell_id, command_id, code):
+    header = Header(
+        action="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Signal",  # NOQA
+        resource_uri=RESOURCE_URI,
+        shell_id=shell_id,
+    )
+
+    body = etree.Element(SOAP_ENV + "Body")
+    signal_node = etree.SubElement(
+        body, WIN_SHELL + "Signal", CommandId=command_id
+    )
+    code_node = etree.SubElement(signal_node, WIN_SHELL + "Code")
+    code_node.text = code
+
+    return _envelope(header, body)
+
+
+def _envelope(header, body):
+    envelope = etree.Element(SOAP_ENV + "Envelope", nsmap=NAMESPACE)
+    envelope.append(header.to_dom())
+    envelope.append(body)
+    return envelope
+
+
+def _b64encode(data):
+    return binascii.b2a_base64(data, newline=False).decode("ascii")
@@ -0,0 +1,108 @@
+""" PSRP fragments (MS-PSRP 2.2.4).
+
+Messages are split in fragments so that they fit in WinRM envelopes. The
+fragments of several messages may be interleaved in one stream.
+"""
+import struct
+
+from ..errors import PSRPError
+
+
+# ObjectId, FragmentId, flags, BlobLength, all big endian
+_HEADER = struct.Struct(">QQBI")
+
+START = 0x1
+END = 0x2
+
+# Blob size of the fragments sent to the server, small enough to fit in the
+# smallest envelope size allowed by default.
+MAX_FRAGMENT_SIZE = 32 * 1024
+
+
+def fragment(data, object_id, max_size=MAX_FRAGMENT_SIZE):
+    """ Split the message data in fragments.
+
+    Parameters
+    ----------
+    data : bytes
+        Packed message
+    object_id : int
+        Id shared by every fragment of the message, unique per message.
+    max_size : int
+        Maximum blob size of each fragment.
+
+    Returns
+    -------
+    fragments : bytes
+        Concatenated fragments
+    """
+    count = max(1, -(-len(data) // max_size))
+    fragments = []
+    for fragment_id in range(count):
+        blob = data[fragment_id * max_size:(fragment_id + 1) * max_size]
+        flags = 0
+        if fragment_id == 0:
+            flags |= START
+        if fragment_id == count - 1:
+            flags |= END
+        fragments.append(
+            _HEADER.pack(object_id, fragment_id, flags, len(blob))
+        )
+        fragments.append(blob)
+    return b"".join(fragments)
+
+
+class Defragmenter(object):
+    """ Reassemble messages out of a stream of fragments.
+
+    Fragments may be split at any byte across calls to feed.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        # object id -> (next fragment id, list of blobs)
+        self._partial = {}
+
+    def feed(self, data):
+        """ Add data to the stream, and return the list of messages (bytes)
+        completed by it.
+        """
+        buf = self._buffer
+        buf += data
+
+        messages = []
+        offset = 0
+        while len(buf) - offset >= _HEADER.size:
+            object_id, fragment_id, flags, length = _HEADER.unpack_from(
+                buf, offset
+            )
+            end = offset + _HEADER.size + length
+            if end > len(buf):
+                break
+            blob = bytes(buf[offset + _HEADER.size:end])
+            offset = end
+
+            if flags & START:
+                if fragment_id != 0:
+                    raise PSRPError(
+                        "Start fragment of object {} has id {}".format(
+                            object_id, fragment_id
+                        )
+                    )
+                blobs = []
+            else:
+                expected, blobs = self._partial.pop(object_id, (None, None))
+                if fragment_id != expected:
+                    raise PSRPError(
+                        "Unexpected fragment {} of object {}".format(
+                            fragment_id, object_id
+                        )
+                    )
+            blobs.append(blob)
+
+            if flags & END:
+                messages.append(b"".join(blobs))
+            else:
+                self._partial[object_id] = (fragment_id + 1, blobs)
+
+        del buf[:offset]
+        return messages
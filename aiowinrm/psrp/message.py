@@ -0,0 +1,91 @@
+""" PSRP messages (MS-PSRP 2.2.1).
+"""
+import struct
+import uuid
+
+from attr import attributes, attr
+
+from ..errors import PSRPError
+
+
+DESTINATION_CLIENT = 0x00000001
+DESTINATION_SERVER = 0x00000002
+
+SESSION_CAPABILITY = 0x00010002
+INIT_RUNSPACEPOOL = 0x00010004
+PUBLIC_KEY = 0x00010005
+ENCRYPTED_SESSION_KEY = 0x00010006
+PUBLIC_KEY_REQUEST = 0x00010007
+CONNECT_RUNSPACEPOOL = 0x00010008
+RUNSPACEPOOL_INIT_DATA = 0x0002100B
+RESET_RUNSPACE_STATE = 0x0002100C
+SET_MAX_RUNSPACES = 0x00021002
+SET_MIN_RUNSPACES = 0x00021003
+RUNSPACE_AVAILABILITY = 0x00021004
+RUNSPACEPOOL_STATE = 0x00021005
+CREATE_PIPELINE = 0x00021006
+GET_AVAILABLE_RUNSPACES = 0x00021007
+USER_EVENT = 0x00021008
+APPLICATION_PRIVATE_DATA = 0x00021009
+GET_COMMAND_METADATA = 0x0002100A
+RUNSPACEPOOL_HOST_CALL = 0x00021100
+RUNSPACEPOOL_HOST_RESPONSE = 0x00021101
+PIPELINE_INPUT = 0x00041002
+END_OF_PIPELINE_INPUT = 0x00041003
+PIPELINE_OUTPUT = 0x00041004
+ERROR_RECORD = 0x00041005
+PIPELINE_STATE = 0x00041006
+DEBUG_RECORD = 0x00041007
+VERBOSE_RECORD = 0x00041008
+WARNING_RECORD = 0x00041009
+PROGRESS_RECORD = 0x00041010
+INFORMATION_RECORD = 0x00041011
+PIPELINE_HOST_CALL = 0x00041100
+PIPELINE_HOST_RESPONSE = 0x00041101
+
+# Destination, MessageType, RPID, PID
+_HEADER = struct.Struct("<II16s16s")
+
+_BOM = b"\xef\xbb\xbf"
+
+_NIL_UUID = uuid.UUID(int=0)
+
+
+@attributes
+class Message:
+    """ A PSRP message, whose data is a CLIXML document.
+
+    pid is the id of the pipeline the message belongs to, or None for
+    runspace pool messages.
+    """
+    destination = attr()
+    message_type = attr()
+    rpid = attr()
+    pid = attr()
+    data = attr()
+
+    def pack(self):
+        pid = _NIL_UUID if self.pid is None else self.pid
+        return b"".join((
+            _HEADER.pack(
+                self.destination, self.message_type, self.rpid.bytes_le,
+                pid.bytes_le
+            ),
+            _BOM,
+            self.data,
+        ))
+
+    @classmethod
+    def unpack(cls, data):
+        if len(data) < _HEADER.size:
+            raise PSRPError("Truncated message ({} bytes)".format(len(data)))
+
+        destination, message_type, rpid, pid = _HEADER.unpack_from(data)
+        pid = uuid.UUID(bytes_le=pid)
+        body = data[_HEADER.size:]
+        if body.startswith(_BOM):
+            body = body[len(_BOM):]
+        return cls(
+            destination, message_type, uuid.UUID(bytes_le=rpid),
+            None if pid == _NIL_UUID else pid, body
+        )
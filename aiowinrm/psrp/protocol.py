@@ -0,0 +1,250 @@
+""" I/O free implementation of PSRP runspace pools and pipelines, see
+aiowinrm.sansio for the WinRS equivalent.
+"""
+import itertools
+import uuid
+
+import lxml.etree as etree
+
+from ..errors import PSRPError
+from ..sansio import check_status
+from ..soap.protocol import (
+    ReceiveParser, fault_subcode, parse_create_command_response,
+    parse_create_shell_response
+)
+from . import clixml, envelopes, message as msg
+from .fragment import Defragmenter, fragment
+
+
+# RunspacePoolState values
+RUNSPACE_POOL_BEFORE_OPEN = 0
+RUNSPACE_POOL_OPENING = 1
+RUNSPACE_POOL_OPENED = 2
+RUNSPACE_POOL_CLOSED = 3
+RUNSPACE_POOL_CLOSING = 4
+RUNSPACE_POOL_BROKEN = 5
+
+# PSInvocationState values
+PIPELINE_NOT_STARTED = 0
+PIPELINE_RUNNING = 1
+PIPELINE_STOPPING = 2
+PIPELINE_STOPPED = 3
+PIPELINE_COMPLETED = 4
+PIPELINE_FAILED = 5
+PIPELINE_DISCONNECTED = 6
+
+_PIPELINE_DONE = frozenset((
+    PIPELINE_STOPPED, PIPELINE_COMPLETED, PIPELINE_FAILED,
+))
+
+
+class RunspacePoolProtocol(object):
+    """ State of a remote runspace pool.
+
+    Parameters
+    ----------
+    min_runspaces, max_runspaces : int
+        Bounds of the number of runspaces in the pool. At most max_runspaces
+        pipelines run at once, the others are queued by the server.
+    max_envelope_size : int or None
+        MaxEnvelopeSize, in bytes, of Receive requests.
+    operation_timeout : float or None
+        OperationTimeout, in seconds, of Receive requests.
+    """
+    def __init__(self, min_runspaces=1, max_runspaces=1,
+                 max_envelope_size=None, operation_timeout=None):
+        self.min_runspaces = min_runspaces
+        self.max_runspaces = max_runspaces
+        self.max_envelope_size = max_envelope_size
+        self.operation_timeout = operation_timeout
+
+        self.rpid = uuid.uuid4()
+        self.shell_id = None
+        self.state = RUNSPACE_POOL_BEFORE_OPEN
+        self.application_private_data = None
+
+        self._defragmenter = Defragmenter()
+        self._object_ids = itertools.count(1)
+
+    @property
+    def is_opened(self):
+        return self.state == RUNSPACE_POOL_OPENED
+
+    def fragment(self, message_type, data, pid=None):
+        """ Pack and fragment a message to the server.
+        """
+        message = msg.Message(
+            msg.DESTINATION_SERVER, message_type, self.rpid, pid, data
+        )
+        return fragment(message.pack(), next(self._object_ids))
+
+    def create_request(self):
+        creation_xml = b"".join((
+            self.fragment(msg.SESSION_CAPABILITY, clixml.session_capability()),
+            self.fragment(
+                msg.INIT_RUNSPACEPOOL,
+                clixml.init_runspace_pool(
+                    self.min_runspaces, self.max_runspaces
+                ),
+            ),
+        ))
+        return etree.tostring(
+            envelopes.create_runspace_pool(
+                str(self.rpid).upper(), creation_xml,
+                clixml.PROTOCOL_VERSION
+            )
+        )
+
+    def create_response(self, status, data):
+        check_status(status, data)
+        self.shell_id = parse_create_shell_response(data)
+        self.state = RUNSPACE_POOL_OPENING
+
+    def receive_request(self):
+        return etree.tostring(
+            envelopes.receive(
+                self.shell_id, None, self.max_envelope_size,
+                self.operation_timeout
+            )
+        )
+
+    def receive_response(self, status, data):
+        """ Handle the response to a Receive request on the pool, until it
+        is opened.
+        """
+        for message in _receive_messages(self._defragmenter, status, data):
+            if message.message_type == msg.RUNSPACEPOOL_STATE:
+                value = clixml.loads(message.data)
+                self.state = value.properties["RunspaceState"]
+                if self.state in (RUNSPACE_POOL_BROKEN, RUNSPACE_POOL_CLOSED):
+                    raise PSRPError(
+                        "Runspace pool could not be opened: {}".format(
+                            _error_message(
+                                value.properties.get("ExceptionAsErrorRecord")
+                            )
+                        )
+                    )
+            elif message.message_type == msg.APPLICATION_PRIVATE_DATA:
+                self.application_private_data = clixml.loads(message.data)
+
+    def close_request(self):
+        return etree.tostring(envelopes.close_runspace_pool(self.shell_id))
+
+    def close_response(self, status, data):
+        check_status(status, data)
+        self.state = RUNSPACE_POOL_CLOSED
+
+    def pipeline(self, script):
+        return PipelineProtocol(self, script)
+
+
+class PipelineProtocol(object):
+    """ State of a pipeline running in a runspace pool.
+
+    Output objects are returned by receive_response as they come. Error
+    records of non-terminating errors are accumulated in errors, and
+    the other streams (warning, verbose...) are ignored.
+    """
+    def __init__(self, pool, script):
+        self.pool = pool
+        self.script = script
+
+        self.pid = uuid.uuid4()
+        self.command_id = None
+        self.state = PIPELINE_NOT_STARTED
+        self.errors = []
+        # ErrorRecord of a failed pipeline
+        self.exception = None
+
+        self._defragmenter = Defragmenter()
+
+    @property
+    def is_done(self):
+        return self.state in _PIPELINE_DONE
+
+    def create_request(self):
+        arguments = self.pool.fragment(
+            msg.CREATE_PIPELINE, clixml.create_pipeline(self.script),
+            self.pid
+        )
+        return etree.tostring(
+            envelopes.create_pipeline(
+                self.pool.shell_id, str(self.pid).upper(), arguments
+            )
+        )
+
+    def create_response(self, status, data):
+        check_status(status, data)
+        self.command_id = parse_create_command_response(data)
+        self.state = PIPELINE_RUNNING
+
+    def receive_request(self):
+        return etree.tostring(
+            envelopes.receive(
+                self.pool.shell_id, self.command_id,
+                self.pool.max_envelope_size, self.pool.operation_timeout
+            )
+        )
+
+    def receive_response(self, status, data):
+        """ Handle the response to a Receive request.
+
+        Returns
+        -------
+        output : list
+            Deserialized output objects.
+        """
+        output = []
+        for message in _receive_messages(self._defragmenter, status, data):
+            message_type = message.message_type
+            if message_type == msg.PIPELINE_OUTPUT:
+                output.append(clixml.loads(message.data))
+            elif message_type == msg.ERROR_RECORD:
+                self.errors.append(clixml.loads(message.data))
+            elif message_type == msg.PIPELINE_STATE:
+                value = clixml.loads(message.data)
+                self.state = value.properties["PipelineState"]
+                self.exception = value.properties.get(
+                    "ExceptionAsErrorRecord"
+                )
+        return output
+
+    def stop_request(self):
+        return etree.tostring(
+            envelopes.signal(
+                self.pool.shell_id, self.command_id, envelopes.SIGNAL_STOP
+            )
+        )
+
+    def stop_response(self, status, data):
+        check_status(status, data)
+
+    def raise_for_state(self):
+        """ Raise PSRPError if the pipeline failed or was stopped.
+        """
+        if self.state == PIPELINE_FAILED:
+            raise PSRPError(
+                "Pipeline failed: {}".format(_error_message(self.exception))
+            )
+        elif self.state == PIPELINE_STOPPED:
+            raise PSRPError("Pipeline stopped")
+
+
+def _receive_messages(defragmenter, status, data):
+    """ Return the messages of a Receive response.
+    """
+    if status == 500 and fault_subcode(data) == "TimedOut":
+        # No output within OperationTimeout
+        return []
+    check_status(status, data)
+
+    parser = ReceiveParser()
+    parser.feed(data)
+    stdout, _, _, _ = parser.close()
+    return [msg.Message.unpack(blob) for blob in defragmenter.feed(stdout)]
+
+
+def _error_message(error_record):
+    if error_record is None:
+        return "unknown error"
+    return str(error_record)
@@ -0,0 +1,153 @@
+from ..constants import TranportKind
+from ..core import _post
+from ..sansio import protocol_property
+from ..tracing import NULL_TRACER
+from ..utils import parse_host
+from .protocol import RunspacePoolProtocol
+
+
+class RunspacePool(object):
+    """ Async context manager for a remote PowerShell runspace pool.
+
+    The runspaces are created once, when the pool is opened, and every
+    pipeline runs in one of them: scripts do not pay for the startup of a
+    new powershell.exe.
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        Session used for every request.
+    host : str
+        Host, as accepted by parse_host.
+    min_runspaces, max_runspaces : int
+        Bounds of the number of runspaces in the pool, i.e. of the number of
+        pipelines running at once.
+    max_envelope_size : int or None
+        MaxEnvelopeSize, in bytes, of Receive requests.
+    operation_timeout : float or None
+        OperationTimeout, in seconds, of Receive requests.
+    tracer : aiowinrm.tracing.Tracer or None
+        Tracer of every request of the pool and its pipelines. If None,
+        requests are not traced.
+
+    Example
+    -------
+    >>> async with RunspacePool(session, host) as pool:
+    ...     for service in await pool.run("Get-Service"):
+    ...         print(service.properties["Name"])
+    """
+    def __init__(self, session, host, min_runspaces=1, max_runspaces=1,
+                 max_envelope_size=None, operation_timeout=None,
+                 tracer=None):
+        self._session = session
+        self.tracer = NULL_TRACER if tracer is None else tracer
+
+        self.host = parse_host(host, transport=TranportKind.http)
+
+        self.protocol = RunspacePoolProtocol(
+            min_runspaces, max_runspaces, max_envelope_size,
+            operation_timeout
+        )
+
+    shell_id = protocol_property("shell_id")
+    state = protocol_property("state")
+    application_private_data = protocol_property("application_private_data")
+
+    async def __aenter__(self):
+        protocol = self.protocol
+        status, data = await _post(
+            self._session, self.host, protocol.create_request(), self.tracer
+        )
+        protocol.create_response(status, data)
+
+        try:
+            while not protocol.is_opened:
+                status, data = await _post(
+                    self._session, self.host, protocol.receive_request(),
+                    self.tracer
+                )
+                protocol.receive_response(status, data)
+        except BaseException:
+            try:
+                await self._close()
+            except Exception:
+                # Report the reason the pool could not be opened instead
+                pass
+            raise
+        return self
+
+    async def __aexit__(self, *a, **kw):
+        if self.shell_id is None:
+            raise RuntimeError("__aexit__ called without __aenter__")
+        await self._close()
+
+    async def _close(self):
+        status, data = await _post(
+            self._session, self.host, self.protocol.close_request(),
+            self.tracer
+        )
+        self.protocol.close_response(status, data)
+
+    def pipeline(self, script):
+        """ Create a pipeline running the given script, to be used as an
+        async context manager.
+        """
+        return Pipeline(self, script)
+
+    async def run(self, script):
+        """ Run a script, and return the list of its output objects.
+
+        Raises PSRPError if the pipeline fails.
+        """
+        async with self.pipeline(script) as pipeline:
+            return [obj async for obj in pipeline.stream()]
+
+
+class Pipeline(object):
+    """ Async context manager for a pipeline of a RunspacePool.
+
+    Leaving the context before the pipeline is done stops it.
+    """
+    def __init__(self, runspace_pool, script):
+        self._runspace_pool = runspace_pool
+        self.protocol = runspace_pool.protocol.pipeline(script)
+
+    script = protocol_property("script")
+    state = protocol_property("state")
+    is_done = protocol_property("is_done")
+    # Error records of non-terminating errors
+    errors = protocol_property("errors")
+
+    async def __aenter__(self):
+        status, data = await self._post(self.protocol.create_request())
+        self.protocol.create_response(status, data)
+        return self
+
+    async def __aexit__(self, *a, **kw):
+        if self.protocol.command_id is None:
+            raise RuntimeError("__aexit__ called without __aenter__")
+
+        if not self.is_done:
+            status, data = await self._post(self.protocol.stop_request())
+            self.protocol.stop_response(status, data)
+
+    async def stream(self):
+        """ Asynchronously iterate over the output objects of the pipeline,
+        as they come.
+
+        Raises PSRPError once the output is exhausted if the pipeline
+        failed.
+        """
+        protocol = self.protocol
+        while not protocol.is_done:
+            status, data = await self._post(protocol.receive_request())
+            for obj in protocol.receive_response(status, data):
+                yield obj
+        protocol.raise_for_state()
+
+    def _post(self, payload):
+        runspace_pool = self._runspace_pool
+        return _post(
+            runspace_pool._session, runspace_pool.host, payload,
+            runspace_pool.tracer
+        )
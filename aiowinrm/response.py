@@ -0,0 +1,98 @@
+from attr import attributes, attr
+
+
+class Response(object):
+    """ Outcome of a command.
+
+    The output is kept as received, as bytes-like objects (bytes, bytearray
+    or memoryview). stdout and stderr are decoded with encoding on first
+    access only.
+
+    Parameters
+    ----------
+    stdout, stderr : bytes-like or str
+        Raw output of the command. str output is encoded with encoding.
+    returncode : int
+        Exit code of the command.
+    encoding : str
+        Encoding of the output, as given by the WINRS_CODEPAGE of the shell.
+    """
+    __slots__ = (
+        "_stdout", "_stderr", "returncode", "encoding", "_stdout_text",
+        "_stderr_text",
+    )
+
+    def __init__(self, stdout, stderr, returncode, encoding="utf-8"):
+        if not isinstance(returncode, int):
+            raise TypeError(
+                "returncode must be an int, got {!r}".format(returncode)
+            )
+        self._stdout, self._stdout_text = _output(stdout, encoding)
+        self._stderr, self._stderr_text = _output(stderr, encoding)
+        self.returncode = returncode
+        self.encoding = encoding
+
+    def __repr__(self):
+        return "Response(stdout=<{} bytes>, stderr=<{} bytes>, " \
+            "returncode={!r})".format(
+                self._stdout.nbytes, self._stderr.nbytes, self.returncode
+            )
+
+    def __eq__(self, other):
+        if not isinstance(other, Response):
+            return NotImplemented
+        return (
+            self.returncode == other.returncode
+            and self._stdout == other._stdout
+            and self._stderr == other._stderr
+        )
+
+    __hash__ = None
+
+    @property
+    def stdout_bytes(self):
+        """ Raw stdout, as a read-only memoryview.
+        """
+        return self._stdout.toreadonly()
+
+    @property
+    def stderr_bytes(self):
+        """ Raw stderr, as a read-only memoryview.
+        """
+        return self._stderr.toreadonly()
+
+    @property
+    def stdout(self):
+        if self._stdout_text is None:
+            self._stdout_text = str(self._stdout, self.encoding)
+        return self._stdout_text
+
+    @property
+    def stderr(self):
+        if self._stderr_text is None:
+            self._stderr_text = str(self._stderr, self.encoding)
+        return self._stderr_text
+
+
+def _output(data, encoding):
+    """ Return the memoryview and decoded text, if already known, of the
+    output data.
+    """
+    if isinstance(data, str):
+        return memoryview(data.encode(encoding)), data
+    return memoryview(data), None
+
+
+@attributes
+class HostResult:
+    """ Outcome of running a command on one host of a fan-out.
+
+    Exactly one of response and exception is set.
+    """
+    host = attr()
+    response = attr(default=None)
+    exception = attr(default=None)
+
+    @property
+    def ok(self):
+        return self.exception is None
@@ -0,0 +1,237 @@
+""" Retries with backoff, and per host circuit breakers.
+
+A RetryPolicy decides whether a failed operation is tried again, and how
+long to wait before. A CircuitBreaker stops sending anything to a host after
+a number of consecutive failures, for a while, so that an unreachable or
+overloaded host fails fast instead of stalling a fan-out and receiving a
+storm of retries.
+"""
+import asyncio
+import itertools
+import random
+import threading
+import time
+
+import aiohttp
+
+from .errors import AIOWinRMException, CircuitOpenError
+
+
+def is_transient(exception):
+    """ Return True if the operation which raised exception may succeed if
+    tried again later.
+    """
+    if isinstance(exception, AIOWinRMException):
+        return exception.transient
+    return isinstance(
+        exception, (OSError, asyncio.TimeoutError,
+                    aiohttp.ClientConnectionError)
+    )
+
+
+class RetryPolicy(object):
+    """ Exponential backoff with full jitter.
+
+    Parameters
+    ----------
+    max_attempts : int
+        Maximum number of attempts, the first one included.
+    initial_backoff : float
+        Upper bound of the delay, in seconds, before the first retry.
+    max_backoff : float
+        Upper bound of any delay, in seconds.
+    multiplier : float
+        Factor applied to the upper bound of the delay after each retry.
+    jitter : bool
+        If True, delays are drawn uniformly between 0 and their upper bound,
+        so that clients failing together do not retry together.
+    retryable : callable
+        Called with the exception of a failed attempt, returns True if it is
+        worth trying again.
+    """
+    def __init__(self, max_attempts=3, initial_backoff=0.5, max_backoff=30.0,
+                 multiplier=2.0, jitter=True, retryable=is_transient):
+        if max_attempts < 1:
+            raise ValueError(
+                "max_attempts must be at least 1, got {}".format(
+                    max_attempts
+                )
+            )
+        self.max_attempts = max_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.retryable = retryable
+
+    def should_retry(self, exception, attempt):
+        """ Return True if attempt (counting from 1) failing with exception
+        should be followed by another one.
+        """
+        return attempt < self.max_attempts and self.retryable(exception)
+
+    def backoff(self, attempt):
+        """ Return the delay, in seconds, after attempt (counting from 1)
+        failed.
+        """
+        delay = min(
+            self.initial_backoff * self.multiplier ** (attempt - 1),
+            self.max_backoff
+        )
+        if self.jitter:
+            delay *= random.random()
+        return delay
+
+
+# Circuit states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker(object):
+    """ Per host circuit breaker.
+
+    After failure_threshold consecutive failures, the circuit of a host
+    opens: calls are refused with CircuitOpenError for reset_timeout seconds.
+    The circuit is then half-open: a single trial call is let through, which
+    closes the circuit if it succeeds, and opens it again otherwise.
+
+    A CircuitBreaker may be shared between threads, e.g. by the workers of
+    sync.Session.map.
+
+    Parameters
+    ----------
+    failure_threshold : int
+        Consecutive failures opening the circuit.
+    reset_timeout : float
+        Seconds a circuit stays open.
+    clock : callable
+        Returns the current time, in seconds.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+
+        # host -> number of consecutive failures
+        self._failures = {}
+        # host -> time the circuit opened at
+        self._opened_at = {}
+        # Hosts with a trial call in flight
+        self._trials = set()
+        self._lock = threading.Lock()
+
+    def state(self, host):
+        opened_at = self._opened_at.get(host)
+        if opened_at is None:
+            return CLOSED
+        if self.clock() - opened_at < self.reset_timeout:
+            return OPEN
+        return HALF_OPEN
+
+    def check(self, host):
+        """ Raise CircuitOpenError if a call to host should not be made.
+        """
+        with self._lock:
+            state = self.state(host)
+            if state == OPEN \
+                    or (state == HALF_OPEN and host in self._trials):
+                raise CircuitOpenError(
+                    "Circuit open for {} after {} consecutive "
+                    "failures".format(host, self._failures[host]),
+                    host
+                )
+            if state == HALF_OPEN:
+                self._trials.add(host)
+
+    def record_success(self, host):
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+            self._trials.discard(host)
+
+    def record_abandon(self, host):
+        """ Account for a call given up before completion, e.g. cancelled,
+        which says nothing about the host.
+        """
+        with self._lock:
+            self._trials.discard(host)
+
+    def record_failure(self, host):
+        with self._lock:
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+            self._trials.discard(host)
+            if failures >= self.failure_threshold:
+                self._opened_at[host] = self.clock()
+
+
+async def call_with_retry(func, host, retry_policy=None,
+                          circuit_breaker=None):
+    """ Await func() until it succeeds, as allowed by retry_policy and
+    circuit_breaker.
+
+    Parameters
+    ----------
+    func : coroutine function
+        Called without arguments for every attempt.
+    host : str
+        Host the attempts are made to, the key of circuit_breaker.
+    retry_policy : RetryPolicy or None
+        If None, a single attempt is made.
+    circuit_breaker : CircuitBreaker or None
+        If given, attempts are refused with CircuitOpenError while the
+        circuit of host is open.
+    """
+    for attempt in itertools.count(1):
+        if circuit_breaker is not None:
+            circuit_breaker.check(host)
+        try:
+            result = await func()
+        except Exception as e:
+            delay = _failed(e, host, attempt, retry_policy, circuit_breaker)
+        except BaseException:
+            if circuit_breaker is not None:
+                circuit_breaker.record_abandon(host)
+            raise
+        else:
+            if circuit_breaker is not None:
+                circuit_breaker.record_success(host)
+            return result
+        await asyncio.sleep(delay)
+
+
+def call_with_retry_sync(func, host, retry_policy=None,
+                         circuit_breaker=None):
+    """ Blocking equivalent of call_with_retry.
+    """
+    for attempt in itertools.count(1):
+        if circuit_breaker is not None:
+            circuit_breaker.check(host)
+        try:
+            result = func()
+        except Exception as e:
+            delay = _failed(e, host, attempt, retry_policy, circuit_breaker)
+        except BaseException:
+            if circuit_breaker is not None:
+                circuit_breaker.record_abandon(host)
+            raise
+        else:
+            if circuit_breaker is not None:
+                circuit_breaker.record_success(host)
+            return result
+        time.sleep(delay)
+
+
+def _failed(exception, host, attempt, retry_policy, circuit_breaker):
+    """ Account for a failed attempt, and return the delay before the next
+    one. Raises exception if there should be none.
+    """
+    if circuit_breaker is not None:
+        circuit_breaker.record_failure(host)
+    if retry_policy is None \
+            or not retry_policy.should_retry(exception, attempt):
+        raise exception
+    return retry_policy.backoff(attempt)
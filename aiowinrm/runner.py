@@ -0,0 +1,234 @@
+""" Fan-out of a command across several worker processes.
+
+A single event loop is bound to one core. run_cmd_sharded splits the hosts
+between worker processes, each running run_cmd_many with its own event
+loop and connection pool, and merges their results back into one async
+iterator.
+
+Hosts are assigned to workers by a hash of their endpoint, so that every
+command to a given host goes through the same worker, and limit_per_host
+holds across workers. Workers send each result as soon as it is known,
+pickled in one message of a multiprocessing pipe (which frames messages
+with their length).
+"""
+import asyncio
+import collections
+import concurrent.futures
+import multiprocessing
+import pickle
+import zlib
+
+from .constants import DEFAULT_DNS_TTL, TranportKind
+from .errors import AIOWinRMException
+from .fanout import run_cmd_many
+from .response import HostResult, Response
+from .utils import parse_host
+
+
+class WorkerError(AIOWinRMException):
+    """ A worker process failed, or an exception raised in a worker could
+    not be sent back as is.
+
+    Attributes
+    ----------
+    type_name : str or None
+        Name of the class of the original exception, if any.
+    """
+    def __init__(self, message, type_name=None):
+        super(WorkerError, self).__init__(message)
+        self.type_name = type_name
+
+    def __reduce__(self):
+        return WorkerError, (str(self), self.type_name)
+
+
+async def run_cmd_sharded(hosts, auth, command, args=(), env=None, cwd=None,
+                          processes=None, limit=100, limit_per_host=1,
+                          timeout=None, rate=None, ordered=True,
+                          progress=None, dns_ttl=DEFAULT_DNS_TTL):
+    """ Run the given command on every host, from several processes.
+
+    Parameters
+    ----------
+    hosts : iterable of str
+        Hosts to run the command on.
+    auth : aiohttp.BasicAuth or None
+        Credentials used for every host.
+    command, args, env, cwd :
+        As for run_cmd_many.
+    processes : int or None
+        Number of worker processes, the number of CPUs by default.
+    limit : int
+        Maximum number of commands in flight across all workers.
+    limit_per_host : int
+        Maximum number of commands in flight on a single host.
+    timeout : float or None
+        Deadline in seconds of every worker, see run_cmd_many.
+    rate : float or None
+        Maximum number of commands started per second across all workers.
+    ordered : bool
+        If True, results are yielded in the order of hosts. Otherwise, as
+        they come.
+    progress : callable or None
+        Called as progress(done, total) after every result.
+    dns_ttl : float or None
+        As for run_cmd_many, in every worker.
+
+    Yields
+    ------
+    result : HostResult
+        One result per host.
+    """
+    hosts = list(hosts)
+    if not hosts:
+        return
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(hosts)))
+
+    shards = [[] for _ in range(processes)]
+    for index, host in enumerate(hosts):
+        key = parse_host(host, transport=TranportKind.http)
+        shards[zlib.crc32(key.encode("utf8")) % processes].append(
+            (index, host)
+        )
+    shards = [shard for shard in shards if shard]
+
+    options = {
+        "env": env, "cwd": cwd, "timeout": timeout,
+        "limit": max(1, limit // len(shards)),
+        "limit_per_host": limit_per_host,
+        "rate": None if rate is None else rate / len(shards),
+        "dns_ttl": dns_ttl,
+    }
+
+    context = multiprocessing.get_context("spawn")
+    loop = asyncio.get_event_loop()
+    results = asyncio.Queue()
+    workers = []
+    # Blocking reads of the pipes happen in these threads
+    readers = concurrent.futures.ThreadPoolExecutor(len(shards))
+    try:
+        for shard in shards:
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=_worker,
+                args=(sender, shard, auth, command, tuple(args), options),
+                daemon=True,
+            )
+            process.start()
+            sender.close()
+            workers.append((
+                process, receiver,
+                asyncio.ensure_future(_read_results(
+                    loop, readers, process, receiver, shard, results
+                )),
+            ))
+
+        buffered = {}
+        next_index = 0
+        for done in range(1, len(hosts) + 1):
+            index, result = await results.get()
+            if progress is not None:
+                progress(done, len(hosts))
+            if not ordered:
+                yield result
+                continue
+            buffered[index] = result
+            while next_index in buffered:
+                yield buffered.pop(next_index)
+                next_index += 1
+    finally:
+        for process, receiver, task in workers:
+            task.cancel()
+            if process.is_alive():
+                process.terminate()
+        for process, receiver, task in workers:
+            await asyncio.gather(task, return_exceptions=True)
+            # Unblocks a reader thread still waiting on the pipe
+            receiver.close()
+            process.join()
+        readers.shutdown(wait=False)
+
+
+async def _read_results(loop, readers, process, receiver, shard, results):
+    """ Put the (index, HostResult) of every host of shard in results, as
+    they come from the worker.
+    """
+    remaining = dict(shard)
+    while remaining:
+        try:
+            data = await loop.run_in_executor(readers, receiver.recv_bytes)
+        except (EOFError, OSError):
+            break
+        index, result = _load_result(data)
+        del remaining[index]
+        results.put_nowait((index, result))
+
+    if remaining:
+        # The worker died before sending every result
+        await loop.run_in_executor(readers, process.join, 5)
+        error = WorkerError(
+            "Worker process exited with code {}".format(process.exitcode)
+        )
+        for index, host in remaining.items():
+            results.put_nowait((index, HostResult(host, exception=error)))
+
+
+def _worker(sender, shard, auth, command, args, options):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(
+            _run_shard(sender, shard, auth, command, args, options)
+        )
+    finally:
+        loop.close()
+        sender.close()
+
+
+async def _run_shard(sender, shard, auth, command, args, options):
+    # host -> indices of the host in the whole list, hosts may repeat
+    indices = collections.defaultdict(collections.deque)
+    for index, host in shard:
+        indices[host].append(index)
+
+    async for result in run_cmd_many(
+        [host for _, host in shard], auth, command, args, **options
+    ):
+        index = indices[result.host].popleft()
+        sender.send_bytes(_dump_result(index, result))
+
+
+def _dump_result(index, result):
+    response = result.response
+    if response is None:
+        response_state = None
+    else:
+        response_state = (
+            bytes(response.stdout_bytes), bytes(response.stderr_bytes),
+            response.returncode, response.encoding,
+        )
+
+    exception = result.exception
+    if exception is not None:
+        try:
+            # Exceptions whose __init__ does not match their args cannot be
+            # unpickled
+            pickle.loads(pickle.dumps(exception))
+        except Exception:
+            exception = WorkerError(
+                "{}: {}".format(type(exception).__name__, exception),
+                type(exception).__name__
+            )
+
+    return pickle.dumps(
+        (index, result.host, response_state, exception),
+        pickle.HIGHEST_PROTOCOL
+    )
+
+
+def _load_result(data):
+    index, host, response_state, exception = pickle.loads(data)
+    response = None if response_state is None else Response(*response_state)
+    return index, HostResult(host, response=response, exception=exception)
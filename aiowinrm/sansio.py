@@ -0,0 +1,336 @@
+""" I/O free implementation of the WinRM shell protocol.
+
+ShellProtocol and CommandProtocol produce the payload of each request, and
+consume the status and body of the matching response. They know nothing
+about HTTP sessions, so the asyncio (core) and blocking (sync) clients are
+thin transports over the same state machines.
+"""
+import lxml.etree as etree
+
+from .constants import DEFAULT_CODEPAGE, DEFAULT_MAX_ENVELOPE_SIZE
+from .errors import (
+    AuthenticationError, EncodingLimitFault, OperationTimeoutFault,
+    TransportError, wsman_fault
+)
+from .polling import PollScheduler
+from .soap.protocol import (
+    create_shell_payload, close_shell_payload, get_shell_payload,
+    parse_create_shell_response,
+    create_command, parse_create_command_response, cleanup_command,
+    command_output, parse_fault, send_input, ReceiveParser
+)
+from .soap.template import render_envelope
+from .tuning import EnvelopeSizeTuner
+from .utils import codepage_encoding
+
+
+# Keyword arguments of CommandProtocol, besides shell_id, command and args
+COMMAND_OPTIONS = (
+    "max_envelope_size", "operation_timeout", "adaptive_envelope_size",
+    "console_mode_stdin", "pipeline_depth",
+)
+
+
+def protocol_property(name):
+    """ Read-only property forwarding to the same attribute of the protocol
+    of a transport.
+    """
+    return property(lambda self: getattr(self.protocol, name))
+
+
+def check_status(status, data=None):
+    """ Raise if status is not the one of a successful WinRM response.
+    """
+    if status != 200:
+        raise response_error(status, data)
+
+
+def response_error(status, data=None):
+    """ Return the exception for an unsuccessful response: a WSManFault if
+    data is a SOAP fault, a TransportError otherwise.
+    """
+    if data:
+        fault = parse_fault(data)
+        if fault is not None:
+            return wsman_fault(status, fault)
+    message = "Unhandled http error {}".format(status)
+    if status == 401:
+        return AuthenticationError(message, status)
+    return TransportError(message, status)
+
+
+class ShellProtocol(object):
+    """ State of a remote shell.
+
+    Parameters
+    ----------
+    env : dict or None
+        Key/value pairs for the running environment
+    cwd : str or None
+        Current directory in the created shell
+    max_envelope_size : int or None
+        MaxEnvelopeSize, in bytes, asked for when receiving output of the
+        commands of this shell. If None, the server default is used.
+    operation_timeout : float or None
+        OperationTimeout, in seconds, of Receive requests.
+    adaptive_envelope_size : bool
+        If True, commands grow the envelope size while the output fills the
+        envelopes, starting from max_envelope_size.
+    pipeline_depth : int
+        Number of Receive requests kept outstanding by the commands of this
+        shell. 1 means one request at a time.
+    codepage : int
+        WINRS_CODEPAGE of the shell, i.e. the Windows code page of the output
+        of its commands.
+    """
+    def __init__(self, env=None, cwd=None, max_envelope_size=None,
+                 operation_timeout=None, adaptive_envelope_size=False,
+                 pipeline_depth=1, codepage=DEFAULT_CODEPAGE):
+        self.env = env
+        self.cwd = cwd
+        self.codepage = codepage
+        # Python codec of the output of commands
+        self.encoding = codepage_encoding(codepage)
+
+        self.max_envelope_size = max_envelope_size
+        self.operation_timeout = operation_timeout
+        self.adaptive_envelope_size = adaptive_envelope_size
+        self.pipeline_depth = pipeline_depth
+
+        self.shell_id = None
+
+    def create_request(self):
+        return etree.tostring(
+            create_shell_payload(self.env, self.cwd, self.codepage)
+        )
+
+    def create_response(self, status, data):
+        check_status(status, data)
+        self.shell_id = parse_create_shell_response(data)
+
+    def close_request(self):
+        if self.shell_id is None:
+            raise RuntimeError("Shell closed before being created")
+        return etree.tostring(close_shell_payload(self.shell_id))
+
+    def close_response(self, status, data):
+        check_status(status, data)
+
+    def get_request(self):
+        return etree.tostring(get_shell_payload(self.shell_id))
+
+    def get_response(self, status, data):
+        """ Return True if the server still knows about this shell.
+        """
+        return status == 200
+
+    def command(self, command, args=(), **kw):
+        """ Create the protocol of a command in this shell, with the shell's
+        envelope size and timeout settings.
+        """
+        kw.setdefault("max_envelope_size", self.max_envelope_size)
+        kw.setdefault("operation_timeout", self.operation_timeout)
+        kw.setdefault("adaptive_envelope_size", self.adaptive_envelope_size)
+        kw.setdefault("pipeline_depth", self.pipeline_depth)
+        return CommandProtocol(self.shell_id, command, args, **kw)
+
+
+class CommandProtocol(object):
+    """ State of a command running in a remote shell.
+
+    A Receive response may be consumed incrementally: call receive_request,
+    then either receive_failed with the whole body of an error response, or
+    receive_feed with each chunk of a successful one followed by
+    receive_result.
+
+    When pipeline_depth is larger than 1, transports may keep that many
+    Receive requests in flight. Each one is then given a sequence_id,
+    counting from 0, and receive_result must be called in sequence order.
+
+    Transports sending one Receive request at a time should wait for
+    poll_delay() seconds before each of them.
+    """
+    def __init__(self, shell_id, command, args=(), max_envelope_size=None,
+                 operation_timeout=None, adaptive_envelope_size=False,
+                 console_mode_stdin=True, pipeline_depth=1):
+        if pipeline_depth < 1:
+            raise ValueError(
+                "pipeline_depth must be at least 1, got {}".format(
+                    pipeline_depth
+                )
+            )
+
+        self.shell_id = shell_id
+        self.command = command
+        self.args = args
+
+        self.max_envelope_size = max_envelope_size
+        self.operation_timeout = operation_timeout
+        if adaptive_envelope_size:
+            self._tuner = EnvelopeSizeTuner(
+                max_envelope_size or DEFAULT_MAX_ENVELOPE_SIZE
+            )
+        else:
+            self._tuner = None
+
+        # Set to False to pipe binary data to stdin
+        self.console_mode_stdin = console_mode_stdin
+        self.pipeline_depth = pipeline_depth
+
+        self.command_id = None
+
+        self.return_code = None
+        self.is_done = False
+
+        self.poll_scheduler = PollScheduler(operation_timeout)
+
+        # sequence_id -> [parser, bytes received, MaxEnvelopeSize asked for,
+        # time sent at]
+        self._receives = {}
+
+    @property
+    def receive_envelope_size(self):
+        """ MaxEnvelopeSize of the next Receive request.
+        """
+        if self._tuner is None:
+            return self.max_envelope_size
+        return self._tuner.size
+
+    @property
+    def send_envelope_size(self):
+        """ Envelope size budget of Send requests.
+        """
+        return self.max_envelope_size or DEFAULT_MAX_ENVELOPE_SIZE
+
+    @property
+    def poll_stats(self):
+        """ PollStats of the Receive requests of this command.
+        """
+        return self.poll_scheduler.stats
+
+    def poll_delay(self):
+        """ Number of seconds to wait before the next Receive request.
+        """
+        return self.poll_scheduler.next_delay()
+
+    def create_request(self):
+        return etree.tostring(
+            create_command(
+                self.shell_id, self.command, self.args,
+                self.console_mode_stdin
+            )
+        )
+
+    def create_response(self, status, data):
+        check_status(status, data)
+        self.command_id = parse_create_command_response(data)
+
+    def cleanup_request(self):
+        if self.command_id is None:
+            raise RuntimeError("Command cleaned up before being created")
+        return etree.tostring(cleanup_command(self.shell_id, self.command_id))
+
+    def cleanup_response(self, status, data):
+        check_status(status, data)
+
+    def send_request(self, data, end=False):
+        return etree.tostring(
+            send_input(self.shell_id, self.command_id, data, end)
+        )
+
+    def send_response(self, status, data):
+        check_status(status, data)
+
+    def receive_request(self, sequence_id=None):
+        envelope_size = self.receive_envelope_size
+        self._receives[sequence_id] = [
+            ReceiveParser(), 0, envelope_size, self.poll_scheduler.sent()
+        ]
+        if sequence_id is None:
+            return render_envelope(
+                command_output, self.shell_id, self.command_id,
+                envelope_size, self.operation_timeout
+            )
+        # Every sequence id is used once: caching the envelope is not worth
+        # it.
+        return etree.tostring(
+            command_output(
+                self.shell_id, self.command_id, envelope_size,
+                self.operation_timeout, sequence_id
+            )
+        )
+
+    def receive_failed(self, status, data, sequence_id=None):
+        """ Handle an error response to a Receive request.
+
+        Returns
+        -------
+        retry : bool
+            True if the request should be sent again, as given by a new
+            receive_request. Raises otherwise.
+        """
+        _, _, envelope_size, _ = self._receives.pop(sequence_id)
+        error = response_error(status, data)
+        if isinstance(error, OperationTimeoutFault):
+            # No output within OperationTimeout: the command is still running
+            self.poll_scheduler.timed_out()
+            return True
+        if self._tuner is not None and isinstance(error, EncodingLimitFault):
+            # With pipelining, a concurrent request may have lowered the
+            # size already
+            if envelope_size > self._tuner.size \
+                    or self._tuner.limit_exceeded():
+                return True
+        raise error
+
+    def receive_feed(self, data, sequence_id=None):
+        receive = self._receives[sequence_id]
+        receive[0].feed(data)
+        receive[1] += len(data)
+
+    def receive_parsed(self, output, size, sequence_id=None):
+        """ Give the parsed Receive response, e.g. parsed elsewhere with
+        soap.protocol.parse_command_output, instead of feeding its chunks.
+        size is the size of the response body.
+        """
+        receive = self._receives[sequence_id]
+        receive[0] = _ParsedReceive(output)
+        receive[1] += size
+
+    def receive_discard(self, sequence_id=None):
+        """ Forget about a Receive request whose response is not needed.
+        """
+        self._receives.pop(sequence_id, None)
+
+    def receive_result(self, sequence_id=None):
+        """ Finish parsing a Receive response.
+
+        Returns
+        -------
+        stdout, stderr : bytearray
+            Output received.
+        return_code : int or None
+            Exit code of the command, once done.
+        is_done : bool
+            True once the command is done.
+        """
+        parser, received, _, sent_at = self._receives.pop(sequence_id)
+        stdout, stderr, return_code, is_done = parser.close()
+
+        self.poll_scheduler.received(len(stdout) + len(stderr), sent_at)
+        if self._tuner is not None:
+            self._tuner.update(received)
+        if is_done:
+            self.return_code = return_code
+            self.is_done = True
+        return stdout, stderr, return_code, is_done
+
+
+class _ParsedReceive(object):
+    """ Stand-in for the ReceiveParser of an already parsed response.
+    """
+    def __init__(self, output):
+        self._output = output
+
+    def close(self):
+        return self._output
@@ -1,14 +1,25 @@
-import base64
+import binascii
 
 import six
 
 import lxml.etree as etree
 
+from attr import attributes, attr
+
+from ..constants import DEFAULT_CODEPAGE
 from .header import Header
-from .namespaces import NAMESPACE, SOAP_ENV, WIN_SHELL
+from .namespaces import NAMESPACE, SOAP_ENV, WIN_SHELL, WSMAN_FAULT
+
+
+def format_duration(seconds):
+    """ Format a number of seconds as an xs:duration, e.g. PT20S.
+    """
+    if seconds == int(seconds):
+        return "PT{}S".format(int(seconds))
+    return "PT{:.3f}S".format(seconds)
 
 
-def create_shell_payload(env=None, cwd=None):
+def create_shell_payload(env=None, cwd=None, codepage=DEFAULT_CODEPAGE):
     """ Create the XML payload to create a new shell.
 
     Parameters
@@ -17,6 +28,8 @@ def create_shell_payload(env=None, cwd=None):
         Key/value pairs for the running environment
     cwd : str or None
         Current directory in the created shell
+    codepage : int
+        Windows code page of the output of the commands of the shell
 
     Returns
     -------
@@ -25,7 +38,9 @@ def create_shell_payload(env=None, cwd=None):
     """
     header = Header(
         action="http://schemas.xmlsoap.org/ws/2004/09/transfer/Create",
-        options={"WINRS_NOPROFILE": "FALSE", "WINRS_CODEPAGE": "65001"},
+        options={
+            "WINRS_NOPROFILE": "FALSE", "WINRS_CODEPAGE": str(codepage),
+        },
     )
 
     body = etree.Element(SOAP_ENV + "Body")
@@ -71,6 +86,33 @@ def close_shell_payload(shell_id):
     return envelope
 
 
+def get_shell_payload(shell_id):
+    """ Create the XML payload to fetch the state of an existing shell.
+
+    Parameters
+    ----------
+    shell_id : str
+        Id of the shell to query
+
+    Returns
+    -------
+    envelope : etree.Element
+        lxml node for the whole envelope
+    """
+    header = Header(
+        action="http://schemas.xmlsoap.org/ws/2004/09/transfer/Get",
+        shell_id=shell_id,
+    )
+
+    envelope = etree.Element(SOAP_ENV + "Envelope", nsmap=NAMESPACE)
+    envelope.append(header.to_dom())
+
+    body = etree.Element(SOAP_ENV + "Body")
+    envelope.append(body)
+
+    return envelope
+
+
 def parse_create_shell_response(response):
     root = etree.fromstring(response)
     return next(
@@ -79,8 +121,7 @@ def parse_create_shell_response(response):
     ).text
 
 
-def create_command(shell_id, command, args=()):
-    console_mode_stdin = True
+def create_command(shell_id, command, args=(), console_mode_stdin=True):
     skip_cmd_shell = False
 
     header = Header(
@@ -143,14 +184,46 @@ def parse_create_command_response(response):
     ).text
 
 
-def command_output(shell_id, command_id):
+def command_output(shell_id, command_id, max_envelope_size=None,
+                   operation_timeout=None, sequence_id=None):
+    """ Create the XML payload to receive the output of a command.
+
+    Parameters
+    ----------
+    shell_id : str
+        Id of the shell running the command
+    command_id : str
+        Id of the command
+    max_envelope_size : int or None
+        Maximum size of the response in bytes. If None, the server default
+        is used.
+    operation_timeout : float or None
+        Seconds the server may wait for output before answering. If None,
+        the Header default is used.
+    sequence_id : int or None
+        Position of this request among the Receive requests of the command,
+        so that the server answers concurrent requests in order.
+
+    Returns
+    -------
+    envelope : etree.Element
+        lxml node for the whole envelope
+    """
+    kw = {}
+    if operation_timeout is not None:
+        kw["timeout"] = format_duration(operation_timeout)
+
     header = Header(
         action='http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Receive',  # NOQA
         shell_id=shell_id,
+        max_envelope_size=max_envelope_size,
+        **kw
     )
 
     body = etree.Element(SOAP_ENV + "Body")
     receive = etree.SubElement(body, WIN_SHELL + "Receive")
+    if sequence_id is not None:
+        receive.set("SequenceId", str(sequence_id))
     desired_stream = etree.SubElement(
         receive, WIN_SHELL + "DesiredStream", CommandId=command_id
     )
@@ -163,51 +236,241 @@ def command_output(shell_id, command_id):
     return envelope
 
 
-def parse_command_output(response):
-    root = etree.fromstring(response)
-    stream_nodes = [
-        node for node in root.findall('.//*')
-        if node.tag.endswith('Stream')
-    ]
-
-    buffer_stdout = []
-    buffer_stderr = []
-    return_code = None
-
-    for stream_node in stream_nodes:
-        if not stream_node.text:
-            continue
-        if stream_node.attrib['Name'] == 'stdout':
-            buffer_stdout.append(
-                base64.b64decode(stream_node.text.encode('ascii'))
-            )
-        elif stream_node.attrib['Name'] == 'stderr':
-            buffer_stderr.append(
-                base64.b64decode(stream_node.text.encode('ascii'))
-            )
+def send_input(shell_id, command_id, data, end=False):
+    """ Create the XML payload to send data to the stdin of a command.
 
-    # We may need to get additional output if the stream has not finished.
-    # The CommandState will change from Running to Done like so:
-    # @example
-    #   from...
-    #   <rsp:CommandState CommandId="..." #   State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Running"/>  # NOQA
-    #   to...
-    #   <rsp:CommandState CommandId="..." #   State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Done"> #   # NOQA
-    #     <rsp:ExitCode>0</rsp:ExitCode>
-    #   </rsp:CommandState>
-    command_done = len([
-        node for node in root.findall('.//*')
-        if node.get('State', '').endswith('CommandState/Done')]) == 1
-
-    if command_done:
-        return_code = int(
-            next(
-                node for node in root.findall('.//*')
-                if node.tag.endswith('ExitCode')
-            ).text
-        )
+    Parameters
+    ----------
+    shell_id : str
+        Id of the shell running the command
+    command_id : str
+        Id of the command
+    data : bytes
+        Raw data to send
+    end : bool
+        If True, stdin is closed after this data
 
-    return (
-        b"".join(buffer_stdout), b"".join(buffer_stderr),
-        return_code, command_done
+    Returns
+    -------
+    envelope : etree.Element
+        lxml node for the whole envelope
+    """
+    header = Header(
+        action='http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Send',  # NOQA
+        shell_id=shell_id,
+    )
+
+    body = etree.Element(SOAP_ENV + "Body")
+    send = etree.SubElement(body, WIN_SHELL + "Send")
+    stream = etree.SubElement(
+        send, WIN_SHELL + "Stream", Name="stdin", CommandId=command_id
+    )
+    if end:
+        stream.set("End", "true")
+    stream.text = binascii.b2a_base64(data, newline=False).decode("ascii")
+
+    envelope = etree.Element(SOAP_ENV + "Envelope", nsmap=NAMESPACE)
+    envelope.append(header.to_dom())
+    envelope.append(body)
+
+    return envelope
+
+
+@attributes
+class Fault:
+    """ Content of a SOAP fault.
+    """
+    # Local name of the fault code, e.g. "Sender" or "Receiver"
+    code = attr()
+    # Local name of the fault subcode, e.g. "EncodingLimit"
+    subcode = attr()
+    reason = attr(default=None)
+    # Code of the WSManFault detail, a Windows error code
+    wsman_code = attr(default=None)
+    machine = attr(default=None)
+    message = attr(default=None)
+
+
+def parse_fault(response):
+    """ Return the Fault in response, or None if response is not a SOAP
+    fault.
+    """
+    try:
+        root = etree.fromstring(response)
+    except etree.XMLSyntaxError:
+        return None
+
+    fault = root.find("./{0}Body/{0}Fault".format(SOAP_ENV))
+    if fault is None:
+        return None
+
+    code = fault.findtext("./{0}Code/{0}Value".format(SOAP_ENV))
+    subcode = fault.findtext(
+        "./{0}Code/{0}Subcode/{0}Value".format(SOAP_ENV)
+    )
+    reason = fault.findtext("./{0}Reason/{0}Text".format(SOAP_ENV))
+
+    wsman_code = machine = message = None
+    detail = fault.find(
+        "./{}Detail/{}WSManFault".format(SOAP_ENV, WSMAN_FAULT)
     )
+    if detail is not None:
+        if detail.get("Code") is not None:
+            wsman_code = int(detail.get("Code"))
+        machine = detail.get("Machine")
+        message_node = detail.find(WSMAN_FAULT + "Message")
+        if message_node is not None:
+            message = "".join(message_node.itertext()).strip()
+
+    return Fault(
+        _local_name(code), _local_name(subcode),
+        reason.strip() if reason else None, wsman_code, machine, message
+    )
+
+
+def fault_subcode(response):
+    """ Return the local name of the SOAP fault subcode of response, e.g.
+    "EncodingLimit", or None if response is not a fault.
+    """
+    fault = parse_fault(response)
+    if fault is None:
+        return None
+    return fault.subcode
+
+
+def _local_name(value):
+    if value is None:
+        return None
+    return value.rpartition(":")[2].strip()
+
+
+class ReceiveParser(object):
+    """ Incremental, single-pass parser for Receive responses.
+
+    Streams, command state and exit code are extracted in one pass over the
+    document, which can be fed in chunks as they come from the network.
+
+    Example
+    -------
+    >>> parser = ReceiveParser()
+    >>> for chunk in chunks:
+    ...     parser.feed(chunk)
+    >>> stdout, stderr, return_code, is_done = parser.close()
+    """
+    def __init__(self):
+        self._target = _ReceiveTarget()
+        self._parser = etree.XMLParser(target=self._target)
+
+    def feed(self, data):
+        self._parser.feed(data)
+
+    def close(self):
+        """ Finish parsing, and return (stdout, stderr, return_code, done).
+
+        stdout and stderr are bytearrays.
+        """
+        return self._parser.close()
+
+
+class _ReceiveTarget(object):
+    _STREAM = WIN_SHELL + "Stream"
+    _COMMAND_STATE = WIN_SHELL + "CommandState"
+    _EXIT_CODE = WIN_SHELL + "ExitCode"
+
+    def __init__(self):
+        # stream name -> list of base64 encoded chunks
+        self._chunks = {"stdout": [], "stderr": []}
+        # text fragments of the node being read, or None to ignore text
+        self._text = None
+        self._stream_name = None
+
+        self._command_done = False
+        self._exit_code = None
+
+    def start(self, tag, attrib):
+        if tag == self._STREAM:
+            name = attrib.get("Name")
+            if name in self._chunks:
+                self._stream_name = name
+                self._text = []
+        elif tag == self._EXIT_CODE:
+            self._text = []
+        elif tag == self._COMMAND_STATE:
+            # We may need to get additional output if the stream has not
+            # finished. The CommandState will change from Running to Done
+            # like so:
+            # @example
+            #   from...
+            #   <rsp:CommandState CommandId="..." #   State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Running"/>  # NOQA
+            #   to...
+            #   <rsp:CommandState CommandId="..." #   State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Done"> #   # NOQA
+            #     <rsp:ExitCode>0</rsp:ExitCode>
+            #   </rsp:CommandState>
+            if attrib.get("State", "").endswith("CommandState/Done"):
+                self._command_done = True
+
+    def data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def end(self, tag):
+        if self._text is None:
+            return
+
+        if tag == self._STREAM:
+            text = "".join(self._text)
+            if text:
+                self._chunks[self._stream_name].append(text)
+        elif tag == self._EXIT_CODE:
+            self._exit_code = int("".join(self._text))
+        self._text = None
+
+    def close(self):
+        return_code = self._exit_code if self._command_done else None
+        return (
+            _decode_chunks(self._chunks["stdout"]),
+            _decode_chunks(self._chunks["stderr"]),
+            return_code, self._command_done
+        )
+
+
+def _decode_chunks(chunks):
+    """ Decode a list of base64 strings into a single, preallocated
+    bytearray.
+    """
+    size = 0
+    for chunk in chunks:
+        size += len(chunk) // 4 * 3 - chunk.count("=", -2)
+
+    buf = bytearray(size)
+    position = 0
+    for chunk in chunks:
+        decoded = binascii.a2b_base64(chunk)
+        # Slice assignment resizes the buffer if the estimate was off, e.g.
+        # because of embedded whitespace.
+        buf[position:position + len(decoded)] = decoded
+        position += len(decoded)
+    del buf[position:]
+    return buf
+
+
+def parse_command_output(response):
+    """ Parse a Receive response.
+
+    Parameters
+    ----------
+    response : bytes or str
+        The whole response body
+
+    Returns
+    -------
+    stdout : bytearray
+    stderr : bytearray
+    return_code : int or None
+        Exit code of the command, None if it is still running
+    command_done : bool
+        True if the command has finished
+    """
+    parser = ReceiveParser()
+    parser.feed(response)
+    return parser.close()
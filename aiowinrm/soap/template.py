@@ -0,0 +1,64 @@
+import functools
+import uuid
+
+import lxml.etree as etree
+
+from .namespaces import ADDRESSING
+
+
+class EnvelopeTemplate(object):
+    """ A serialized envelope where only the MessageID changes.
+
+    Rendering a template is a bytes concatenation, instead of building and
+    serializing a whole lxml tree.
+    """
+    def __init__(self, prefix, suffix):
+        self._prefix = prefix
+        self._suffix = suffix
+
+    @classmethod
+    def from_envelope(cls, envelope):
+        """ Create a template from an envelope built by soap.protocol.
+
+        Parameters
+        ----------
+        envelope : etree.Element
+            lxml node for the whole envelope, with a MessageID header.
+        """
+        message_id = envelope.find(".//" + ADDRESSING + "MessageID")
+        if message_id is None:
+            raise ValueError("Envelope has no MessageID")
+
+        marker = message_id.text.encode("ascii")
+        data = etree.tostring(envelope)
+        if data.count(marker) != 1:
+            raise ValueError("MessageID appears more than once in envelope")
+
+        prefix, _, suffix = data.partition(marker)
+        return cls(prefix + b"uuid:", suffix)
+
+    def render(self, message_id=None):
+        """ Return the envelope bytes for the given (or a new) message id.
+        """
+        if message_id is None:
+            message_id = uuid.uuid4()
+        return b"".join(
+            (self._prefix, str(message_id).encode("ascii"), self._suffix)
+        )
+
+
+@functools.lru_cache(maxsize=1024)
+def envelope_template(builder, *args):
+    """ Return the (cached) template for builder(*args).
+
+    builder must be one of the soap.protocol envelope builders, and args
+    must be hashable.
+    """
+    return EnvelopeTemplate.from_envelope(builder(*args))
+
+
+def render_envelope(builder, *args):
+    """ Serialize builder(*args) with a fresh MessageID, using the template
+    cache.
+    """
+    return envelope_template(builder, *args).render()
@@ -1,131 +1,390 @@
-import lxml.etree as etree
+import concurrent.futures
+import itertools
+import time
+
 import requests
 
-from attr import attributes, attr
-from attr.validators import instance_of
+from requests.adapters import HTTPAdapter
 
-from .constants import TranportKind
-from .soap.protocol import (
-    cleanup_command, close_shell_payload, command_output, create_command,
-    create_shell_payload, parse_create_shell_response,
-    parse_create_command_response, parse_command_output
+from .capture import CapturedResponse, OutputCapture
+from .constants import (
+    DEFAULT_CAPTURE_MEMORY, DEFAULT_CODEPAGE, TranportKind
+)
+from .response import HostResult, Response
+from .retry import call_with_retry_sync
+from .sansio import (
+    COMMAND_OPTIONS, CommandProtocol, ShellProtocol, protocol_property
 )
+from .tracing import NULL_TRACER
 from .utils import parse_host
 
 
 class ShellContext:
-    def __init__(self, session, host, env=None, cwd=None):
+    """ Context manager for a remote shell, see aiowinrm.core.ShellContext.
+    """
+    def __init__(self, session, host, env=None, cwd=None,
+                 max_envelope_size=None, operation_timeout=None,
+                 adaptive_envelope_size=False, codepage=DEFAULT_CODEPAGE,
+                 tracer=None):
         self._session = session
+        self.tracer = NULL_TRACER if tracer is None else tracer
 
-        self.host = host
-        self.env = env
-        self.cwd = cwd
+        self.host = parse_host(host, transport=TranportKind.http)
 
-        self._shell_id = None
-
-    def __enter__(self):
-        payload = etree.tostring(create_shell_payload(self.env, self.cwd))
-        resp = self._session.post(self.host, data=payload)
-        resp.raise_for_status()
+        self.protocol = ShellProtocol(
+            env, cwd, max_envelope_size, operation_timeout,
+            adaptive_envelope_size, codepage=codepage
+        )
 
-        self._shell_id = parse_create_shell_response(resp.text)
+    env = protocol_property("env")
+    cwd = protocol_property("cwd")
+    max_envelope_size = protocol_property("max_envelope_size")
+    operation_timeout = protocol_property("operation_timeout")
+    adaptive_envelope_size = protocol_property("adaptive_envelope_size")
+    codepage = protocol_property("codepage")
+    encoding = protocol_property("encoding")
+    shell_id = protocol_property("shell_id")
 
+    def __enter__(self):
+        status, data = _post(
+            self._session, self.host, self.protocol.create_request(),
+            self.tracer
+        )
+        self.protocol.create_response(status, data)
         return self
 
     def __exit__(self, *a, **kw):
-        payload = etree.tostring(close_shell_payload(self._shell_id))
-        resp = self._session.post(self.host, data=payload)
-        resp.raise_for_status()
+        status, data = _post(
+            self._session, self.host, self.protocol.close_request(),
+            self.tracer
+        )
+        self.protocol.close_response(status, data)
 
 
 class CommandContext:
+    """ Context manager for a command, see aiowinrm.core.CommandContext.
+    """
     @classmethod
-    def from_shell_context(cls, shell_context, command, args=()):
+    def from_shell_context(cls, shell_context, command, args=(), **kw):
+        protocol_kw = dict(
+            (name, kw.pop(name)) for name in COMMAND_OPTIONS if name in kw
+        )
+        kw.setdefault("tracer", shell_context.tracer)
+        protocol = shell_context.protocol.command(command, args, **protocol_kw)
         return cls(
-            shell_context._session, shell_context.host,
-            shell_context._shell_id, command, args
+            shell_context._session, shell_context.host, protocol.shell_id,
+            protocol.command, protocol.args, protocol=protocol, **kw
         )
 
-    def __init__(self, session, host, shell_id, command, args=()):
+    def __init__(self, session, host, shell_id, command, args=(),
+                 max_envelope_size=None, operation_timeout=None,
+                 adaptive_envelope_size=False, console_mode_stdin=True,
+                 tracer=None, protocol=None):
         self._session = session
-        self._shell_id = shell_id
-
-        self.host = host
-        self.command = command
-        self.args = args
-
-        self._command_id = None
+        self.tracer = NULL_TRACER if tracer is None else tracer
+
+        self.host = parse_host(host, transport=TranportKind.http)
+
+        if protocol is None:
+            protocol = CommandProtocol(
+                shell_id, command, args, max_envelope_size,
+                operation_timeout, adaptive_envelope_size, console_mode_stdin
+            )
+        self.protocol = protocol
+
+    command = protocol_property("command")
+    args = protocol_property("args")
+    max_envelope_size = protocol_property("max_envelope_size")
+    operation_timeout = protocol_property("operation_timeout")
+    console_mode_stdin = protocol_property("console_mode_stdin")
+    shell_id = protocol_property("shell_id")
+    command_id = protocol_property("command_id")
+    return_code = protocol_property("return_code")
+    is_done = protocol_property("is_done")
+    poll_stats = protocol_property("poll_stats")
 
     def __enter__(self):
-        payload = etree.tostring(
-            create_command(self._shell_id, self.command, self.args)
+        status, data = _post(
+            self._session, self.host, self.protocol.create_request(),
+            self.tracer
         )
-        resp = self._session.post(self.host, data=payload)
-        resp.raise_for_status()
-
-        self._command_id = parse_create_command_response(resp.text)
-
+        self.protocol.create_response(status, data)
         return self
 
     def __exit__(self, *a, **kw):
-        payload = etree.tostring(
-            cleanup_command(self._shell_id, self._command_id)
+        status, data = _post(
+            self._session, self.host, self.protocol.cleanup_request(),
+            self.tracer
         )
-        resp = self._session.post(self.host, data=payload)
-        resp.raise_for_status()
+        self.protocol.cleanup_response(status, data)
 
     def _output_request(self):
-        payload = etree.tostring(command_output(self._shell_id, self._command_id))
-        resp = self._session.post(self.host, data=payload)
-        resp.raise_for_status()
-
-        stdout, stderr, return_code, is_done = parse_command_output(resp.text)
-
-        return (
-            stdout.decode("utf8"), stderr.decode("utf8"), return_code, is_done
-        )
-
-    def get_output(self):
-        out_buffer = []
-        err_buffer = []
-
+        protocol = self.protocol
+        delay = protocol.poll_delay()
+        if delay > 0:
+            time.sleep(delay)
+        for retry in itertools.count():
+            status, data = _post(
+                self._session, self.host, protocol.receive_request(),
+                self.tracer, retry
+            )
+            if status == 200:
+                break
+            # Raises unless the request should be sent again
+            protocol.receive_failed(status, data)
+
+        protocol.receive_feed(data)
+        return protocol.receive_result()
+
+    def capture(self, max_memory=DEFAULT_CAPTURE_MEMORY):
+        """ Receive the whole output of the command.
+
+        At most max_memory bytes of each stream are kept in memory, the rest
+        is spilled to a temporary file.
+
+        Returns
+        -------
+        stdout, stderr : OutputCapture
+            Raw output of the command.
+        return_code : int
+        """
+        stdout = OutputCapture(max_memory)
+        stderr = OutputCapture(max_memory)
+        try:
+            is_done = False
+            while not is_done:
+                out, err, return_code, is_done = self._output_request()
+                stdout.write(out)
+                stderr.write(err)
+        except BaseException:
+            stdout.close()
+            stderr.close()
+            raise
+        return stdout, stderr, return_code
+
+    def receive_output(self):
+        """ Receive the whole output of the command, in memory.
+
+        Returns
+        -------
+        stdout, stderr : bytearray
+            Raw output of the command.
+        return_code : int
+        """
+        stdout = bytearray()
+        stderr = bytearray()
         is_done = False
-
         while not is_done:
             out, err, return_code, is_done = self._output_request()
-
-            if out:
-                out_buffer.append(out)
-            if err:
-                err_buffer.append(err)
-
-        return "\n".join(out_buffer), "\n".join(err_buffer), return_code
+            # Keep the parser's buffers as is for output fitting in one
+            # envelope, the common case
+            if stdout:
+                stdout += out
+            else:
+                stdout = out
+            if stderr:
+                stderr += err
+            else:
+                stderr = err
+        return stdout, stderr, return_code
+
+    def get_output(self, encoding="utf-8"):
+        stdout, stderr, return_code = self.receive_output()
+        return (
+            stdout.decode(encoding), stderr.decode(encoding), return_code
+        )
 
 
-@attributes
-class Response:
-    stdout = attr(validator=instance_of(str))
-    stderr = attr(validator=instance_of(str))
-    returncode = attr(validator=instance_of(int))
+def _post(session, url, payload, tracer=NULL_TRACER, retry=0):
+    """ Send a WinRM request, and return its status and body.
+    """
+    span = tracer.start_request(url, payload, retry)
+    try:
+        resp = session.post(url, data=payload)
+    except BaseException as e:
+        span.finish(error=e)
+        raise
+    span.finish(resp.status_code, len(resp.content))
+    return resp.status_code, resp.content
+
+
+# Default number of threads of Session.map, and of connections kept per host
+# so that as many concurrent commands on one host reuse their connections.
+DEFAULT_MAX_WORKERS = 10
+
+
+def make_session(auth=None, pool_connections=100,
+                 pool_maxsize=DEFAULT_MAX_WORKERS):
+    """ Create a requests session suited to WinRM.
+
+    Connections are kept alive and pooled, so that consecutive requests to
+    a host reuse the same (authenticated) connection.
+
+    Parameters
+    ----------
+    auth : object
+        requests authentication, e.g. a (user, password) tuple.
+    pool_connections : int
+        Number of hosts for which a connection pool is kept.
+    pool_maxsize : int
+        Maximum number of connections kept per host. Connections beyond it
+        are closed once done with, and the next ones authenticate again:
+        keep it at least as large as the number of threads sending requests
+        to the same host.
+    """
+    session = requests.Session()
+    session.auth = auth
+    session.headers.update({
+        "Content-Type": "application/soap+xml;charset=UTF-8",
+        "Connection": "keep-alive",
+    })
+
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections, pool_maxsize=pool_maxsize
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 
 class Session:
-    def __init__(self, session, host):
+    """ Blocking WinRM client.
+
+    A Session is meant to be long-lived: requests go through the connection
+    pools of the underlying requests session. map runs commands from a pool
+    of threads sharing that session, which requests does not document as
+    thread-safe, so the session (e.g. its auth or adapters) must not be
+    modified while commands run.
+
+    Parameters
+    ----------
+    session : requests.Session
+        Session used for every request, see make_session.
+    host : str or None
+        Default host for run_cmd.
+    tracer : aiowinrm.tracing.Tracer or None
+        Tracer of every request. If None, requests are not traced.
+    """
+    @classmethod
+    def create(cls, auth, host=None, pool_connections=100,
+               pool_maxsize=DEFAULT_MAX_WORKERS, tracer=None):
+        """ Create a Session, with its own requests session.
+        """
+        return cls(
+            make_session(auth, pool_connections, pool_maxsize), host, tracer
+        )
+
+    def __init__(self, session, host=None, tracer=None):
         self.session = session
-        self.host = parse_host(host, TranportKind.http)
+        if host is not None:
+            host = parse_host(host, TranportKind.http)
+        self.host = host
+        self.tracer = tracer
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
 
-    def run_cmd(self, cmd, args=(), env=None, cwd=None):
-        with ShellContext(self.session, self.host, env=env, cwd=cwd) as shell_context:
+    def __exit__(self, *a, **kw):
+        self.close()
+
+    def run_cmd(self, cmd, args=(), env=None, cwd=None, host=None):
+        """ Run the given command, on host if given, on the session default
+        host otherwise.
+        """
+        host = self._resolve_host(host)
+        with ShellContext(
+            self.session, host, env=env, cwd=cwd, tracer=self.tracer
+        ) as shell_context:
             with CommandContext.from_shell_context(
                 shell_context, cmd, args
             ) as command_context:
-                stdout, stderr, return_code = command_context.get_output()
-                return Response(stdout, stderr, return_code)
+                stdout, stderr, return_code = command_context.receive_output()
+                return Response(
+                    stdout, stderr, return_code, shell_context.encoding
+                )
+
+    def capture_cmd(self, cmd, args=(), env=None, cwd=None, host=None,
+                    max_memory=DEFAULT_CAPTURE_MEMORY):
+        """ Run the given command as run_cmd does, keeping at most
+        max_memory bytes of each output stream in memory.
+
+        The CapturedResponse should be closed once done with, to remove the
+        temporary files of large outputs.
+        """
+        host = self._resolve_host(host)
+        with ShellContext(
+            self.session, host, env=env, cwd=cwd, tracer=self.tracer
+        ) as shell_context:
+            with CommandContext.from_shell_context(
+                shell_context, cmd, args
+            ) as command_context:
+                stdout, stderr, return_code = command_context.capture(
+                    max_memory
+                )
+                return CapturedResponse(
+                    stdout, stderr, return_code, shell_context.encoding
+                )
+
+    def _resolve_host(self, host):
+        if host is None:
+            if self.host is None:
+                raise ValueError("No host given, and no default host")
+            return self.host
+        return parse_host(host, TranportKind.http)
+
+    def map(self, hosts, cmd, args=(), env=None, cwd=None,
+            max_workers=DEFAULT_MAX_WORKERS, ordered=True, retry_policy=None,
+            circuit_breaker=None):
+        """ Run the given command on every host, with a pool of threads.
+
+        Parameters
+        ----------
+        hosts : iterable of str
+            Hosts to run the command on.
+        max_workers : int
+            Maximum number of commands running at once. Hosts repeating in
+            hosts run up to this many commands at once, which the pool_maxsize
+            of the session should allow for.
+        ordered : bool
+            If True, results come in the order of hosts. Otherwise, they
+            come as soon as they are available.
+        retry_policy : aiowinrm.retry.RetryPolicy or None
+            If given, the command is run again on hosts where it failed with
+            a transient error. Only use it for commands which can safely run
+            twice.
+        circuit_breaker : aiowinrm.retry.CircuitBreaker or None
+            If given, hosts whose circuit is open are reported right away
+            with a CircuitOpenError.
+
+        Yields
+        ------
+        result : HostResult
+            One result per host.
+        """
+        def run(host):
+            try:
+                response = call_with_retry_sync(
+                    lambda: self.run_cmd(cmd, args, env, cwd, host),
+                    parse_host(host, TranportKind.http), retry_policy,
+                    circuit_breaker
+                )
+                return HostResult(host, response=response)
+            except Exception as e:
+                return HostResult(host, exception=e)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            if ordered:
+                for result in executor.map(run, hosts):
+                    yield result
+            else:
+                futures = [executor.submit(run, host) for host in hosts]
+                for future in concurrent.futures.as_completed(futures):
+                    yield future.result()
 
 
 def run_cmd(host, auth, cmd, args=(), env=None, cwd=None):
-    with requests.Session() as session:
-        session.auth = auth
-
-        winrm_session = Session(session, host)
+    with Session(make_session(auth), host) as winrm_session:
         return winrm_session.run_cmd(cmd, args, env=env, cwd=cwd)
@@ -0,0 +1,816 @@
+""" A fake WSMan endpoint, for tests and benchmarks.
+
+Only the shell operations used by aiowinrm are implemented. What a command
+does is up to a command factory, called with the command line of every new
+command and returning an object with the MockCommand interface.
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import contextlib
+import hashlib
+import re
+import threading
+import uuid
+import zlib
+
+import lxml.etree as etree
+
+from aiohttp import web
+
+from aiowinrm.compression import GZIP_WBITS
+from aiowinrm.constants import (
+    DEFAULT_MAX_ENVELOPE_SIZE, ENVELOPE_OVERHEAD, MAX_ADAPTIVE_ENVELOPE_SIZE
+)
+from aiowinrm.encryption import CONTENT_TYPE, unwrap_message, wrap_message
+from aiowinrm.soap.namespaces import ADDRESSING, WIN_SHELL, WSMAN_DMTF
+
+
+ACTION_CREATE = "http://schemas.xmlsoap.org/ws/2004/09/transfer/Create"
+ACTION_DELETE = "http://schemas.xmlsoap.org/ws/2004/09/transfer/Delete"
+ACTION_GET = "http://schemas.xmlsoap.org/ws/2004/09/transfer/Get"
+ACTION_COMMAND = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Command"  # NOQA
+ACTION_RECEIVE = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Receive"  # NOQA
+ACTION_SEND = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Send"
+ACTION_SIGNAL = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Signal"  # NOQA
+
+_FAULT_BODY = """\
+<s:Fault><s:Code><s:Value>s:Sender</s:Value><s:Subcode>\
+<s:Value>w:{subcode}</s:Value></s:Subcode></s:Code>\
+<s:Reason><s:Text xml:lang="en-US">{message}</s:Text></s:Reason>\
+<s:Detail><f:WSManFault \
+xmlns:f="http://schemas.microsoft.com/wbem/wsman/1/wsmanfault" \
+Code="{code}" Machine="mock"><f:Message>{message}</f:Message>\
+</f:WSManFault></s:Detail></s:Fault>"""
+
+_ENVELOPE = """\
+<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xml:lang="en-US" \
+xmlns:s="http://www.w3.org/2003/05/soap-envelope" \
+xmlns:a="http://schemas.xmlsoap.org/ws/2004/08/addressing" \
+xmlns:w="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" \
+xmlns:rsp="http://schemas.microsoft.com/wbem/wsman/1/windows/shell">\
+<s:Header><a:Action>{action}</a:Action>\
+<a:MessageID>uuid:{message_id}</a:MessageID>\
+<a:To>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</a:To>\
+<a:RelatesTo>{relates_to}</a:RelatesTo></s:Header>\
+<s:Body>{body}</s:Body></s:Envelope>"""
+
+_CREATE_BODY = """\
+<x:ResourceCreated xmlns:x="http://schemas.xmlsoap.org/ws/2004/09/transfer">\
+<a:Address>{url}</a:Address><a:ReferenceParameters><w:SelectorSet>\
+<w:Selector Name="ShellId">{shell_id}</w:Selector>\
+</w:SelectorSet></a:ReferenceParameters></x:ResourceCreated>\
+<rsp:Shell><rsp:ShellId>{shell_id}</rsp:ShellId></rsp:Shell>"""
+
+_GET_BODY = """\
+<rsp:Shell><rsp:ShellId>{shell_id}</rsp:ShellId>\
+<rsp:State>Connected</rsp:State></rsp:Shell>"""
+
+_COMMAND_BODY = """\
+<rsp:CommandResponse><rsp:CommandId>{command_id}</rsp:CommandId>\
+</rsp:CommandResponse>"""
+
+_STREAM = """<rsp:Stream Name="{name}" CommandId="{command_id}">{data}</rsp:Stream>"""  # NOQA
+_STREAM_END = """<rsp:Stream Name="{name}" CommandId="{command_id}" End="true"></rsp:Stream>"""  # NOQA
+
+_RECEIVE_BODY = """\
+<rsp:ReceiveResponse>{streams}{state}</rsp:ReceiveResponse>"""
+
+_STATE_RUNNING = """<rsp:CommandState CommandId="{command_id}" State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Running"/>"""  # NOQA
+_STATE_DONE = """<rsp:CommandState CommandId="{command_id}" State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Done"><rsp:ExitCode>{exit_code}</rsp:ExitCode></rsp:CommandState>"""  # NOQA
+
+
+class MockCommand(object):
+    """ Base class for the commands run by the mock server.
+
+    The default implementation ignores its input, and exits with 0 without
+    output.
+    """
+    def __init__(self, command, args):
+        self.command = command
+        self.args = args
+        self.stdin_closed = False
+
+    def feed_stdin(self, data, end):
+        """ Called for every Send request.
+        """
+        if end:
+            self.stdin_closed = True
+
+    async def receive(self, max_size):
+        """ Called for every Receive request.
+
+        Parameters
+        ----------
+        max_size : int
+            Maximum number of bytes of output (stdout and stderr together)
+            fitting in the response envelope.
+
+        Returns
+        -------
+        stdout : bytes
+        stderr : bytes
+        exit_code : int or None
+            None if the command is still running
+
+        Returning None instead answers with a TimedOut fault, as WinRM
+        does when there is no output within the OperationTimeout.
+        """
+        return b"", b"", 0
+
+
+class MockWinRMServer(object):
+    """ aiohttp server emulating a WinRM endpoint.
+
+    Parameters
+    ----------
+    command_factory : callable
+        Called as command_factory(command, args) for every new command.
+    latency : float
+        Seconds to wait before answering any request.
+    default_envelope_size : int
+        Envelope size used for requests without a MaxEnvelopeSize header.
+    max_envelope_size : int
+        Requests with a larger MaxEnvelopeSize get an EncodingLimit fault.
+    create_faults : int
+        Number of shell creations answered with a QuotaLimit fault before
+        the first successful one.
+    security_context_factory : callable or None
+        If given, requests must be authenticated with Negotiate and
+        encrypted, with the server side security contexts it returns (see
+        StubSecurityContext).
+    http_compression : bool
+        If True, responses are gzipped for clients accepting it.
+
+    Commands wrapped by aiowinrm.compression.gzip_command are recognized,
+    and their stdout gzipped.
+    """
+    def __init__(self, command_factory=MockCommand, latency=0.0,
+                 default_envelope_size=DEFAULT_MAX_ENVELOPE_SIZE,
+                 max_envelope_size=MAX_ADAPTIVE_ENVELOPE_SIZE,
+                 create_faults=0, security_context_factory=None,
+                 http_compression=False):
+        self.command_factory = command_factory
+        self.latency = latency
+        self.default_envelope_size = default_envelope_size
+        self.max_envelope_size = max_envelope_size
+        self.create_faults = create_faults
+        self.security_context_factory = security_context_factory
+        self.http_compression = http_compression
+
+        self.shells = {}
+        self.commands = {}
+        # Largest number of commands alive at once
+        self.peak_commands = 0
+        # command id -> SequenceId of the next Receive request to answer
+        self.next_sequence_ids = {}
+        self._sequence_changed = asyncio.Condition()
+        # action -> number of requests received
+        self.request_counts = {}
+        # (address, port) of every client connection seen
+        self.peers = set()
+        # (address, port) -> security context of the connection
+        self.security_contexts = {}
+        # Number of Negotiate handshakes completed
+        self.handshakes = 0
+        # Number of requests received with a gzipped body
+        self.compressed_requests = 0
+
+        self.url = None
+        self._runner = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application(client_max_size=64 * 1024 ** 2)
+        app.router.add_post("/wsman", self._handle)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+
+        port = self._runner.addresses[0][1]
+        self.url = "http://{}:{}/wsman".format(host, port)
+        return self
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *a, **kw):
+        await self.close()
+
+    @contextlib.contextmanager
+    def run_in_thread(self, host="127.0.0.1", port=0):
+        """ Run the server in its own event loop and thread, e.g. to test
+        blocking clients.
+        """
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start(host, port))
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.close())
+            loop.close()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        started.wait()
+        try:
+            yield self
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+
+    async def _handle(self, request):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        peer = request.transport.get_extra_info("peername")
+        self.peers.add(peer)
+        if request.headers.get("Content-Encoding") == "gzip":
+            # aiohttp decompresses the body
+            self.compressed_requests += 1
+        data = await request.read()
+        if self.security_context_factory is not None:
+            return await self._handle_encrypted(request, peer, data)
+
+        response = await self._handle_envelope(data)
+        if self.http_compression:
+            response.enable_compression()
+        return response
+
+    async def _handle_encrypted(self, request, peer, data):
+        authorization = request.headers.get("Authorization")
+        if authorization is not None:
+            return self._authenticate(peer, authorization)
+
+        context = self.security_contexts.get(peer)
+        if context is None or not context.complete:
+            return web.Response(
+                status=401, headers={"WWW-Authenticate": "Negotiate"}
+            )
+
+        response = await self._handle_envelope(unwrap_message(context, data))
+        return web.Response(
+            status=response.status,
+            body=wrap_message(context, response.body),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
+
+    def _authenticate(self, peer, authorization):
+        _, _, token = authorization.partition(" ")
+        context = self.security_contexts.get(peer)
+        if context is None or context.complete:
+            context = self.security_context_factory()
+            self.security_contexts[peer] = context
+
+        try:
+            token = context.step(base64.b64decode(token))
+        except ValueError:
+            del self.security_contexts[peer]
+            return web.Response(status=401)
+
+        headers = {}
+        if token is not None:
+            headers["WWW-Authenticate"] = "Negotiate {}".format(
+                base64.b64encode(token).decode("ascii")
+            )
+        if not context.complete:
+            return web.Response(status=401, headers=headers)
+        self.handshakes += 1
+        return web.Response(status=200, headers=headers)
+
+    async def _handle_envelope(self, data):
+        root = etree.fromstring(data)
+        action = root.findtext(".//" + ADDRESSING + "Action")
+        message_id = root.findtext(".//" + ADDRESSING + "MessageID")
+        shell_id = root.findtext(
+            ".//" + WSMAN_DMTF + "Selector[@Name='ShellId']"
+        )
+
+        self.request_counts[action] = self.request_counts.get(action, 0) + 1
+
+        envelope_size = root.findtext(".//" + WSMAN_DMTF + "MaxEnvelopeSize")
+        if envelope_size is None:
+            envelope_size = self.default_envelope_size
+        elif int(envelope_size) > self.max_envelope_size:
+            return _fault_response(
+                "EncodingLimit", 2150858817,
+                "The response that the WS-Management service computed "
+                "exceeds the maximum envelope size that is allowed."
+            )
+        else:
+            envelope_size = int(envelope_size)
+
+        if action == ACTION_CREATE and self.create_faults > 0:
+            self.create_faults -= 1
+            return _fault_response(
+                "QuotaLimit", 2150859173,
+                "The WS-Management service cannot process the request. This "
+                "user is allowed a maximum number of 5 concurrent shells."
+            )
+        elif action == ACTION_CREATE:
+            shell_id = str(uuid.uuid4()).upper()
+            self.shells[shell_id] = set()
+            body = _CREATE_BODY.format(url=self.url, shell_id=shell_id)
+        elif shell_id not in self.shells:
+            return web.Response(status=400, text="Unknown shell")
+        elif action == ACTION_GET:
+            body = _GET_BODY.format(shell_id=shell_id)
+        elif action == ACTION_DELETE:
+            for command_id in self.shells.pop(shell_id):
+                self.commands.pop(command_id, None)
+            await self._notify_sequence_changed()
+            body = ""
+        elif action == ACTION_COMMAND:
+            body = self._handle_command(root, shell_id)
+        elif action == ACTION_SEND:
+            body = self._handle_send(root)
+        elif action == ACTION_RECEIVE:
+            body = await self._handle_receive(root, envelope_size)
+            if isinstance(body, web.Response):
+                return body
+        elif action == ACTION_SIGNAL:
+            command_id = root.find(".//" + WIN_SHELL + "Signal").get(
+                "CommandId"
+            )
+            self.commands.pop(command_id, None)
+            self.shells[shell_id].discard(command_id)
+            await self._notify_sequence_changed()
+            body = "<rsp:SignalResponse/>"
+        else:
+            return web.Response(status=400, text="Unknown action")
+
+        if body is None:
+            return web.Response(status=400, text="Unknown command")
+
+        data = _ENVELOPE.format(
+            action=action + "Response", message_id=str(uuid.uuid4()).upper(),
+            relates_to=message_id, body=body,
+        )
+        return web.Response(
+            body=data.encode("utf8"),
+            content_type="application/soap+xml", charset="utf-8",
+        )
+
+    def _handle_command(self, root, shell_id):
+        command = root.findtext(".//" + WIN_SHELL + "Command")
+        arguments = root.findtext(".//" + WIN_SHELL + "Arguments")
+        args = tuple(arguments.split(" ")) if arguments else ()
+
+        command_id = str(uuid.uuid4()).upper()
+        self.commands[command_id] = self._make_command(command, args)
+        self.peak_commands = max(self.peak_commands, len(self.commands))
+        self.shells[shell_id].add(command_id)
+        return _COMMAND_BODY.format(command_id=command_id)
+
+    def _make_command(self, command, args):
+        """ Create the MockCommand of a command line, unwrapping the
+        PowerShell wrappers of aiowinrm.
+        """
+        script = _powershell_script(command, args)
+        if script is None:
+            return self.command_factory(command, args)
+
+        match = _R_GZIP_COMMAND.search(script)
+        if "GZipStream" in script and match is not None:
+            return GzipOutputCommand(
+                self._make_command(*_split_command_line(match.group(1)))
+            )
+
+        match = _R_BATCH_SCRIPT.search(script)
+        if match is not None:
+            return BatchCommand(
+                [
+                    self._make_command(*_split_command_line(line))
+                    for line in _R_LITERAL.findall(match.group("commands"))
+                ],
+                _unquote(match.group("marker")),
+            )
+
+        return self.command_factory(command, args)
+
+    def _handle_send(self, root):
+        stream = root.find(".//" + WIN_SHELL + "Stream")
+        command = self.commands.get(stream.get("CommandId"))
+        if command is None:
+            return None
+
+        data = base64.b64decode(stream.text or "")
+        command.feed_stdin(data, stream.get("End") == "true")
+        return "<rsp:SendResponse/>"
+
+    async def _handle_receive(self, root, envelope_size):
+        command_id = root.find(".//" + WIN_SHELL + "DesiredStream").get(
+            "CommandId"
+        )
+        sequence_id = root.find(".//" + WIN_SHELL + "Receive").get(
+            "SequenceId"
+        )
+        command = self.commands.get(command_id)
+        if command is None:
+            return None
+
+        max_size = (envelope_size - ENVELOPE_OVERHEAD) // 4 * 3
+        if sequence_id is None:
+            output = await command.receive(max_size)
+        else:
+            # Answer concurrent requests in sequence order
+            sequence_id = int(sequence_id)
+            async with self._sequence_changed:
+                await self._sequence_changed.wait_for(
+                    lambda: command_id not in self.commands
+                    or self.next_sequence_ids.get(command_id, 0)
+                    == sequence_id
+                )
+            if command_id not in self.commands:
+                return None
+            try:
+                output = await command.receive(max_size)
+            finally:
+                self.next_sequence_ids[command_id] = sequence_id + 1
+                await self._notify_sequence_changed()
+
+        if output is None:
+            return _fault_response(
+                "TimedOut", 2150858793,
+                "The WS-Management service cannot complete the operation "
+                "within the time specified in OperationTimeout."
+            )
+        stdout, stderr, exit_code = output
+
+        streams = []
+        for name, data in (("stdout", stdout), ("stderr", stderr)):
+            if data:
+                streams.append(_STREAM.format(
+                    name=name, command_id=command_id,
+                    data=base64.b64encode(data).decode("ascii"),
+                ))
+            if exit_code is not None:
+                streams.append(
+                    _STREAM_END.format(name=name, command_id=command_id)
+                )
+
+        if exit_code is None:
+            state = _STATE_RUNNING.format(command_id=command_id)
+        else:
+            state = _STATE_DONE.format(
+                command_id=command_id, exit_code=exit_code
+            )
+
+        return _RECEIVE_BODY.format(streams="".join(streams), state=state)
+
+
+    async def _notify_sequence_changed(self):
+        async with self._sequence_changed:
+            self._sequence_changed.notify_all()
+
+
+def _fault_response(subcode, code, message):
+    data = _ENVELOPE.format(
+        action="http://schemas.dmtf.org/wbem/wsman/1/wsman/fault",
+        message_id=str(uuid.uuid4()).upper(), relates_to="",
+        body=_FAULT_BODY.format(subcode=subcode, code=code, message=message),
+    )
+    return web.Response(
+        status=500, body=data.encode("utf8"),
+        content_type="application/soap+xml", charset="utf-8",
+    )
+
+
+class StaticCommand(MockCommand):
+    """ Command writing a fixed output, in chunks of up to chunk_size bytes
+    of each stream per Receive response, as long as both fit in the
+    envelope.
+    """
+    def __init__(self, command, args, stdout=b"", stderr=b"", exit_code=0,
+                 chunk_size=None):
+        super(StaticCommand, self).__init__(command, args)
+        self._stdout = stdout
+        self._stderr = stderr
+        self._exit_code = exit_code
+        self._chunk_size = chunk_size or max(len(stdout), len(stderr), 1)
+        self._stdout_position = 0
+        self._stderr_position = 0
+
+    async def receive(self, max_size):
+        size = min(self._chunk_size, max_size)
+
+        start = self._stdout_position
+        stdout = self._stdout[start:start + size]
+        self._stdout_position += len(stdout)
+
+        size = min(self._chunk_size, max_size - len(stdout))
+        start = self._stderr_position
+        stderr = self._stderr[start:start + size]
+        self._stderr_position += len(stderr)
+
+        if self._stdout_position < len(self._stdout) \
+                or self._stderr_position < len(self._stderr):
+            return stdout, stderr, None
+        return stdout, stderr, self._exit_code
+
+
+_WrapResult = collections.namedtuple(
+    "_WrapResult", ["header", "data", "padding_length"]
+)
+
+_XOR_TABLE = bytes(b ^ 0x5A for b in range(256))
+
+
+class StubSecurityContext(object):
+    """ Stand-in for a pyspnego security context, for encryption tests.
+
+    The handshake mimics NTLM (negotiate, challenge, authenticate), and
+    messages are "sealed" with a XOR and a SHA256 signature.
+    """
+    def __init__(self, server=False):
+        self.server = server
+        self.complete = False
+
+    def step(self, in_token=None):
+        if self.server and in_token == b"NEGOTIATE":
+            return b"CHALLENGE"
+        elif self.server and in_token == b"AUTHENTICATE":
+            self.complete = True
+            return None
+        elif not self.server and in_token is None:
+            return b"NEGOTIATE"
+        elif not self.server and in_token == b"CHALLENGE":
+            self.complete = True
+            return b"AUTHENTICATE"
+        raise ValueError("Unexpected token {!r}".format(in_token))
+
+    def wrap_winrm(self, data):
+        header = hashlib.sha256(data).digest()[:16]
+        return _WrapResult(header, data.translate(_XOR_TABLE), 0)
+
+    def unwrap_winrm(self, header, data):
+        data = data.translate(_XOR_TABLE)
+        if hashlib.sha256(data).digest()[:16] != header:
+            raise ValueError("Invalid signature")
+        return data
+
+
+_R_LITERAL = re.compile(r"^('(?:[^']|'')*')$", re.MULTILINE)
+
+_R_GZIP_COMMAND = re.compile(r"^\$command = ('(?:[^']|'')*')$", re.MULTILINE)
+
+_R_BATCH_SCRIPT = re.compile(
+    r"^\$marker = (?P<marker>'[^']*')\n\$commands = @\(\n"
+    r"(?P<commands>.*?)\n\)$",
+    re.MULTILINE | re.DOTALL
+)
+
+
+def _powershell_script(command, args):
+    if command != "powershell" or "-EncodedCommand" not in args:
+        return None
+    return base64.b64decode(args[-1]).decode("utf-16-le")
+
+
+def _unquote(literal):
+    return literal[1:-1].replace("''", "'")
+
+
+def _split_command_line(literal):
+    command, _, arguments = _unquote(literal).partition(" ")
+    return command, tuple(arguments.split(" ")) if arguments else ()
+
+
+class GzipOutputCommand(MockCommand):
+    """ Command gzipping the stdout of another one, as gzip_command does.
+    """
+    def __init__(self, command):
+        super(GzipOutputCommand, self).__init__(command.command, command.args)
+        self._command = command
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+
+    def feed_stdin(self, data, end):
+        self._command.feed_stdin(data, end)
+
+    async def receive(self, max_size):
+        # Leave room for the gzip header and flush markers
+        output = await self._command.receive(max_size - 64)
+        if output is None:
+            return None
+        stdout, stderr, exit_code = output
+        stdout = self._compressor.compress(stdout)
+        if exit_code is None:
+            stdout += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        else:
+            stdout += self._compressor.flush()
+        return stdout, stderr, exit_code
+
+
+class BatchCommand(MockCommand):
+    """ Run commands one after the other, as aiowinrm.batch does.
+    """
+    def __init__(self, commands, marker):
+        super(BatchCommand, self).__init__("powershell", ())
+        self._commands = commands
+        self._marker = marker
+        self._index = 0
+
+    async def receive(self, max_size):
+        if self._index == len(self._commands):
+            return b"", b"", 0
+
+        # Leave room for the marker
+        output = await self._commands[self._index].receive(max_size - 128)
+        if output is None:
+            return None
+        stdout, stderr, exit_code = output
+        if exit_code is None:
+            return stdout, stderr, None
+
+        end = "{} {} {};".format(
+            self._marker, self._index, exit_code
+        ).encode("ascii")
+        self._index += 1
+        done = self._index == len(self._commands)
+        return stdout + end, stderr + end, 0 if done else None
+
+
+def static_output(stdout=b"", stderr=b"", exit_code=0, chunk_size=None):
+    """ Return a command factory for StaticCommand.
+    """
+    def factory(command, args):
+        return StaticCommand(
+            command, args, stdout, stderr, exit_code, chunk_size
+        )
+    return factory
+
+
+class IdleCommand(MockCommand):
+    """ Command without output for its first idle_polls Receive requests,
+    each of them taking delay seconds and answered with a TimedOut fault if
+    timeout is True.
+    """
+    def __init__(self, command, args, stdout=b"", idle_polls=0, delay=0.0,
+                 timeout=False):
+        super(IdleCommand, self).__init__(command, args)
+        self._stdout = stdout
+        self._idle_polls = idle_polls
+        self._delay = delay
+        self._timeout = timeout
+
+    async def receive(self, max_size):
+        if self._idle_polls > 0:
+            self._idle_polls -= 1
+            if self._delay:
+                await asyncio.sleep(self._delay)
+            if self._timeout:
+                return None
+            return b"", b"", None
+        return self._stdout, b"", 0
+
+
+def idle_output(stdout=b"", idle_polls=0, delay=0.0, timeout=False):
+    """ Return a command factory for IdleCommand.
+    """
+    def factory(command, args):
+        return IdleCommand(command, args, stdout, idle_polls, delay, timeout)
+    return factory
+
+
+class StdinEchoCommand(MockCommand):
+    """ Command writing its stdin to stdout once closed. Until then,
+    Receive requests are answered with a TimedOut fault after delay
+    seconds.
+    """
+    def __init__(self, command, args, delay=0.01):
+        super(StdinEchoCommand, self).__init__(command, args)
+        self._stdin = bytearray()
+        self._delay = delay
+
+    def feed_stdin(self, data, end):
+        super(StdinEchoCommand, self).feed_stdin(data, end)
+        self._stdin += data
+
+    async def receive(self, max_size):
+        if not self.stdin_closed:
+            await asyncio.sleep(self._delay)
+            return None
+        return bytes(self._stdin), b"", 0
+
+
+def stdin_echo(delay=0.01):
+    """ Return a command factory for StdinEchoCommand.
+    """
+    def factory(command, args):
+        return StdinEchoCommand(command, args, delay)
+    return factory
+
+
+def generated_output(size, chunk_size=None, exit_code=0):
+    """ Return a command factory writing size bytes of ASCII to stdout.
+    """
+    line = b"0123456789abcdefghijklmnopqrstuvwxyz0123456789abcdefghijklmnop\r\n"
+    stdout = (line * (size // len(line) + 1))[:size]
+    return static_output(stdout, exit_code=exit_code, chunk_size=chunk_size)
+
+
+_R_PARAM = re.compile(r"^\$(path|offset|count|length) = (.*)$", re.MULTILINE)
+
+
+class FakeTransferShell(MockCommand):
+    """ Emulate the scripts of aiowinrm.transfer on an in-memory file system.
+    """
+    chunk_size = 96 * 1024
+
+    def __init__(self, files, command, args):
+        super(FakeTransferShell, self).__init__(command, args)
+        self._files = files
+
+        script = base64.b64decode(args[-1]).decode("utf-16-le")
+        params = dict(_R_PARAM.findall(script))
+        self._path = params["path"][1:-1].replace("''", "'")
+        self._offset = int(params.get("offset", 0))
+        self._count = int(params.get("count", 0))
+
+        self._output = b""
+        if "SetLength" in script:
+            self._files[self._path] = bytearray(int(params["length"]))
+        elif "ComputeHash" in script:
+            self._output = hashlib.sha256(
+                self._files[self._path]
+            ).hexdigest().upper().encode("ascii")
+        elif "OpenStandardOutput" in script:
+            self._output = bytes(
+                self._files[self._path][
+                    self._offset:self._offset + self._count
+                ]
+            )
+        elif "Get-Item" in script:
+            self._output = str(len(self._files[self._path])).encode("ascii")
+
+        self._is_upload = "OpenStandardInput" in script
+
+    def feed_stdin(self, data, end):
+        super(FakeTransferShell, self).feed_stdin(data, end)
+        target = self._files[self._path]
+        target[self._offset:self._offset + len(data)] = data
+        self._offset += len(data)
+
+    async def receive(self, max_size):
+        if self._is_upload and not self.stdin_closed:
+            await asyncio.sleep(0.001)
+            return b"", b"", None
+
+        size = min(self.chunk_size, max_size)
+        chunk = self._output[:size]
+        self._output = self._output[size:]
+        return chunk, b"", None if self._output else 0
+
+
+def main(argv=None):
+    """ Run a mock server until interrupted, printing its URL on stdout.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument(
+        "--latency", type=float, default=0.0,
+        help="Seconds to wait before answering any request"
+    )
+    parser.add_argument(
+        "--output-size", type=int, default=1024,
+        help="Bytes written to stdout by every command"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=None,
+        help="Bytes of output returned per Receive request"
+    )
+    args = parser.parse_args(argv)
+
+    server = MockWinRMServer(
+        generated_output(args.output_size, args.chunk_size),
+        latency=args.latency,
+    )
+
+    async def serve():
+        async with server:
+            print(server.url, flush=True)
+            await asyncio.Event().wait()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import base64
+import unittest
+
+from aiowinrm.batch import (
+    MAX_COMMAND_LINE_SIZE, _plan, batch_command, split_output
+)
+from aiowinrm.errors import BatchError
+
+
+class TestBatchCommand(unittest.TestCase):
+    def test_script(self):
+        # When
+        command, args = batch_command(["hostname", "echo it's"], "MARK")
+
+        # Then
+        self.assertEqual(command, "powershell")
+        script = base64.b64decode(args[-1]).decode("utf-16-le")
+        self.assertIn("$marker = 'MARK'\n", script)
+        self.assertIn("$commands = @(\n'hostname'\n'echo it''s'\n)\n", script)
+
+
+class TestSplitOutput(unittest.TestCase):
+    def test_split(self):
+        # Given
+        stdout = b"host\r\nM 0 0;M 1 1;a\r\nb\r\nM 2 -1;"
+        stderr = b"M 0 0;oops\r\nM 1 1;M 2 -1;"
+
+        # When
+        outputs = split_output(stdout, stderr, "M", 3)
+
+        # Then
+        self.assertEqual(outputs, [
+            (b"host\r\n", b"", 0),
+            (b"", b"oops\r\n", 1),
+            (b"a\r\nb\r\n", b"", -1),
+        ])
+
+    def test_interrupted(self):
+        # When
+        outputs = split_output(b"host\r\nM 0 0;partial", b"", "M", 3)
+
+        # Then
+        self.assertEqual(outputs, [(b"host\r\n", b"", 0)])
+
+    def test_out_of_order(self):
+        # When/Then
+        with self.assertRaises(BatchError):
+            split_output(b"M 1 0;", b"", "M", 2)
+
+
+def _command_line_size(command_lines, marker):
+    command, args = batch_command(command_lines, marker)
+    return len(" ".join((command,) + args))
+
+
+class TestPlan(unittest.TestCase):
+    def test_split_by_size(self):
+        # Given
+        command_lines = ["x" * 500] * 20
+
+        # When
+        batches = _plan(command_lines, "MARK", MAX_COMMAND_LINE_SIZE)
+
+        # Then
+        self.assertGreater(len(batches), 1)
+        self.assertEqual(sum(batches, []), command_lines)
+        for i, batch in enumerate(batches):
+            self.assertLessEqual(
+                _command_line_size(batch, "MARK"), MAX_COMMAND_LINE_SIZE
+            )
+            if i + 1 < len(batches):
+                # Batches are as large as the limit allows
+                self.assertGreater(
+                    _command_line_size(batch + batches[i + 1][:1], "MARK"),
+                    MAX_COMMAND_LINE_SIZE
+                )
+
+    def test_non_ascii(self):
+        # Given
+        # Characters outside of the BMP take 4 bytes in UTF-16
+        command_lines = ["echo \U0001f600" * 100] * 10
+
+        # When
+        batches = _plan(command_lines, "MARK", MAX_COMMAND_LINE_SIZE)
+
+        # Then
+        for batch in batches:
+            self.assertLessEqual(
+                _command_line_size(batch, "MARK"), MAX_COMMAND_LINE_SIZE
+            )
+
+    def test_long_command_line(self):
+        # When
+        batches = _plan(["a", "x" * 10000, "b"], "MARK", 8191)
+
+        # Then
+        self.assertEqual(batches, [["a"], ["x" * 10000], ["b"]])
@@ -0,0 +1,72 @@
+import unittest
+
+from aiowinrm.capture import CapturedResponse, OutputCapture
+
+
+class TestOutputCapture(unittest.TestCase):
+    def test_in_memory(self):
+        # Given
+        capture = OutputCapture(max_memory=1024)
+        self.addCleanup(capture.close)
+
+        # When
+        capture.write(b"hello ")
+        capture.write(b"world")
+
+        # Then
+        self.assertFalse(capture.spilled)
+        self.assertEqual(capture.size, 11)
+        self.assertEqual(capture.getvalue(), b"hello world")
+
+    def test_spill(self):
+        # Given
+        capture = OutputCapture(max_memory=100)
+        self.addCleanup(capture.close)
+        data = bytes(range(256)) * 4
+
+        # When
+        for i in range(0, len(data), 30):
+            capture.write(data[i:i + 30])
+
+        # Then
+        self.assertTrue(capture.spilled)
+        self.assertEqual(capture.getvalue(), data)
+        self.assertEqual(
+            b"".join(capture.iter_chunks(chunk_size=7)), data
+        )
+
+    def test_iter_lines(self):
+        # Given
+        capture = OutputCapture(max_memory=10)
+        self.addCleanup(capture.close)
+        text = "première\r\nseconde\n\ntroisième"
+        data = text.encode("utf8")
+
+        # When
+        for i in range(len(data)):
+            capture.write(data[i:i + 1])
+
+        # Then
+        self.assertEqual(
+            list(capture.iter_lines()),
+            ["première", "seconde", "", "troisième"]
+        )
+        self.assertEqual(capture.text(), text)
+
+
+class TestCapturedResponse(unittest.TestCase):
+    def test_lazy_access(self):
+        # Given
+        stdout = OutputCapture()
+        stdout.write("é\r\nà".encode("cp1252"))
+        stderr = OutputCapture()
+
+        # When
+        with CapturedResponse(stdout, stderr, 0, "cp1252") as response:
+            lines = list(response.iter_stdout_lines())
+            text = response.stdout
+
+        # Then
+        self.assertEqual(lines, ["é", "à"])
+        self.assertEqual(text, "é\r\nà")
+        self.assertEqual(response.returncode, 0)
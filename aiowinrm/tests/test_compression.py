@@ -0,0 +1,71 @@
+import base64
+import gzip
+import unittest
+
+from aiowinrm.compression import (
+    OutputDecompressor, compress_payload, gzip_command
+)
+from aiowinrm.errors import AIOWinRMException
+
+
+class TestCompressPayload(unittest.TestCase):
+    def test_gzip(self):
+        # Given
+        payload = b"<s:Envelope>" + b"a" * 10000 + b"</s:Envelope>"
+
+        # When
+        compressed = compress_payload(payload)
+
+        # Then
+        self.assertLess(len(compressed), len(payload) // 10)
+        self.assertEqual(gzip.decompress(compressed), payload)
+
+
+class TestGzipCommand(unittest.TestCase):
+    def test_command_line(self):
+        # When
+        command, args = gzip_command("dir", ("/s", "C:\\it's"))
+
+        # Then
+        self.assertEqual(command, "powershell")
+        script = base64.b64decode(args[-1]).decode("utf-16-le")
+        self.assertIn("$command = 'dir /s C:\\it''s'\n", script)
+        self.assertIn("exit $p.ExitCode", script)
+
+
+class TestOutputDecompressor(unittest.TestCase):
+    def test_incremental(self):
+        # Given
+        output = b"0123456789\r\n" * 10000
+        compressed = gzip.compress(output)
+        decompressor = OutputDecompressor(max_chunk=4096)
+
+        # When
+        chunks = []
+        for i in range(0, len(compressed), 100):
+            chunks.extend(decompressor.decompress(compressed[i:i + 100]))
+        chunks.append(decompressor.flush())
+
+        # Then
+        self.assertEqual(b"".join(chunks), output)
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), 4096)
+
+    def test_truncated(self):
+        # Given
+        compressed = gzip.compress(b"0123456789\r\n" * 10000)
+        decompressor = OutputDecompressor()
+
+        # When
+        list(decompressor.decompress(compressed[:len(compressed) // 2]))
+
+        # Then
+        with self.assertRaises(AIOWinRMException):
+            decompressor.flush()
+
+    def test_empty(self):
+        # Given
+        decompressor = OutputDecompressor()
+
+        # When/Then
+        self.assertEqual(list(decompressor.decompress(b"")), [])
+        self.assertEqual(decompressor.flush(), b"")
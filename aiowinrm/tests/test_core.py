@@ -0,0 +1,193 @@
+import asyncio
+import unittest
+
+from aiowinrm import sync
+from aiowinrm.core import CommandContext, ShellContext
+
+
+class ScriptedCommandContext(CommandContext):
+    """ CommandContext replaying canned Receive results.
+    """
+    def __init__(self, outputs):
+        super(ScriptedCommandContext, self).__init__(
+            None, "localhost", "shell", "dummy"
+        )
+        self._outputs = list(outputs)
+        self.requests = 0
+
+    async def _output_request(self):
+        self.requests += 1
+        stdout, stderr, return_code, is_done = self._outputs.pop(0)
+        if is_done:
+            self.protocol.return_code = return_code
+            self.protocol.is_done = True
+        return stdout, stderr, return_code, is_done
+
+
+def _collect(aiterable):
+    async def collect():
+        return [item async for item in aiterable]
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(collect())
+    finally:
+        loop.close()
+
+
+class TestCommandContextStream(unittest.TestCase):
+    def test_bytes(self):
+        # Given
+        context = ScriptedCommandContext([
+            (b"out", b"", None, False),
+            (b"", b"", None, False),
+            (b"more", b"err", 2, True),
+        ])
+
+        # When
+        chunks = _collect(context.stream())
+
+        # Then
+        self.assertEqual(
+            chunks,
+            [("stdout", b"out"), ("stdout", b"more"), ("stderr", b"err")]
+        )
+        self.assertEqual(context.return_code, 2)
+        self.assertEqual(context.requests, 3)
+
+    def test_split_multibyte(self):
+        # Given
+        data = u"café €".encode("utf8")
+        context = ScriptedCommandContext([
+            (data[:4], b"", None, False),
+            (data[4:-1], b"", None, False),
+            (data[-1:], b"", 0, True),
+        ])
+
+        # When
+        chunks = _collect(context.stream(encoding="utf8"))
+
+        # Then
+        self.assertEqual(
+            u"".join(chunk for _, chunk in chunks), u"café €"
+        )
+
+    def test_backpressure(self):
+        # Given
+        context = ScriptedCommandContext([
+            (b"1", b"", None, False),
+            (b"2", b"", None, False),
+            (b"3", b"", 0, True),
+        ])
+
+        async def first_chunk():
+            stream = context.stream()
+            chunk = await stream.__anext__()
+            await asyncio.sleep(0)
+            await stream.aclose()
+            return chunk
+
+        # When
+        loop = asyncio.new_event_loop()
+        try:
+            chunk = loop.run_until_complete(first_chunk())
+        finally:
+            loop.close()
+
+        # Then
+        self.assertEqual(chunk, ("stdout", b"1"))
+        self.assertEqual(context.requests, 1)
+
+
+class RecordingCommandContext(CommandContext):
+    """ CommandContext recording Send requests instead of sending them.
+    """
+    def __init__(self, max_envelope_size):
+        super(RecordingCommandContext, self).__init__(
+            None, "localhost", "shell", "dummy",
+            max_envelope_size=max_envelope_size
+        )
+        self.sent = []
+
+    async def _send_request(self, data, end=False):
+        self.sent.append((bytes(data), end))
+
+
+class TestCommandContextSendStdin(unittest.TestCase):
+    def _send(self, context, source):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(context.send_stdin(source))
+        finally:
+            loop.close()
+
+    def test_bytes(self):
+        # Given
+        context = RecordingCommandContext(max_envelope_size=2048 + 8)
+        data = b"0123456789"
+
+        # When
+        self._send(context, data)
+
+        # Then
+        self.assertEqual(
+            context.sent,
+            [(b"012345", False), (b"6789", True)]
+        )
+
+    def test_async_iterable(self):
+        # Given
+        context = RecordingCommandContext(max_envelope_size=2048 + 8)
+
+        async def source():
+            for data in (b"01", b"2345678", b"9", b"abc"):
+                yield data
+
+        # When
+        self._send(context, source())
+
+        # Then
+        self.assertEqual(
+            context.sent,
+            [(b"012345", False), (b"6789ab", False), (b"c", True)]
+        )
+
+    def test_empty(self):
+        # Given
+        context = RecordingCommandContext(max_envelope_size=2048 + 8)
+
+        # When
+        self._send(context, [])
+
+        # Then
+        self.assertEqual(context.sent, [(b"", True)])
+
+
+class TestFromShellContext(unittest.TestCase):
+    def test_inherit_settings(self):
+        for shell_class, command_class in (
+            (ShellContext, CommandContext),
+            (sync.ShellContext, sync.CommandContext),
+        ):
+            # Given
+            shell_context = shell_class(
+                None, "localhost", max_envelope_size=4096,
+                operation_timeout=5.0
+            )
+            shell_context.protocol.shell_id = "shell"
+
+            # When
+            command_context = command_class.from_shell_context(
+                shell_context, "dir", ("/b",), operation_timeout=1.0,
+                console_mode_stdin=False
+            )
+
+            # Then
+            protocol = command_context.protocol
+            self.assertEqual(protocol.shell_id, "shell")
+            self.assertEqual(protocol.command, "dir")
+            self.assertEqual(protocol.args, ("/b",))
+            self.assertEqual(protocol.max_envelope_size, 4096)
+            self.assertEqual(protocol.operation_timeout, 1.0)
+            self.assertFalse(protocol.console_mode_stdin)
+            self.assertEqual(command_context.host, shell_context.host)
@@ -0,0 +1,48 @@
+import unittest
+
+from aiowinrm.encryption import (
+    BOUNDARY, PROTOCOL_SPNEGO, unwrap_message, wrap_message
+)
+from aiowinrm.errors import AIOWinRMException
+
+from .mock_server import StubSecurityContext
+
+
+class TestMessage(unittest.TestCase):
+    def test_roundtrip(self):
+        # Given
+        payload = b"<s:Envelope>" + b"x" * 1000 + b"</s:Envelope>"
+        context = StubSecurityContext()
+
+        # When
+        body = wrap_message(context, payload)
+
+        # Then
+        self.assertTrue(body.startswith(
+            "--{}\r\n\tContent-Type: {}\r\n".format(
+                BOUNDARY, PROTOCOL_SPNEGO
+            ).encode("ascii")
+        ))
+        self.assertIn(b"Length=1025\r\n", body)
+        self.assertTrue(body.endswith(b"--Encrypted Boundary--\r\n"))
+        self.assertNotIn(b"Envelope", body)
+        self.assertEqual(unwrap_message(context, body), payload)
+
+    def test_length_mismatch(self):
+        # Given
+        context = StubSecurityContext()
+        body = wrap_message(context, b"<s:Envelope/>").replace(
+            b"Length=13", b"Length=14"
+        )
+
+        # When/Then
+        with self.assertRaises(AIOWinRMException):
+            unwrap_message(context, body)
+
+    def test_malformed(self):
+        # Given
+        context = StubSecurityContext()
+
+        # When/Then
+        with self.assertRaises(AIOWinRMException):
+            unwrap_message(context, b"<s:Envelope/>")
@@ -0,0 +1,816 @@
+import asyncio
+import concurrent.futures
+import unittest
+
+import aiohttp
+
+from aiowinrm import api, sync
+from aiowinrm.batch import MAX_COMMAND_LINE_SIZE, run_batch
+from aiowinrm.constants import ENVELOPE_OVERHEAD
+from aiowinrm.core import CommandContext, ShellContext
+from aiowinrm.encryption import EncryptedSession, unwrap_message
+from aiowinrm.fanout import run_cmd_many
+from aiowinrm.offload import Offloader
+from aiowinrm.errors import (
+    AIOWinRMException, AuthenticationError, QuotaLimitFault
+)
+from aiowinrm.pool import ShellPool
+from aiowinrm.retry import RetryPolicy
+from aiowinrm.tracing import CallbackTracer
+
+from .mock_server import (
+    ACTION_COMMAND, ACTION_CREATE, ACTION_RECEIVE, MockWinRMServer,
+    ACTION_SIGNAL, StaticCommand, StubSecurityContext, generated_output,
+    idle_output, static_output, stdin_echo
+)
+
+
+class AsyncServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def run_with_server(self, server, func):
+        async def run():
+            async with server:
+                return await func()
+        return self.loop.run_until_complete(run())
+
+
+class TestApi(AsyncServerTestCase):
+    def test_run_cmd(self):
+        # Given
+        server = MockWinRMServer(static_output(
+            u"héllo\r\n".encode("utf8") * 3, b"warning", chunk_size=4
+        ))
+        stdout = []
+        stderr = []
+
+        # When
+        self.run_with_server(server, lambda: api.run_cmd(
+            server.url, None, "dir",
+            stdout_callback=stdout.append, stderr_callback=stderr.append,
+        ))
+
+        # Then
+        self.assertEqual(u"".join(stdout), u"héllo\r\n" * 3)
+        self.assertEqual(u"".join(stderr), u"warning")
+        self.assertEqual(server.request_counts[ACTION_RECEIVE], 6)
+
+    def test_run_cmd_many(self):
+        # Given
+        server = MockWinRMServer(static_output(b"out", exit_code=3))
+
+        async def run():
+            return [
+                result
+                async for result in run_cmd_many(
+                    [server.url] * 5, None, "dir", limit=2
+                )
+            ]
+
+        # When
+        results = self.run_with_server(server, run)
+
+        # Then
+        self.assertEqual(len(results), 5)
+        for result in results:
+            self.assertTrue(result.ok)
+            self.assertEqual(result.response.stdout, "out")
+            self.assertEqual(result.response.returncode, 3)
+
+    def test_run_cmd_many_retry(self):
+        # Given
+        server = MockWinRMServer(static_output(b"out"), create_faults=2)
+
+        async def run(retry_policy):
+            return [
+                result
+                async for result in run_cmd_many(
+                    [server.url], None, "dir", retry_policy=retry_policy
+                )
+            ]
+
+        # When
+        first, = self.run_with_server(server, lambda: run(None))
+        second, = self.run_with_server(
+            server, lambda: run(RetryPolicy(initial_backoff=0.001))
+        )
+
+        # Then
+        self.assertIsInstance(first.exception, QuotaLimitFault)
+        self.assertTrue(second.ok)
+        self.assertEqual(second.response.stdout, "out")
+
+    def test_shell_pool(self):
+        # Given
+        server = MockWinRMServer(static_output(b"out"))
+
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                async with ShellPool(session) as pool:
+                    for _ in range(3):
+                        await api.run_cmd(server.url, None, "dir", shell_pool=pool)
+                    await api.run_cmd(
+                        server.url, None, "dir", cwd="C:\\", shell_pool=pool
+                    )
+
+        # When
+        self.run_with_server(server, run)
+
+        # Then
+        self.assertEqual(server.request_counts[ACTION_CREATE], 2)
+        self.assertEqual(server.shells, {})
+
+
+class TestStdin(AsyncServerTestCase):
+    def test_run_cmd(self):
+        # Given
+        server = MockWinRMServer(stdin_echo())
+        stdout = []
+
+        # When
+        self.run_with_server(server, lambda: api.run_cmd(
+            server.url, None, "more", stdout_callback=stdout.append,
+            stdin=[b"hello ", b"world"],
+        ))
+
+        # Then
+        self.assertEqual(u"".join(stdout), u"hello world")
+
+    def test_send_error(self):
+        # Given
+        server = MockWinRMServer(stdin_echo())
+
+        async def stdin():
+            yield b"hello"
+            await asyncio.sleep(0.05)
+            raise ValueError("broken input")
+
+        async def run():
+            # The command waits for its stdin forever if the error of the
+            # send is not noticed
+            await asyncio.wait_for(
+                api.run_cmd(server.url, None, "more", stdin=stdin()), 5
+            )
+
+        # When/Then
+        with self.assertRaisesRegex(ValueError, "broken input"):
+            self.run_with_server(server, run)
+        self.assertEqual(server.request_counts[ACTION_SIGNAL], 1)
+        self.assertEqual(server.commands, {})
+
+
+class TestEnvelopeSize(AsyncServerTestCase):
+    def _receive_count(self, server, **options):
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                async with ShellContext(
+                    session, server.url, **options
+                ) as shell_context:
+                    async with CommandContext.from_shell_context(
+                        shell_context, "dir"
+                    ) as command_context:
+                        async for _ in command_context.stream():
+                            pass
+            return server.request_counts[ACTION_RECEIVE]
+
+        return self.run_with_server(server, run)
+
+    def test_max_envelope_size(self):
+        # Given
+        server = MockWinRMServer(generated_output(1024 ** 2))
+
+        # When
+        default = self._receive_count(server)
+        server.request_counts.clear()
+        large = self._receive_count(server, max_envelope_size=500 * 1024)
+
+        # Then
+        self.assertLess(large, default)
+
+    def test_adaptive_falls_back(self):
+        # Given
+        server = MockWinRMServer(
+            generated_output(1024 ** 2), max_envelope_size=200 * 1024
+        )
+
+        # When
+        count = self._receive_count(server, adaptive_envelope_size=True)
+
+        # Then
+        self.assertGreater(count, 1)
+
+    def test_streams_share_envelope(self):
+        # Given
+        # Room for 6 bytes of output per Receive response
+        server = MockWinRMServer(
+            static_output(b"o" * 6, b"e" * 6),
+            default_envelope_size=ENVELOPE_OVERHEAD + 8,
+        )
+        stdout = []
+        stderr = []
+
+        # When
+        self.run_with_server(server, lambda: api.run_cmd(
+            server.url, None, "dir",
+            stdout_callback=stdout.append, stderr_callback=stderr.append,
+        ))
+
+        # Then
+        self.assertEqual(u"".join(stdout), u"o" * 6)
+        self.assertEqual(u"".join(stderr), u"e" * 6)
+        self.assertEqual(server.request_counts[ACTION_RECEIVE], 2)
+
+
+class TestTracing(AsyncServerTestCase):
+    def test_async(self):
+        # Given
+        server = MockWinRMServer(
+            generated_output(1024 ** 2), max_envelope_size=200 * 1024
+        )
+        records = []
+
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                async with ShellContext(
+                    session, server.url, adaptive_envelope_size=True,
+                    tracer=CallbackTracer(records.append)
+                ) as shell_context:
+                    await shell_context.run("dir")
+
+        # When
+        self.run_with_server(server, run)
+
+        # Then
+        actions = [record.action for record in records]
+        self.assertEqual(actions[:2], ["Create", "Command"])
+        self.assertEqual(actions[-2:], ["Signal", "Delete"])
+        receives = [r for r in records if r.action == "Receive"]
+        self.assertEqual(len(receives), server.request_counts[ACTION_RECEIVE])
+        self.assertEqual(
+            [r.retry for r in receives if r.status == 500], [0]
+        )
+        self.assertEqual(
+            [r.retry for r in receives if r.retry], [1]
+        )
+        self.assertGreater(
+            sum(r.response_size for r in receives), 1024 ** 2
+        )
+        self.assertTrue(all(r.host == server.url for r in records))
+
+
+class TestPipelinedReceive(AsyncServerTestCase):
+    def _output(self, server, **options):
+        async def run():
+            chunks = []
+            async with aiohttp.ClientSession() as session:
+                async with ShellContext(
+                    session, server.url, **options
+                ) as shell_context:
+                    async with CommandContext.from_shell_context(
+                        shell_context, "dir"
+                    ) as command_context:
+                        async for stream, chunk in command_context.stream():
+                            chunks.append((stream, chunk))
+            return chunks, command_context.return_code
+
+        return self.run_with_server(server, run)
+
+    def test_in_order(self):
+        # Given
+        stdout = bytes(range(256)) * 64
+        server = MockWinRMServer(
+            static_output(stdout, b"err", exit_code=4, chunk_size=1000),
+            latency=0.001,
+        )
+
+        # When
+        chunks, return_code = self._output(server, pipeline_depth=4)
+
+        # Then
+        self.assertEqual(
+            b"".join(c for stream, c in chunks if stream == "stdout"), stdout
+        )
+        self.assertEqual(
+            b"".join(c for stream, c in chunks if stream == "stderr"), b"err"
+        )
+        self.assertEqual(return_code, 4)
+        self.assertEqual(server.commands, {})
+
+    def test_adaptive_envelope_size(self):
+        # Given
+        server = MockWinRMServer(
+            generated_output(1024 ** 2), max_envelope_size=200 * 1024
+        )
+
+        # When
+        chunks, return_code = self._output(
+            server, pipeline_depth=3, adaptive_envelope_size=True
+        )
+
+        # Then
+        self.assertEqual(sum(len(chunk) for _, chunk in chunks), 1024 ** 2)
+        self.assertEqual(return_code, 0)
+
+
+class TestConcurrentCommands(AsyncServerTestCase):
+    def test_run_many(self):
+        # Given
+        server = MockWinRMServer(
+            lambda command, args: StaticCommand(
+                command, args, " ".join(args).encode("ascii"),
+                exit_code=len(args), chunk_size=2
+            ),
+            latency=0.002,
+        )
+        commands = [("echo", ("query", str(i))) for i in range(20)]
+
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                async with ShellContext(
+                    session, server.url, max_commands=3
+                ) as shell_context:
+                    return await shell_context.run_many(commands)
+
+        # When
+        responses = self.run_with_server(server, run)
+
+        # Then
+        self.assertEqual(
+            [response.stdout for response in responses],
+            ["query {}".format(i) for i in range(20)]
+        )
+        self.assertEqual(
+            set(response.returncode for response in responses), {2}
+        )
+        self.assertEqual(server.request_counts[ACTION_CREATE], 1)
+        self.assertEqual(server.peak_commands, 3)
+
+
+class _PlaintextServer(MockWinRMServer):
+    """ Server authenticating clients and decrypting their requests, but
+    answering in plaintext.
+    """
+    async def _handle_encrypted(self, request, peer, data):
+        authorization = request.headers.get("Authorization")
+        if authorization is not None:
+            return self._authenticate(peer, authorization)
+        context = self.security_contexts[peer]
+        return await self._handle_envelope(unwrap_message(context, data))
+
+
+class TestEncryption(AsyncServerTestCase):
+    def setUp(self):
+        super(TestEncryption, self).setUp()
+        self.server = MockWinRMServer(
+            generated_output(100000, chunk_size=8192),
+            security_context_factory=lambda: StubSecurityContext(server=True),
+        )
+
+    def run_commands(self, count, between=None):
+        async def run():
+            responses = []
+            async with EncryptedSession(
+                context_factory=lambda host: StubSecurityContext()
+            ) as session:
+                async with ShellContext(session, self.server.url) as shell:
+                    for _ in range(count):
+                        responses.append(await shell.run("dir"))
+                        if between is not None:
+                            between()
+            return responses
+        return self.run_with_server(self.server, run)
+
+    def test_run(self):
+        # When
+        responses = self.run_commands(2)
+
+        # Then
+        for response in responses:
+            self.assertEqual(len(response.stdout_bytes), 100000)
+            self.assertEqual(response.returncode, 0)
+        # A single handshake, on the only connection
+        self.assertEqual(self.server.handshakes, 1)
+        self.assertEqual(len(self.server.peers), 1)
+
+    def test_lost_context(self):
+        # When
+        responses = self.run_commands(
+            2, between=self.server.security_contexts.clear
+        )
+
+        # Then
+        self.assertEqual(len(responses[1].stdout_bytes), 100000)
+        # Initial handshake, then again for the second command and for the
+        # shell deletion
+        self.assertEqual(self.server.handshakes, 3)
+
+    def test_unencrypted(self):
+        # Given
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                async with ShellContext(session, self.server.url):
+                    pass
+
+        # When/Then
+        with self.assertRaises(AuthenticationError):
+            self.run_with_server(self.server, run)
+
+    def test_plaintext_response(self):
+        # Given
+        server = _PlaintextServer(
+            security_context_factory=lambda: StubSecurityContext(server=True)
+        )
+
+        async def run():
+            async with EncryptedSession(
+                context_factory=lambda host: StubSecurityContext()
+            ) as session:
+                async with ShellContext(session, server.url):
+                    pass
+
+        # When/Then
+        with self.assertRaisesRegex(AIOWinRMException, "Unencrypted"):
+            self.run_with_server(server, run)
+
+    def test_http_compression(self):
+        # Given
+        async def run():
+            async with EncryptedSession(
+                context_factory=lambda host: StubSecurityContext()
+            ) as session:
+                async with ShellContext(
+                    session, self.server.url, http_compression=True
+                ):
+                    pass
+
+        # When/Then
+        # Rejected on the first request, whatever the size of its body
+        with self.assertRaisesRegex(ValueError, "http_compression"):
+            self.run_with_server(self.server, run)
+        self.assertEqual(self.server.request_counts, {})
+
+
+def _echo(command, args):
+    """ Command factory writing its command line, and exiting with its
+    number of arguments.
+    """
+    line = " ".join((command,) + args).encode("ascii")
+    return StaticCommand(
+        command, args, line + b"\r\n", b"err " + line, len(args)
+    )
+
+
+class _CommandLineServer(MockWinRMServer):
+    """ Server recording the length of the command line of every command.
+    """
+    def __init__(self, *a, **kw):
+        super(_CommandLineServer, self).__init__(*a, **kw)
+        self.command_line_sizes = []
+
+    def _make_command(self, command, args):
+        self.command_line_sizes.append(len(" ".join((command,) + args)))
+        return super(_CommandLineServer, self)._make_command(command, args)
+
+
+class TestBatch(AsyncServerTestCase):
+    def run_batch(self, server, commands, shell_options=None, **kw):
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                async with ShellContext(
+                    session, server.url, **(shell_options or {})
+                ) as shell:
+                    return await run_batch(shell, commands, **kw)
+        return self.run_with_server(server, run)
+
+    def test_run_batch(self):
+        # Given
+        server = MockWinRMServer(_echo)
+        commands = ["hostname", ("ipconfig", ("/all",)), ("reg", ("a", "b"))]
+
+        # When
+        responses = self.run_batch(server, commands)
+
+        # Then
+        self.assertEqual(
+            [response.stdout for response in responses],
+            ["hostname\r\n", "ipconfig /all\r\n", "reg a b\r\n"]
+        )
+        self.assertEqual(
+            [response.stderr for response in responses],
+            ["err hostname", "err ipconfig /all", "err reg a b"]
+        )
+        self.assertEqual(
+            [response.returncode for response in responses], [0, 1, 2]
+        )
+        self.assertEqual(server.request_counts[ACTION_COMMAND], 1)
+
+    def test_split_batches(self):
+        # Given
+        server = MockWinRMServer(_echo)
+        commands = [("echo", (str(i),)) for i in range(50)]
+
+        # When
+        responses = self.run_batch(
+            server, commands, max_command_line_size=3000
+        )
+
+        # Then
+        self.assertEqual(
+            [response.stdout for response in responses],
+            ["echo {}\r\n".format(i) for i in range(50)]
+        )
+        self.assertGreater(server.request_counts[ACTION_COMMAND], 1)
+        self.assertLess(server.request_counts[ACTION_COMMAND], 10)
+        # Parts run one after the other, keeping the order of commands
+        self.assertEqual(server.peak_commands, 1)
+
+    def test_compress_output(self):
+        # Given
+        server = _CommandLineServer(_echo)
+        commands = [
+            ("reg", ("query", "HKLM\\Software\\Key{}".format(i), "/v", "x"))
+            for i in range(400)
+        ]
+
+        # When
+        responses = self.run_batch(
+            server, commands, shell_options={"compress_output": True}
+        )
+
+        # Then
+        self.assertEqual(
+            [response.stdout for response in responses],
+            [
+                " ".join((command,) + args) + "\r\n"
+                for command, args in commands
+            ]
+        )
+        # Batches are not wrapped again to gzip their output, which would
+        # exceed the command line limit of cmd.exe
+        self.assertLessEqual(
+            max(server.command_line_sizes), MAX_COMMAND_LINE_SIZE
+        )
+
+
+class TestOffload(AsyncServerTestCase):
+    def run_commands(self, executor):
+        server = MockWinRMServer(generated_output(500000, chunk_size=100000))
+        offloader = Offloader(executor, threshold=1024)
+
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                async with ShellContext(
+                    session, server.url, offloader=offloader
+                ) as shell:
+                    return await shell.run_many(["dir"] * 4)
+
+        return self.run_with_server(server, run)
+
+    def test_thread_pool(self):
+        # When
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            responses = self.run_commands(executor)
+
+        # Then
+        for response in responses:
+            self.assertEqual(len(response.stdout_bytes), 500000)
+            self.assertEqual(response.returncode, 0)
+
+    def test_process_pool(self):
+        # When
+        with concurrent.futures.ProcessPoolExecutor(2) as executor:
+            responses = self.run_commands(executor)
+
+        # Then
+        for response in responses:
+            self.assertEqual(len(response.stdout_bytes), 500000)
+            self.assertEqual(response.returncode, 0)
+
+
+class TestCompression(AsyncServerTestCase):
+    def test_compress_output(self):
+        # Given
+        stdout = b"0123456789abcdef\r\n" * 20000
+        server = MockWinRMServer(static_output(stdout, chunk_size=65536))
+        records = []
+
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                async with ShellContext(
+                    session, server.url, compress_output=True,
+                    tracer=CallbackTracer(records.append),
+                ) as shell:
+                    return await shell.run("dir")
+
+        # When
+        response = self.run_with_server(server, run)
+
+        # Then
+        self.assertEqual(bytes(response.stdout_bytes), stdout)
+        self.assertEqual(response.returncode, 0)
+        received = sum(
+            record.response_size for record in records
+            if record.action == "Receive"
+        )
+        self.assertLess(received, len(stdout) // 10)
+
+    def test_http_compression(self):
+        # Given
+        server = MockWinRMServer(
+            static_output(b"out" * 10000), http_compression=True
+        )
+        stdin = b"0123456789" * 10000
+
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                async with ShellContext(
+                    session, server.url, http_compression=True
+                ) as shell:
+                    async with CommandContext.from_shell_context(
+                        shell, "more"
+                    ) as command:
+                        await command.send_stdin(stdin)
+                        return b"".join([
+                            chunk async for _, chunk in command.stream()
+                        ])
+
+        # When
+        stdout = self.run_with_server(server, run)
+
+        # Then
+        self.assertEqual(stdout, b"out" * 10000)
+        self.assertEqual(server.compressed_requests, 1)
+
+
+class TestPolling(AsyncServerTestCase):
+    def _run(self, server):
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                async with ShellContext(session, server.url) as shell_context:
+                    async with CommandContext.from_shell_context(
+                        shell_context, "dir"
+                    ) as command_context:
+                        chunks = [
+                            chunk
+                            async for _, chunk in command_context.stream()
+                        ]
+            return b"".join(chunks), command_context.poll_stats
+
+        return self.run_with_server(server, run)
+
+    def test_timed_out(self):
+        # Given
+        server = MockWinRMServer(
+            idle_output(b"out", idle_polls=3, timeout=True)
+        )
+
+        # When
+        stdout, stats = self._run(server)
+
+        # Then
+        self.assertEqual(stdout, b"out")
+        self.assertEqual(stats.polls, 4)
+        self.assertEqual(stats.timed_out_polls, 3)
+        self.assertEqual(stats.productive_polls, 1)
+        self.assertEqual(stats.wait_time, 0.0)
+
+    def test_backoff(self):
+        # Given
+        server = MockWinRMServer(idle_output(b"out", idle_polls=3))
+
+        # When
+        stdout, stats = self._run(server)
+
+        # Then
+        self.assertEqual(stdout, b"out")
+        self.assertEqual(stats.empty_polls, 3)
+        self.assertGreater(stats.wait_time, 0.0)
+
+
+class TestSync(unittest.TestCase):
+    def test_run_cmd(self):
+        # Given
+        server = MockWinRMServer(static_output(b"out", b"err", exit_code=1))
+
+        # When
+        with server.run_in_thread():
+            response = sync.run_cmd(server.url, None, "dir")
+
+        # Then
+        self.assertEqual(response.stdout, "out")
+        self.assertEqual(response.stderr, "err")
+        self.assertEqual(response.returncode, 1)
+        self.assertEqual(server.shells, {})
+
+    def test_timed_out(self):
+        # Given
+        server = MockWinRMServer(
+            idle_output(b"out", idle_polls=2, timeout=True)
+        )
+
+        # When
+        with server.run_in_thread():
+            response = sync.run_cmd(server.url, None, "dir")
+
+        # Then
+        self.assertEqual(response.stdout, "out")
+        self.assertEqual(response.returncode, 0)
+
+    def test_chunked_output(self):
+        # Given
+        stdout = "première ligne\r\nseconde ligne".encode("utf8")
+        server = MockWinRMServer(static_output(stdout, chunk_size=3))
+
+        # When
+        with server.run_in_thread():
+            response = sync.run_cmd(server.url, None, "dir")
+
+        # Then
+        self.assertEqual(response.stdout, "première ligne\r\nseconde ligne")
+
+    def test_capture_cmd(self):
+        # Given
+        server = MockWinRMServer(generated_output(100000, chunk_size=4096))
+
+        # When
+        with server.run_in_thread():
+            with sync.Session.create(None, server.url) as session:
+                response = session.capture_cmd("dir", max_memory=10000)
+
+        # Then
+        with response:
+            self.assertTrue(response.stdout_capture.spilled)
+            self.assertEqual(len(response.stdout_bytes), 100000)
+            lines = list(response.iter_stdout_lines())
+            self.assertEqual(len(lines), 100000 // 64 + 1)
+            self.assertEqual(len(lines[0]), 62)
+
+    def test_tracer(self):
+        # Given
+        server = MockWinRMServer(static_output(b"out"))
+        records = []
+
+        # When
+        with server.run_in_thread():
+            with sync.Session.create(
+                None, server.url, tracer=CallbackTracer(records.append)
+            ) as session:
+                session.run_cmd("dir")
+
+        # Then
+        self.assertEqual(
+            [record.action for record in records],
+            ["Create", "Command", "Receive", "Signal", "Delete"]
+        )
+        self.assertTrue(all(record.status == 200 for record in records))
+
+    def test_session_reuses_connection(self):
+        # Given
+        server = MockWinRMServer(static_output(b"out"))
+
+        # When
+        with server.run_in_thread():
+            with sync.Session.create(None, server.url) as session:
+                for _ in range(3):
+                    session.run_cmd("dir")
+
+        # Then
+        self.assertEqual(server.request_counts[ACTION_CREATE], 3)
+        self.assertEqual(len(server.peers), 1)
+
+    def test_session_map(self):
+        # Given
+        server = MockWinRMServer(static_output(b"out", exit_code=2))
+
+        # When
+        with server.run_in_thread():
+            with sync.Session.create(None) as session:
+                results = list(session.map(
+                    [server.url] * 4 + ["http://127.0.0.1:1/wsman"], "dir",
+                    max_workers=2
+                ))
+
+        # Then
+        self.assertEqual(len(results), 5)
+        for result in results[:4]:
+            self.assertTrue(result.ok)
+            self.assertEqual(result.response.returncode, 2)
+        self.assertFalse(results[4].ok)
+        self.assertEqual(results[4].host, "http://127.0.0.1:1/wsman")
+
+    def test_session_map_reuses_connections(self):
+        # Given
+        server = MockWinRMServer(static_output(b"out"))
+
+        # When
+        with server.run_in_thread():
+            with sync.Session.create(None) as session:
+                results = list(session.map([server.url] * 50, "dir"))
+
+        # Then
+        self.assertTrue(all(result.ok for result in results))
+        # Every thread keeps its connection, none is discarded and opened
+        # again
+        self.assertLessEqual(len(server.peers), sync.DEFAULT_MAX_WORKERS)
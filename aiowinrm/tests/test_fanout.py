@@ -0,0 +1,198 @@
+import asyncio
+import socket
+import unittest
+
+from aiowinrm.fanout import run_cmd_many
+
+from .mock_server import MockCommand, MockWinRMServer, idle_output
+
+
+def _unused_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return "http://127.0.0.1:{}/wsman".format(s.getsockname()[1])
+
+
+class _Counter(object):
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+
+    def enter(self):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+
+    def exit(self):
+        self.running -= 1
+
+
+class _SlowCommand(MockCommand):
+    """ Command answering its first Receive after delay seconds, counted
+    from its creation to its last output in every counter.
+    """
+    def __init__(self, command, args, counters, delay):
+        super(_SlowCommand, self).__init__(command, args)
+        self._counters = counters
+        self._delay = delay
+        for counter in counters:
+            counter.enter()
+
+    async def receive(self, max_size):
+        await asyncio.sleep(self._delay)
+        for counter in self._counters:
+            counter.exit()
+        return b"out", b"", 0
+
+
+def _slow_output(counters, delay):
+    def factory(command, args):
+        return _SlowCommand(command, args, counters, delay)
+    return factory
+
+
+class TestRunCmdMany(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def run_on_servers(self, servers, func):
+        async def run():
+            for server in servers:
+                await server.start()
+            try:
+                return await func()
+            finally:
+                for server in servers:
+                    await server.close()
+        return self.loop.run_until_complete(run())
+
+    def test_limits(self):
+        # Given
+        total = _Counter()
+        per_host = [_Counter() for _ in range(3)]
+        servers = [
+            MockWinRMServer(_slow_output([total, counter], 0.05))
+            for counter in per_host
+        ]
+
+        async def run():
+            hosts = [server.url for server in servers] * 3
+            return [
+                result
+                async for result in run_cmd_many(
+                    hosts, None, "dir", limit=2, limit_per_host=1
+                )
+            ]
+
+        # When
+        results = self.run_on_servers(servers, run)
+
+        # Then
+        self.assertEqual(len(results), 9)
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(total.peak, 2)
+        for counter in per_host:
+            self.assertEqual(counter.peak, 1)
+
+    def test_busy_host_does_not_starve_others(self):
+        # Given
+        busy = MockWinRMServer(_slow_output([_Counter()], 0.05))
+        other = MockWinRMServer(_slow_output([_Counter()], 0.05))
+
+        async def run():
+            hosts = [busy.url] * 4 + [other.url]
+            return [
+                result.host
+                async for result in run_cmd_many(
+                    hosts, None, "dir", limit=2, limit_per_host=1
+                )
+            ]
+
+        # When
+        hosts = self.run_on_servers([busy, other], run)
+
+        # Then
+        # The other host runs alongside the first command of the busy one,
+        # instead of waiting for a global slot held by its queued commands
+        self.assertIn(other.url, hosts[:2])
+
+    def test_timeout(self):
+        # Given
+        slow = MockWinRMServer(idle_output(b"out", idle_polls=100, delay=0.05))
+        fast = MockWinRMServer(idle_output(b"out"))
+
+        async def run():
+            return [
+                result
+                async for result in run_cmd_many(
+                    [slow.url, fast.url], None, "dir", timeout=0.5
+                )
+            ]
+
+        # When
+        results = self.run_on_servers([slow, fast], run)
+
+        # Then
+        results = {result.host: result for result in results}
+        self.assertTrue(results[fast.url].ok)
+        self.assertIsInstance(
+            results[slow.url].exception, asyncio.TimeoutError
+        )
+
+    def test_timeout_slow_consumer(self):
+        # Given
+        servers = [
+            MockWinRMServer(_slow_output([_Counter()], delay))
+            # The second host finishes while the consumer holds the timeout
+            # of the first one
+            for delay in (0.5, 0.2)
+        ]
+
+        async def run():
+            results = []
+            async for result in run_cmd_many(
+                [server.url for server in servers], None, "dir", timeout=0.1
+            ):
+                results.append(result)
+                # Hosts finishing while the consumer is busy must not be
+                # lost
+                await asyncio.sleep(0.3)
+            return results
+
+        # When
+        results = self.run_on_servers(servers, run)
+
+        # Then
+        self.assertEqual(
+            sorted(result.host for result in results),
+            sorted(server.url for server in servers)
+        )
+        for result in results:
+            if not result.ok:
+                self.assertIsInstance(result.exception, asyncio.TimeoutError)
+
+    def test_failing_host(self):
+        # Given
+        server = MockWinRMServer(idle_output(b"out"))
+        unreachable = _unused_url()
+
+        async def run():
+            return [
+                result
+                async for result in run_cmd_many(
+                    [unreachable, server.url, server.url], None, "dir"
+                )
+            ]
+
+        # When
+        results = self.run_on_servers([server], run)
+
+        # Then
+        self.assertEqual(len(results), 3)
+        failed = [result for result in results if not result.ok]
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(failed[0].host, unreachable)
+        self.assertIsNotNone(failed[0].exception)
+        for result in results:
+            if result.ok:
+                self.assertEqual(result.response.stdout, "out")
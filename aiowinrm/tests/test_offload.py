@@ -0,0 +1,122 @@
+import asyncio
+import concurrent.futures
+import unittest
+
+import lxml.etree as etree
+
+from aiowinrm.offload import Offloader
+
+from .test_protocol import DONE, make_receive_response
+
+
+class _CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+    def __init__(self):
+        super(_CountingExecutor, self).__init__(2)
+        self.submitted = 0
+
+    def submit(self, *a, **kw):
+        self.submitted += 1
+        return super(_CountingExecutor, self).submit(*a, **kw)
+
+
+class TestOffloader(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.executor = _CountingExecutor()
+        self.addCleanup(self.executor.shutdown)
+
+    def test_small_inline(self):
+        # Given
+        offloader = Offloader(self.executor, threshold=1024)
+        response = make_receive_response(
+            [("stdout", b"hello")], DONE.format(0)
+        )
+
+        # When
+        output = self.loop.run_until_complete(
+            offloader.parse_command_output(response)
+        )
+
+        # Then
+        self.assertEqual(output, (bytearray(b"hello"), bytearray(), 0, True))
+        self.assertEqual(self.executor.submitted, 0)
+
+    def test_batched(self):
+        # Given
+        offloader = Offloader(self.executor, threshold=0, max_batch=3)
+        responses = [
+            make_receive_response([("stdout", str(i).encode("ascii"))])
+            for i in range(5)
+        ]
+
+        async def parse_all():
+            return await asyncio.gather(*(
+                offloader.parse_command_output(response)
+                for response in responses
+            ))
+
+        # When
+        outputs = self.loop.run_until_complete(parse_all())
+
+        # Then
+        self.assertEqual(
+            [bytes(stdout) for stdout, _, _, _ in outputs],
+            [b"0", b"1", b"2", b"3", b"4"]
+        )
+        # One full batch, then the rest at the next loop iteration
+        self.assertEqual(self.executor.submitted, 2)
+
+    def test_malformed(self):
+        # Given
+        offloader = Offloader(self.executor, threshold=0)
+        responses = [make_receive_response([("stdout", b"ok")]), b"<s:Env"]
+
+        async def parse_all():
+            return await asyncio.gather(
+                *(offloader.parse_command_output(response)
+                  for response in responses),
+                return_exceptions=True
+            )
+
+        # When
+        results = self.loop.run_until_complete(parse_all())
+
+        # Then
+        self.assertEqual(bytes(results[0][0]), b"ok")
+        self.assertIsInstance(results[1], etree.XMLSyntaxError)
+
+    def test_malformed_process_pool(self):
+        # Given
+        # XMLSyntaxError cannot be pickled back from the worker processes
+        executor = concurrent.futures.ProcessPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+        offloader = Offloader(executor, threshold=0)
+        responses = [b"<s:Env", make_receive_response([("stdout", b"ok")])]
+
+        async def parse_all():
+            return await asyncio.gather(
+                *(offloader.parse_command_output(response)
+                  for response in responses),
+                return_exceptions=True
+            )
+
+        # When
+        results = self.loop.run_until_complete(parse_all())
+
+        # Then
+        self.assertIsInstance(results[0], etree.XMLSyntaxError)
+        self.assertEqual(bytes(results[1][0]), b"ok")
+
+    def test_send_payload(self):
+        # Given
+        offloader = Offloader(self.executor, threshold=1024)
+
+        # When
+        payload = self.loop.run_until_complete(
+            offloader.send_payload("S", "C", b"x" * 2048, end=True)
+        )
+
+        # Then
+        self.assertIn(b'End="true"', payload)
+        self.assertEqual(self.executor.submitted, 1)
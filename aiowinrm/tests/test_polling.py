@@ -0,0 +1,63 @@
+import unittest
+
+from aiowinrm.polling import PollScheduler
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPollScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = PollScheduler(
+            operation_timeout=20, initial_delay=0.1, max_delay=0.5,
+            clock=self.clock
+        )
+
+    def _poll(self, size, duration=0.0):
+        sent_at = self.scheduler.sent()
+        self.clock.now += duration
+        self.scheduler.received(size, sent_at)
+        return self.scheduler.next_delay()
+
+    def test_backoff(self):
+        # When/Then
+        self.assertEqual(self._poll(0), 0.1)
+        self.assertEqual(self._poll(0), 0.2)
+        self.assertEqual(self._poll(0), 0.4)
+        self.assertEqual(self._poll(0), 0.5)
+        self.assertEqual(self._poll(10), 0.0)
+        self.assertEqual(self._poll(0), 0.1)
+
+        stats = self.scheduler.stats
+        self.assertEqual(stats.polls, 6)
+        self.assertEqual(stats.productive_polls, 1)
+        self.assertEqual(stats.empty_polls, 5)
+        self.assertEqual(stats.bytes_received, 10)
+        self.assertAlmostEqual(stats.wait_time, 1.3)
+        self.assertAlmostEqual(stats.empty_ratio, 5 / 6)
+
+    def test_long_poll(self):
+        # When/Then
+        self.assertEqual(self._poll(0), 0.1)
+        # The server held the request: no need to wait before the next one
+        self.assertEqual(self._poll(0, duration=15), 0.0)
+
+    def test_timed_out(self):
+        # Given
+        self._poll(0)
+
+        # When
+        self.scheduler.timed_out()
+
+        # Then
+        self.assertEqual(self.scheduler.next_delay(), 0.0)
+        stats = self.scheduler.stats
+        self.assertEqual(stats.polls, 2)
+        self.assertEqual(stats.empty_polls, 2)
+        self.assertEqual(stats.timed_out_polls, 1)
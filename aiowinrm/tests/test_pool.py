@@ -0,0 +1,191 @@
+import asyncio
+import unittest
+
+import aiohttp
+
+from aiowinrm.pool import ShellPool
+
+from .mock_server import (
+    ACTION_CREATE, ACTION_DELETE, ACTION_GET, MockWinRMServer, static_output
+)
+
+
+class TestShellPool(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.server = MockWinRMServer(static_output(b"out"))
+
+    def run_with_pool(self, func, **pool_options):
+        async def run():
+            async with self.server:
+                async with aiohttp.ClientSession() as session:
+                    async with ShellPool(session, **pool_options) as pool:
+                        return await func(pool)
+        return self.loop.run_until_complete(run())
+
+    def count(self, action):
+        return self.server.request_counts.get(action, 0)
+
+    def test_reuse(self):
+        # Given
+        async def run(pool):
+            shell_ids = []
+            for _ in range(3):
+                async with pool.shell(self.server.url) as shell_context:
+                    await shell_context.run("dir")
+                    shell_ids.append(shell_context.shell_id)
+            return shell_ids
+
+        # When
+        shell_ids = self.run_with_pool(run)
+
+        # Then
+        self.assertEqual(len(set(shell_ids)), 1)
+        self.assertEqual(self.count(ACTION_CREATE), 1)
+        self.assertEqual(self.server.shells, {})
+
+    def test_discard_on_error(self):
+        # Given
+        async def run(pool):
+            with self.assertRaises(ValueError):
+                async with pool.shell(self.server.url):
+                    raise ValueError()
+            async with pool.shell(self.server.url):
+                pass
+
+        # When
+        self.run_with_pool(run)
+
+        # Then
+        self.assertEqual(self.count(ACTION_CREATE), 2)
+        self.assertEqual(self.count(ACTION_DELETE), 2)
+
+    def test_idle_eviction(self):
+        # Given
+        async def run(pool):
+            async with pool.shell(self.server.url) as shell_context:
+                first = shell_context.shell_id
+            await asyncio.sleep(0.05)
+            async with pool.shell(self.server.url) as shell_context:
+                self.assertNotEqual(shell_context.shell_id, first)
+                self.assertNotIn(first, self.server.shells)
+
+        # When
+        self.run_with_pool(run, max_idle=0.01)
+
+        # Then
+        self.assertEqual(self.count(ACTION_CREATE), 2)
+
+    def test_health_check(self):
+        # Given
+        checked = []
+
+        async def health_check(shell_context):
+            checked.append(shell_context.shell_id)
+            return len(checked) > 1
+
+        async def run(pool):
+            shell_ids = []
+            for _ in range(3):
+                async with pool.shell(self.server.url) as shell_context:
+                    shell_ids.append(shell_context.shell_id)
+            return shell_ids
+
+        # When
+        shell_ids = self.run_with_pool(
+            run, health_check=health_check, health_check_after=0.0
+        )
+
+        # Then
+        # The first reuse fails its check, the second one passes
+        self.assertEqual(len(checked), 2)
+        self.assertNotEqual(shell_ids[0], shell_ids[1])
+        self.assertEqual(shell_ids[1], shell_ids[2])
+        self.assertEqual(self.count(ACTION_CREATE), 2)
+
+    def test_default_health_check(self):
+        # Given
+        async def run(pool):
+            async with pool.shell(self.server.url) as shell_context:
+                first = shell_context.shell_id
+            # The server forgets about the shell
+            del self.server.shells[first]
+            async with pool.shell(self.server.url) as shell_context:
+                return first, shell_context.shell_id
+
+        # When
+        first, second = self.run_with_pool(run, health_check_after=0.0)
+
+        # Then
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.count(ACTION_GET), 1)
+
+    def test_health_check_after(self):
+        # Given
+        async def health_check(shell_context):
+            raise AssertionError("Recently used shells are not checked")
+
+        async def run(pool):
+            for _ in range(2):
+                async with pool.shell(self.server.url):
+                    pass
+
+        # When
+        self.run_with_pool(
+            run, health_check=health_check, health_check_after=60.0
+        )
+
+        # Then
+        self.assertEqual(self.count(ACTION_CREATE), 1)
+
+    def test_wait_at_capacity(self):
+        # Given
+        async def run(pool):
+            released = asyncio.Event()
+            order = []
+
+            async def hold():
+                async with pool.shell(self.server.url) as shell_context:
+                    order.append(("hold", shell_context.shell_id))
+                    await released.wait()
+
+            async def wait():
+                async with pool.shell(self.server.url) as shell_context:
+                    order.append(("wait", shell_context.shell_id))
+
+            holder = asyncio.ensure_future(hold())
+            await asyncio.sleep(0.05)
+            waiter = asyncio.ensure_future(wait())
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiter.done())
+
+            released.set()
+            await asyncio.gather(holder, waiter)
+            return order
+
+        # When
+        order = self.run_with_pool(run, max_per_host=1)
+
+        # Then
+        (first, first_id), (second, second_id) = order
+        self.assertEqual((first, second), ("hold", "wait"))
+        self.assertEqual(first_id, second_id)
+        self.assertEqual(self.count(ACTION_CREATE), 1)
+
+    def test_evict_other_key_at_capacity(self):
+        # Given
+        async def run(pool):
+            async with pool.shell(self.server.url, cwd="C:\\"):
+                pass
+            async with pool.shell(self.server.url, cwd="D:\\"):
+                pass
+
+        # When
+        self.run_with_pool(run, max_per_host=1)
+
+        # Then
+        # The idle shell of the first cwd made room for the second one
+        self.assertEqual(self.count(ACTION_CREATE), 2)
+        self.assertEqual(self.count(ACTION_DELETE), 2)
+        self.assertEqual(self.server.shells, {})
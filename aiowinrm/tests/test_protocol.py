@@ -0,0 +1,171 @@
+import base64
+import unittest
+
+from aiowinrm.soap.protocol import (
+    ReceiveParser, command_output, parse_command_output, parse_fault,
+    send_input
+)
+
+
+RECEIVE_RESPONSE_TEMPLATE = """\
+<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xml:lang="en-US"
+    xmlns:s="http://www.w3.org/2003/05/soap-envelope"
+    xmlns:a="http://schemas.xmlsoap.org/ws/2004/08/addressing"
+    xmlns:w="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd"
+    xmlns:rsp="http://schemas.microsoft.com/wbem/wsman/1/windows/shell">
+  <s:Header>
+    <a:Action>http://schemas.microsoft.com/wbem/wsman/1/windows/shell/ReceiveResponse</a:Action>
+    <a:MessageID>uuid:AAAAAAAA-0000-0000-0000-000000000000</a:MessageID>
+    <a:To>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</a:To>
+  </s:Header>
+  <s:Body>
+    <rsp:ReceiveResponse>
+      {streams}
+      {state}
+    </rsp:ReceiveResponse>
+  </s:Body>
+</s:Envelope>
+"""
+
+RUNNING = """<rsp:CommandState CommandId="C" State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Running"/>"""  # NOQA
+DONE = """<rsp:CommandState CommandId="C" State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Done"><rsp:ExitCode>{}</rsp:ExitCode></rsp:CommandState>"""  # NOQA
+
+
+def _stream(name, data, end=False):
+    if data:
+        return '<rsp:Stream Name="{}" CommandId="C">{}</rsp:Stream>'.format(
+            name, base64.b64encode(data).decode("ascii")
+        )
+    else:
+        return '<rsp:Stream Name="{}" CommandId="C" End="true"></rsp:Stream>'.format(name)  # NOQA
+
+
+def make_receive_response(streams, state=RUNNING):
+    return RECEIVE_RESPONSE_TEMPLATE.format(
+        streams="\n".join(_stream(name, data) for name, data in streams),
+        state=state,
+    ).encode("utf8")
+
+
+class TestParseCommandOutput(unittest.TestCase):
+    def test_running(self):
+        # Given
+        response = make_receive_response([
+            ("stdout", b"hello "), ("stderr", b"oops"), ("stdout", b"world"),
+        ])
+
+        # When
+        stdout, stderr, return_code, is_done = parse_command_output(response)
+
+        # Then
+        self.assertEqual(stdout, b"hello world")
+        self.assertEqual(stderr, b"oops")
+        self.assertIsNone(return_code)
+        self.assertFalse(is_done)
+
+    def test_done(self):
+        # Given
+        response = make_receive_response(
+            [("stdout", b""), ("stderr", b"")], state=DONE.format(3)
+        )
+
+        # When
+        stdout, stderr, return_code, is_done = parse_command_output(response)
+
+        # Then
+        self.assertEqual(stdout, b"")
+        self.assertEqual(stderr, b"")
+        self.assertEqual(return_code, 3)
+        self.assertTrue(is_done)
+
+    def test_incremental(self):
+        # Given
+        payloads = [bytes(range(256)) * 7, b"a", b"ab", b"abc"]
+        response = make_receive_response(
+            [("stdout", payload) for payload in payloads],
+            state=DONE.format(0),
+        )
+
+        # When
+        parser = ReceiveParser()
+        for i in range(0, len(response), 7):
+            parser.feed(response[i:i + 7])
+        stdout, stderr, return_code, is_done = parser.close()
+
+        # Then
+        self.assertEqual(stdout, b"".join(payloads))
+        self.assertEqual(stderr, b"")
+        self.assertEqual(return_code, 0)
+        self.assertTrue(is_done)
+
+
+class TestSendInput(unittest.TestCase):
+    def test_send_input(self):
+        # Given
+        data = b"\x00\x01binary"
+
+        # When
+        envelope = send_input("shell", "command", data, end=True)
+
+        # Then
+        stream = envelope.find(".//{*}Send/{*}Stream")
+        self.assertEqual(stream.get("Name"), "stdin")
+        self.assertEqual(stream.get("CommandId"), "command")
+        self.assertEqual(stream.get("End"), "true")
+        self.assertEqual(base64.b64decode(stream.text), data)
+
+
+class TestCommandOutput(unittest.TestCase):
+    def test_header_options(self):
+        # When
+        envelope = command_output(
+            "shell", "command", max_envelope_size=512000,
+            operation_timeout=2.5
+        )
+
+        # Then
+        self.assertEqual(
+            envelope.findtext(".//{*}MaxEnvelopeSize"), "512000"
+        )
+        self.assertEqual(envelope.findtext(".//{*}OperationTimeout"), "PT2.500S")
+
+    def test_defaults(self):
+        # When
+        envelope = command_output("shell", "command")
+
+        # Then
+        self.assertIsNone(envelope.find(".//{*}MaxEnvelopeSize"))
+        self.assertEqual(envelope.findtext(".//{*}OperationTimeout"), "PT60S")
+
+
+FAULT_RESPONSE = b"""\
+<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" \
+xmlns:w="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd"><s:Body><s:Fault>\
+<s:Code><s:Value>s:Receiver</s:Value><s:Subcode>\
+<s:Value>w:QuotaLimit</s:Value></s:Subcode></s:Code>\
+<s:Reason><s:Text xml:lang="en-US">Quota exceeded. </s:Text></s:Reason>\
+<s:Detail><f:WSManFault \
+xmlns:f="http://schemas.microsoft.com/wbem/wsman/1/wsmanfault" \
+Code="2150859173" Machine="win-01"><f:Message>Too many <f:Bold>shells\
+</f:Bold>.</f:Message></f:WSManFault></s:Detail></s:Fault></s:Body>\
+</s:Envelope>"""
+
+
+class TestParseFault(unittest.TestCase):
+    def test_fault(self):
+        # When
+        fault = parse_fault(FAULT_RESPONSE)
+
+        # Then
+        self.assertEqual(fault.code, "Receiver")
+        self.assertEqual(fault.subcode, "QuotaLimit")
+        self.assertEqual(fault.reason, "Quota exceeded.")
+        self.assertEqual(fault.wsman_code, 2150859173)
+        self.assertEqual(fault.machine, "win-01")
+        self.assertEqual(fault.message, "Too many shells.")
+
+    def test_not_a_fault(self):
+        # When/Then
+        self.assertIsNone(parse_fault(make_receive_response([])))
+        self.assertIsNone(parse_fault(b"Service Unavailable"))
@@ -0,0 +1,408 @@
+import asyncio
+import base64
+import unittest
+import uuid
+
+import lxml.etree as etree
+
+from aiowinrm.errors import PSRPError
+from aiowinrm.psrp import clixml, message as msg
+from aiowinrm.psrp.fragment import Defragmenter, fragment
+from aiowinrm.psrp.protocol import (
+    PIPELINE_COMPLETED, PIPELINE_FAILED, RUNSPACE_POOL_BROKEN,
+    RUNSPACE_POOL_CLOSED, RUNSPACE_POOL_OPENED, RunspacePoolProtocol
+)
+from aiowinrm.psrp.runspace import RunspacePool
+from aiowinrm.soap.namespaces import WIN_SHELL
+
+from .mock_server import (
+    ACTION_COMMAND, ACTION_CREATE, ACTION_DELETE, ACTION_RECEIVE,
+    ACTION_SIGNAL
+)
+from .test_protocol import make_receive_response
+
+
+PROCESS = """\
+<Obj RefId="0"><TN RefId="0">\
+<T>System.Diagnostics.Process</T><T>System.Object</T></TN>\
+<ToString>System.Diagnostics.Process (svchost)</ToString>\
+<Props><S N="Name">svchost</S><I32 N="Id">812</I32>\
+<Obj N="Modules" RefId="1"><TN RefId="1"><T>System.Object[]</T></TN>\
+<LST><S>a.dll</S><S>b.dll</S></LST></Obj></Props>\
+<MS><Obj N="Priority" RefId="2"><TN RefId="2">\
+<T>System.Diagnostics.ProcessPriorityClass</T><T>System.Enum</T></TN>\
+<ToString>Normal</ToString><I32>32</I32></Obj></MS></Obj>"""
+
+STATE = """\
+<Obj RefId="0"><MS><I32 N="{name}">{state}</I32>{extra}</MS></Obj>"""
+
+ERROR_RECORD = """\
+<Obj N="ExceptionAsErrorRecord" RefId="1"><TN RefId="0">\
+<T>System.Management.Automation.ErrorRecord</T></TN>\
+<ToString>Cannot find path 'C:\\nope'</ToString><MS/></Obj>"""
+
+
+def server_fragments(rpid, pid, messages):
+    data = b""
+    for object_id, (message_type, body) in enumerate(messages, start=1):
+        message = msg.Message(
+            msg.DESTINATION_CLIENT, message_type, rpid, pid,
+            body.encode("utf8")
+        )
+        data += fragment(message.pack(), object_id, max_size=50)
+    return data
+
+
+CREATE_RESPONSE = """\
+<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" \
+xmlns:w="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" \
+xmlns:rsp="http://schemas.microsoft.com/wbem/wsman/1/windows/shell">\
+<s:Body><w:Selector Name="ShellId">{shell_id}</w:Selector>\
+<rsp:CommandResponse><rsp:CommandId>{command_id}</rsp:CommandId>\
+</rsp:CommandResponse></s:Body></s:Envelope>"""
+
+
+class _StubResponse(object):
+    def __init__(self, status, body):
+        self.status = status
+        self._body = body
+
+    async def read(self):
+        return self._body
+
+    async def release(self):
+        pass
+
+
+class _StubSession(object):
+    """ Session answering the requests of a runspace pool and its
+    pipelines, in place of a PowerShell remoting endpoint.
+
+    Parameters
+    ----------
+    pool_state : int
+        RunspaceState of the pool once opened.
+    pipeline_output : list
+        Receive responses of every pipeline, as lists of (message type,
+        CLIXML) pairs.
+    """
+    def __init__(self, pool_state=RUNSPACE_POOL_OPENED, pipeline_output=()):
+        self.pool_state = pool_state
+        self.pipeline_output = list(pipeline_output)
+        self.actions = []
+
+        self._rpid = None
+        self._pipelines = {}
+
+    async def post(self, url, data, headers):
+        root = etree.fromstring(data)
+        action = root.findtext(".//{*}Action")
+        self.actions.append(action)
+
+        body = b""
+        if action == ACTION_CREATE:
+            shell_id = root.find(".//" + WIN_SHELL + "Shell").get("ShellId")
+            self._rpid = uuid.UUID(shell_id)
+            body = CREATE_RESPONSE.format(
+                shell_id=shell_id, command_id=""
+            ).encode("utf8")
+        elif action == ACTION_COMMAND:
+            command_id = root.find(
+                ".//" + WIN_SHELL + "CommandLine"
+            ).get("CommandId")
+            self._pipelines[command_id] = iter(self.pipeline_output)
+            body = CREATE_RESPONSE.format(
+                shell_id="", command_id=command_id
+            ).encode("utf8")
+        elif action == ACTION_RECEIVE:
+            command_id = root.find(
+                ".//" + WIN_SHELL + "DesiredStream"
+            ).get("CommandId")
+            if command_id is None:
+                messages = [(msg.RUNSPACEPOOL_STATE, STATE.format(
+                    name="RunspaceState", state=self.pool_state, extra=""
+                ))]
+                pid = None
+            else:
+                messages = next(self._pipelines[command_id])
+                pid = uuid.UUID(command_id)
+            body = make_receive_response([
+                ("stdout", server_fragments(self._rpid, pid, messages))
+            ])
+        return _StubResponse(200, body)
+
+
+class TestFragment(unittest.TestCase):
+    def test_roundtrip(self):
+        # Given
+        first = bytes(range(256)) * 3
+        second = b"short"
+        data = fragment(first, 1, max_size=100) + fragment(second, 2)
+
+        # When
+        defragmenter = Defragmenter()
+        messages = []
+        for i in range(0, len(data), 7):
+            messages.extend(defragmenter.feed(data[i:i + 7]))
+
+        # Then
+        self.assertEqual(messages, [first, second])
+
+    def test_interleaved(self):
+        # Given
+        first = fragment(b"a" * 30, 1, max_size=10)
+        second = fragment(b"b" * 5, 2)
+        # Split the first message around the second one
+        middle = len(first) // 3
+
+        # When
+        messages = Defragmenter().feed(
+            first[:middle] + second + first[middle:]
+        )
+
+        # Then
+        self.assertEqual(messages, [b"b" * 5, b"a" * 30])
+
+    def test_missing_start(self):
+        # Given
+        data = fragment(b"a" * 30, 1, max_size=10)
+        middle = len(data) // 3
+
+        # When/Then
+        with self.assertRaises(PSRPError):
+            Defragmenter().feed(data[middle:])
+
+
+class TestMessage(unittest.TestCase):
+    def test_roundtrip(self):
+        # Given
+        message = msg.Message(
+            msg.DESTINATION_SERVER, msg.CREATE_PIPELINE, uuid.uuid4(),
+            uuid.uuid4(), b"<Obj/>"
+        )
+
+        # When
+        unpacked = msg.Message.unpack(message.pack())
+
+        # Then
+        self.assertEqual(unpacked, message)
+
+    def test_runspace_pool_message(self):
+        # Given
+        message = msg.Message(
+            msg.DESTINATION_SERVER, msg.SESSION_CAPABILITY, uuid.uuid4(),
+            None, b"<Obj/>"
+        )
+
+        # When
+        packed = message.pack()
+
+        # Then
+        self.assertEqual(packed[24:40], b"\x00" * 16)
+        self.assertIsNone(msg.Message.unpack(packed).pid)
+
+
+class TestCLIXML(unittest.TestCase):
+    def test_object(self):
+        # When
+        process = clixml.loads(PROCESS)
+
+        # Then
+        self.assertEqual(process.type_names[0], "System.Diagnostics.Process")
+        self.assertEqual(process.properties["Name"], "svchost")
+        self.assertEqual(process.properties["Id"], 812)
+        self.assertEqual(process.properties["Modules"], ["a.dll", "b.dll"])
+        priority = process.properties["Priority"]
+        self.assertEqual(str(priority), "Normal")
+        self.assertEqual(priority.value, 32)
+
+    def test_primitives(self):
+        # Given
+        data = """\
+<Obj RefId="0"><DCT>\
+<En><S N="Key">text</S><S N="Value">a_x000D__x000A_b_x005F_x</S></En>\
+<En><S N="Key">flag</S><B N="Value">true</B></En>\
+<En><S N="Key">nothing</S><Nil N="Value"/></En>\
+<En><S N="Key">bytes</S><BA N="Value">AAE=</BA></En>\
+</DCT></Obj>"""
+
+        # When
+        value = clixml.loads(data)
+
+        # Then
+        self.assertEqual(value, {
+            "text": "a\r\nb_x", "flag": True, "nothing": None,
+            "bytes": b"\x00\x01",
+        })
+
+    def test_create_pipeline(self):
+        # Given
+        script = "Get-Item 'a_x' | % { $_ }\r\n<# & #>"
+
+        # When
+        root = etree.fromstring(clixml.create_pipeline(script))
+
+        # Then
+        command = root.find(".//S[@N='Cmd']")
+        self.assertEqual(clixml.decode_string(command.text), script)
+        self.assertEqual(root.find(".//B[@N='IsScript']").text, "true")
+
+
+class TestPipelineProtocol(unittest.TestCase):
+    def setUp(self):
+        self.pool = RunspacePoolProtocol()
+        self.pool.shell_id = "shell"
+        self.pipeline = self.pool.pipeline("Get-Process")
+        self.pipeline.command_id = str(self.pipeline.pid).upper()
+
+    def _response(self, messages):
+        data = server_fragments(self.pool.rpid, self.pipeline.pid, messages)
+        return make_receive_response([("stdout", data)])
+
+    def test_output(self):
+        # Given
+        first = self._response([(msg.PIPELINE_OUTPUT, PROCESS)])
+        second = self._response([
+            (msg.PIPELINE_OUTPUT, "<S>done</S>"),
+            (msg.PIPELINE_STATE, STATE.format(
+                name="PipelineState", state=PIPELINE_COMPLETED, extra=""
+            )),
+        ])
+
+        # When
+        output = self.pipeline.receive_response(200, first)
+        self.assertFalse(self.pipeline.is_done)
+        output += self.pipeline.receive_response(200, second)
+
+        # Then
+        self.assertEqual(output[0].properties["Name"], "svchost")
+        self.assertEqual(output[1], "done")
+        self.assertTrue(self.pipeline.is_done)
+        self.pipeline.raise_for_state()
+
+    def test_failed(self):
+        # Given
+        response = self._response([
+            (msg.PIPELINE_STATE, STATE.format(
+                name="PipelineState", state=PIPELINE_FAILED,
+                extra=ERROR_RECORD
+            )),
+        ])
+
+        # When
+        self.pipeline.receive_response(200, response)
+
+        # Then
+        self.assertTrue(self.pipeline.is_done)
+        with self.assertRaisesRegex(PSRPError, "Cannot find path"):
+            self.pipeline.raise_for_state()
+
+    def test_create_request(self):
+        # When
+        root = etree.fromstring(self.pipeline.create_request())
+
+        # Then
+        arguments = root.findtext(".//{*}Arguments")
+        data = Defragmenter().feed(base64.b64decode(arguments))
+        message = msg.Message.unpack(data[0])
+        self.assertEqual(message.message_type, msg.CREATE_PIPELINE)
+        self.assertEqual(message.rpid, self.pool.rpid)
+        self.assertEqual(message.pid, self.pipeline.pid)
+
+
+class TestRunspacePool(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def run_with_pool(self, session, func):
+        async def run():
+            async with RunspacePool(session, "http://host") as pool:
+                return await func(pool)
+        return self.loop.run_until_complete(run())
+
+    def test_run(self):
+        # Given
+        session = _StubSession(pipeline_output=[
+            [(msg.PIPELINE_OUTPUT, PROCESS)],
+            [
+                (msg.PIPELINE_OUTPUT, "<S>done</S>"),
+                (msg.PIPELINE_STATE, STATE.format(
+                    name="PipelineState", state=PIPELINE_COMPLETED, extra=""
+                )),
+            ],
+        ])
+
+        async def run(pool):
+            self.assertTrue(pool.protocol.is_opened)
+            return pool, await pool.run("Get-Process")
+
+        # When
+        pool, output = self.run_with_pool(session, run)
+
+        # Then
+        self.assertEqual(output[0].properties["Name"], "svchost")
+        self.assertEqual(output[1], "done")
+        self.assertEqual(pool.state, RUNSPACE_POOL_CLOSED)
+        self.assertEqual(session.actions, [
+            ACTION_CREATE, ACTION_RECEIVE, ACTION_COMMAND, ACTION_RECEIVE,
+            ACTION_RECEIVE, ACTION_DELETE,
+        ])
+
+    def test_failed_pipeline(self):
+        # Given
+        session = _StubSession(pipeline_output=[[
+            (msg.PIPELINE_STATE, STATE.format(
+                name="PipelineState", state=PIPELINE_FAILED,
+                extra=ERROR_RECORD
+            )),
+        ]])
+
+        async def run(pool):
+            with self.assertRaisesRegex(PSRPError, "Cannot find path"):
+                await pool.run("Get-Item C:\\nope")
+
+        # When
+        self.run_with_pool(session, run)
+
+        # Then
+        # The pipeline is done: leaving its context does not stop it
+        self.assertNotIn(ACTION_SIGNAL, session.actions)
+        self.assertEqual(session.actions[-1], ACTION_DELETE)
+
+    def test_stop_unfinished_pipeline(self):
+        # Given
+        session = _StubSession(pipeline_output=[
+            [(msg.PIPELINE_OUTPUT, "<S>first</S>")],
+        ])
+
+        async def run(pool):
+            async with pool.pipeline("Get-Process") as pipeline:
+                async for obj in pipeline.stream():
+                    return obj
+
+        # When
+        obj = self.run_with_pool(session, run)
+
+        # Then
+        self.assertEqual(obj, "first")
+        self.assertEqual(
+            session.actions[-2:], [ACTION_SIGNAL, ACTION_DELETE]
+        )
+
+    def test_broken_pool(self):
+        # Given
+        session = _StubSession(pool_state=RUNSPACE_POOL_BROKEN)
+
+        async def run(pool):
+            raise AssertionError("A broken pool is not opened")
+
+        # When
+        with self.assertRaisesRegex(PSRPError, "could not be opened"):
+            self.run_with_pool(session, run)
+
+        # Then
+        # The shell is deleted even though the pool could not be opened
+        self.assertEqual(
+            session.actions, [ACTION_CREATE, ACTION_RECEIVE, ACTION_DELETE]
+        )
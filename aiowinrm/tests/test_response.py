@@ -0,0 +1,47 @@
+import unittest
+
+from aiowinrm.response import Response
+
+
+class TestResponse(unittest.TestCase):
+    def test_lazy_decoding(self):
+        # Given
+        stdout = bytearray("Répertoire de C:\\".encode("cp850"))
+
+        # When
+        response = Response(stdout, b"", 0, encoding="cp850")
+
+        # Then
+        self.assertEqual(response.stdout, "Répertoire de C:\\")
+        self.assertEqual(response.stderr, "")
+        self.assertEqual(response.stdout_bytes, stdout)
+        self.assertIs(response.stdout, response.stdout)
+
+    def test_no_copy(self):
+        # Given
+        stdout = bytearray(b"out")
+
+        # When
+        response = Response(stdout, b"", 0)
+
+        # Then
+        self.assertFalse(hasattr(response, "__dict__"))
+        self.assertIs(response.stdout_bytes.obj, stdout)
+        with self.assertRaises(TypeError):
+            response.stdout_bytes[0] = 0
+
+    def test_str(self):
+        # When
+        response = Response(u"héllo", u"", 0)
+
+        # Then
+        self.assertEqual(response.stdout, u"héllo")
+        self.assertEqual(response.stdout_bytes, u"héllo".encode("utf-8"))
+        self.assertEqual(response, Response(u"héllo".encode("utf-8"), b"", 0))
+
+    def test_invalid(self):
+        # When/Then
+        with self.assertRaises(TypeError):
+            Response(1, b"", 0)
+        with self.assertRaises(TypeError):
+            Response(b"out", b"", None)
@@ -0,0 +1,130 @@
+import unittest
+
+from aiowinrm.errors import (
+    AccessDeniedFault, CircuitOpenError, QuotaLimitFault
+)
+from aiowinrm.retry import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, RetryPolicy,
+    call_with_retry_sync, is_transient
+)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def quota_fault():
+    return QuotaLimitFault(500, "Receiver", "QuotaLimit")
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_backoff(self):
+        # Given
+        policy = RetryPolicy(
+            initial_backoff=1.0, max_backoff=5.0, jitter=False
+        )
+
+        # When/Then
+        self.assertEqual(
+            [policy.backoff(attempt) for attempt in range(1, 6)],
+            [1.0, 2.0, 4.0, 5.0, 5.0]
+        )
+
+    def test_should_retry(self):
+        # Given
+        policy = RetryPolicy(max_attempts=2)
+
+        # When/Then
+        self.assertTrue(policy.should_retry(quota_fault(), 1))
+        self.assertFalse(policy.should_retry(quota_fault(), 2))
+        self.assertFalse(policy.should_retry(
+            AccessDeniedFault(500, "Sender", "AccessDenied"), 1
+        ))
+
+    def test_is_transient(self):
+        # When/Then
+        self.assertTrue(is_transient(ConnectionResetError()))
+        self.assertFalse(is_transient(ValueError()))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_open_and_close(self):
+        # Given
+        clock = FakeClock()
+        breaker = CircuitBreaker(
+            failure_threshold=2, reset_timeout=10, clock=clock
+        )
+
+        # When/Then
+        breaker.record_failure("a")
+        breaker.check("a")
+        breaker.record_failure("a")
+        self.assertEqual(breaker.state("a"), OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.check("a")
+        breaker.check("b")
+
+        clock.now = 10
+        self.assertEqual(breaker.state("a"), HALF_OPEN)
+        breaker.check("a")
+        # A single trial at a time
+        with self.assertRaises(CircuitOpenError):
+            breaker.check("a")
+
+        breaker.record_success("a")
+        self.assertEqual(breaker.state("a"), CLOSED)
+
+    def test_failed_trial(self):
+        # Given
+        clock = FakeClock()
+        breaker = CircuitBreaker(
+            failure_threshold=1, reset_timeout=10, clock=clock
+        )
+        breaker.record_failure("a")
+        clock.now = 10
+        breaker.check("a")
+
+        # When
+        breaker.record_failure("a")
+
+        # Then
+        self.assertEqual(breaker.state("a"), OPEN)
+
+
+class TestCallWithRetry(unittest.TestCase):
+    def test_retry(self):
+        # Given
+        errors = [quota_fault(), quota_fault()]
+
+        def func():
+            if errors:
+                raise errors.pop()
+            return "ok"
+
+        policy = RetryPolicy(initial_backoff=0.001)
+
+        # When
+        result = call_with_retry_sync(func, "a", policy)
+
+        # Then
+        self.assertEqual(result, "ok")
+
+    def test_circuit_breaker(self):
+        # Given
+        calls = []
+
+        def func():
+            calls.append(None)
+            raise ConnectionRefusedError()
+
+        breaker = CircuitBreaker(failure_threshold=2)
+        policy = RetryPolicy(max_attempts=5, initial_backoff=0.001)
+
+        # When/Then
+        with self.assertRaises(CircuitOpenError):
+            call_with_retry_sync(func, "a", policy, breaker)
+        self.assertEqual(len(calls), 2)
@@ -0,0 +1,190 @@
+import asyncio
+import contextlib
+import io
+import json
+import socket
+import unittest
+
+from aiowinrm.__main__ import main
+from aiowinrm.errors import (
+    AuthenticationError, CircuitOpenError, QuotaLimitFault, TransportError
+)
+from aiowinrm.response import HostResult
+from aiowinrm.runner import (
+    WorkerError, _dump_result, _load_result, run_cmd_sharded
+)
+
+from .mock_server import MockWinRMServer, static_output
+
+
+def _unused_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return "http://127.0.0.1:{}/wsman".format(s.getsockname()[1])
+
+
+class TestRunCmdSharded(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        stack = contextlib.ExitStack()
+        self.addCleanup(stack.close)
+        self.servers = [
+            stack.enter_context(MockWinRMServer(
+                static_output(b"out", b"err", exit_code=i)
+            ).run_in_thread())
+            for i in range(2)
+        ]
+
+    def run_sharded(self, hosts, **kw):
+        progress = []
+
+        async def run():
+            return [
+                result async for result in run_cmd_sharded(
+                    hosts, None, "dir", processes=2,
+                    progress=lambda *a: progress.append(a), **kw
+                )
+            ]
+
+        return self.loop.run_until_complete(run()), progress
+
+    def test_ordered(self):
+        # Given
+        unreachable = _unused_url()
+        hosts = [
+            self.servers[0].url, unreachable, self.servers[1].url,
+            self.servers[0].url,
+        ]
+
+        # When
+        results, progress = self.run_sharded(hosts)
+
+        # Then
+        self.assertEqual([result.host for result in results], hosts)
+        self.assertEqual(
+            [result.ok for result in results], [True, False, True, True]
+        )
+        self.assertEqual(
+            [result.response.returncode for result in results if result.ok],
+            [0, 1, 0]
+        )
+        self.assertEqual(results[0].response.stdout, "out")
+        self.assertEqual(results[0].response.stderr, "err")
+        self.assertEqual(progress, [(i, 4) for i in range(1, 5)])
+
+    def test_unordered(self):
+        # Given
+        hosts = [server.url for server in self.servers] * 3
+
+        # When
+        results, _ = self.run_sharded(hosts, ordered=False, rate=100)
+
+        # Then
+        self.assertEqual(
+            sorted(result.host for result in results), sorted(hosts)
+        )
+        self.assertTrue(all(result.ok for result in results))
+
+    def test_typed_fault(self):
+        # Given
+        server = MockWinRMServer(create_faults=10)
+
+        # When
+        with server.run_in_thread():
+            (result,), _ = self.run_sharded([server.url])
+
+        # Then
+        error = result.exception
+        self.assertIsInstance(error, QuotaLimitFault)
+        self.assertEqual(error.subcode, "QuotaLimit")
+        self.assertIsNotNone(error.wsman_code)
+        self.assertTrue(error.transient)
+
+
+class TestDumpResult(unittest.TestCase):
+    def _round_trip(self, exception):
+        data = _dump_result(3, HostResult("host", exception=exception))
+        index, result = _load_result(data)
+        self.assertEqual(index, 3)
+        self.assertEqual(result.host, "host")
+        return result.exception
+
+    def test_exceptions(self):
+        # Given
+        fault = QuotaLimitFault(
+            500, "Receiver", "QuotaLimit", "Too many shells", 2150859173,
+            "server"
+        )
+        errors = (
+            fault, TransportError("Bad gateway", 502),
+            AuthenticationError("Unauthorized", 401),
+            CircuitOpenError("Circuit open", "host"),
+        )
+
+        for error in errors:
+            # When
+            loaded = self._round_trip(error)
+
+            # Then
+            self.assertIs(type(loaded), type(error))
+            self.assertEqual(str(loaded), str(error))
+            self.assertEqual(vars(loaded), vars(error))
+            self.assertEqual(loaded.transient, error.transient)
+
+    def test_unpicklable(self):
+        # Given
+        class LocalError(Exception):
+            pass
+
+        # When
+        loaded = self._round_trip(LocalError("oops"))
+
+        # Then
+        self.assertIsInstance(loaded, WorkerError)
+        self.assertEqual(loaded.type_name, "LocalError")
+
+
+class TestMain(unittest.TestCase):
+    def test_json(self):
+        # Given
+        server = MockWinRMServer(static_output(b"hello\r\n", exit_code=3))
+        output = io.StringIO()
+
+        # When
+        with server.run_in_thread():
+            with contextlib.redirect_stdout(output):
+                status = main([
+                    "--processes", "1", "--json", server.url, "--",
+                    "echo", "hello",
+                ])
+
+        # Then
+        self.assertEqual(status, 1)
+        record = json.loads(output.getvalue())
+        self.assertEqual(record["host"], server.url)
+        self.assertEqual(record["returncode"], 3)
+        self.assertEqual(record["stdout"], "hello\r\n")
+
+    def test_undecodable_output(self):
+        # Given
+        # Latin-1 output of a shell using the UTF-8 codepage
+        server = MockWinRMServer(static_output(b"caf\xe9\r\n", b"\xff"))
+        output = io.StringIO()
+
+        # When
+        with server.run_in_thread():
+            with contextlib.redirect_stdout(output):
+                status = main([
+                    "--processes", "1", server.url, "--", "type", "menu",
+                ])
+
+        # Then
+        self.assertEqual(status, 0)
+        self.assertEqual(output.getvalue().splitlines(), [
+            "{}: caf\ufffd".format(server.url),
+            "{} [stderr]: \ufffd".format(server.url),
+            "{}: exit code 0".format(server.url),
+        ])
+
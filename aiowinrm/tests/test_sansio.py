@@ -0,0 +1,135 @@
+import unittest
+
+from aiowinrm.errors import (
+    AIOWinRMException, AuthenticationError, EncodingLimitFault, TransportError
+)
+from aiowinrm.sansio import CommandProtocol, ShellProtocol
+
+from .test_protocol import DONE, make_receive_response
+
+
+ENCODING_LIMIT_FAULT = b"""\
+<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" \
+xmlns:w="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd"><s:Body>\
+<s:Fault><s:Code><s:Value>s:Sender</s:Value><s:Subcode>\
+<s:Value>w:EncodingLimit</s:Value></s:Subcode></s:Code></s:Fault>\
+</s:Body></s:Envelope>"""
+
+TIMED_OUT_FAULT = ENCODING_LIMIT_FAULT.replace(b"EncodingLimit", b"TimedOut")
+
+
+def make_command(**kw):
+    command = CommandProtocol("shell", "dir", **kw)
+    command.command_id = "command"
+    return command
+
+
+class TestShellProtocol(unittest.TestCase):
+    def test_command_inherits_settings(self):
+        # Given
+        shell = ShellProtocol(
+            max_envelope_size=4096, operation_timeout=5.0,
+            adaptive_envelope_size=True
+        )
+        shell.shell_id = "shell"
+
+        # When
+        command = shell.command("dir", console_mode_stdin=False)
+
+        # Then
+        self.assertEqual(command.shell_id, "shell")
+        self.assertEqual(command.max_envelope_size, 4096)
+        self.assertEqual(command.operation_timeout, 5.0)
+        self.assertEqual(command.receive_envelope_size, 4096)
+        self.assertFalse(command.console_mode_stdin)
+
+    def test_codepage(self):
+        # Given
+        shell = ShellProtocol(codepage=437)
+
+        # When
+        request = shell.create_request()
+
+        # Then
+        self.assertIn(b'Name="WINRS_CODEPAGE">437<', request)
+        self.assertEqual(shell.encoding, "cp437")
+
+    def test_http_error(self):
+        # Given
+        shell = ShellProtocol()
+
+        # When/Then
+        with self.assertRaises(AuthenticationError):
+            shell.create_response(401, b"")
+        with self.assertRaises(TransportError) as context:
+            shell.create_response(503, b"Service Unavailable")
+        self.assertTrue(context.exception.transient)
+        self.assertIsInstance(context.exception, AIOWinRMException)
+        self.assertIsNone(shell.shell_id)
+
+
+class TestCommandProtocolReceive(unittest.TestCase):
+    def test_incremental(self):
+        # Given
+        command = make_command()
+        response = make_receive_response(
+            [("stdout", b"hello"), ("stderr", b"oops")], state=DONE.format(1)
+        )
+
+        # When
+        command.receive_request()
+        for i in range(0, len(response), 11):
+            command.receive_feed(response[i:i + 11])
+        stdout, stderr, return_code, is_done = command.receive_result()
+
+        # Then
+        self.assertEqual(stdout, b"hello")
+        self.assertEqual(stderr, b"oops")
+        self.assertEqual(return_code, 1)
+        self.assertTrue(is_done)
+        self.assertEqual(command.return_code, 1)
+        self.assertTrue(command.is_done)
+
+    def test_encoding_limit_retry(self):
+        # Given
+        command = make_command(
+            max_envelope_size=1024, adaptive_envelope_size=True
+        )
+        command.receive_request()
+        command.receive_feed(make_receive_response([("stdout", b"x" * 1024)]))
+        command.receive_result()
+        self.assertEqual(command.receive_envelope_size, 2048)
+
+        # When
+        command.receive_request()
+        retry = command.receive_failed(500, ENCODING_LIMIT_FAULT)
+
+        # Then
+        self.assertTrue(retry)
+        self.assertEqual(command.receive_envelope_size, 1024)
+
+    def test_error_without_tuning(self):
+        # Given
+        command = make_command(max_envelope_size=1024)
+
+        # When/Then
+        command.receive_request()
+        with self.assertRaises(EncodingLimitFault) as context:
+            command.receive_failed(500, ENCODING_LIMIT_FAULT)
+        self.assertEqual(context.exception.status, 500)
+        self.assertEqual(context.exception.code, "Sender")
+        self.assertFalse(context.exception.transient)
+
+    def test_timed_out(self):
+        # Given
+        command = make_command()
+
+        # When
+        command.receive_request()
+        retry = command.receive_failed(500, TIMED_OUT_FAULT)
+
+        # Then
+        self.assertTrue(retry)
+        self.assertFalse(command.is_done)
+        self.assertEqual(command.poll_stats.timed_out_polls, 1)
+        self.assertEqual(command.poll_delay(), 0.0)
@@ -0,0 +1,64 @@
+import unittest
+import uuid
+
+import lxml.etree as etree
+
+from aiowinrm.soap.header import Header
+from aiowinrm.soap.protocol import cleanup_command, command_output
+from aiowinrm.soap.template import EnvelopeTemplate, envelope_template
+
+
+class TestEnvelopeTemplate(unittest.TestCase):
+    def test_render_matches_builder(self):
+        # Given
+        message_id = uuid.uuid4()
+        shell_id = "0A0B0C0D-0000-0000-0000-000000000000"
+        command_id = "11111111-2222-3333-4444-555555555555"
+
+        envelope = command_output(shell_id, command_id)
+        r_payload = etree.tostring(envelope)
+        old_id = envelope.find(".//{*}MessageID").text
+
+        # When
+        template = EnvelopeTemplate.from_envelope(envelope)
+        payload = template.render(message_id)
+
+        # Then
+        self.assertEqual(
+            payload,
+            r_payload.replace(
+                old_id.encode("ascii"),
+                "uuid:{}".format(message_id).encode("ascii")
+            )
+        )
+
+    def test_fresh_message_id(self):
+        # Given
+        template = envelope_template(cleanup_command, "shell", "command")
+
+        # When
+        first = etree.fromstring(template.render())
+        second = etree.fromstring(template.render())
+
+        # Then
+        self.assertNotEqual(
+            first.find(".//{*}MessageID").text,
+            second.find(".//{*}MessageID").text,
+        )
+
+    def test_cached(self):
+        # When
+        first = envelope_template(command_output, "shell", "command")
+        second = envelope_template(command_output, "shell", "command")
+
+        # Then
+        self.assertIs(first, second)
+
+    def test_no_message_id(self):
+        # Given
+        header = Header(action="dummy").to_dom()
+        header.remove(header.find(".//{*}MessageID"))
+
+        # When/Then
+        with self.assertRaises(ValueError):
+            EnvelopeTemplate.from_envelope(header)
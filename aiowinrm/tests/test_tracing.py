@@ -0,0 +1,89 @@
+import unittest
+
+from aiowinrm.sansio import CommandProtocol, ShellProtocol
+from aiowinrm.tracing import (
+    NULL_TRACER, CallbackTracer, PrometheusTracer, soap_action
+)
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+class TestSoapAction(unittest.TestCase):
+    def test_actions(self):
+        # Given
+        shell = ShellProtocol()
+        command = CommandProtocol("shell", "dir")
+        command.command_id = "command"
+
+        # When/Then
+        self.assertEqual(soap_action(shell.create_request()), "Create")
+        self.assertEqual(soap_action(command.create_request()), "Command")
+        self.assertEqual(soap_action(command.receive_request()), "Receive")
+        self.assertEqual(soap_action(command.receive_request(3)), "Receive")
+        self.assertIsNone(soap_action(b"<a/>"))
+
+
+class TestCallbackTracer(unittest.TestCase):
+    def test_record(self):
+        # Given
+        records = []
+        tracer = CallbackTracer(records.append)
+        payload = ShellProtocol().create_request()
+
+        # When
+        span = tracer.start_request("http://host:5985/wsman", payload, 1)
+        span.finish(200, 42)
+
+        # Then
+        record, = records
+        self.assertEqual(record.host, "http://host:5985/wsman")
+        self.assertEqual(record.action, "Create")
+        self.assertEqual(record.request_size, len(payload))
+        self.assertEqual(record.retry, 1)
+        self.assertEqual(record.status, 200)
+        self.assertEqual(record.response_size, 42)
+        self.assertGreaterEqual(record.duration, 0)
+        self.assertIsNone(record.error)
+
+    def test_null_tracer(self):
+        # When
+        span = NULL_TRACER.start_request("http://host:5985/wsman", b"")
+
+        # Then
+        self.assertIs(span, NULL_TRACER.start_request("", b""))
+        span.finish(error=ValueError())
+
+
+@unittest.skipIf(prometheus_client is None, "prometheus_client is needed")
+class TestPrometheusTracer(unittest.TestCase):
+    def test_metrics(self):
+        # Given
+        registry = prometheus_client.CollectorRegistry()
+        tracer = PrometheusTracer(registry)
+        payload = ShellProtocol().create_request()
+
+        # When
+        tracer.start_request("http://host", payload).finish(200, 10)
+        tracer.start_request("http://host", payload, 1).finish(
+            error=OSError()
+        )
+
+        # Then
+        def value(name, **labels):
+            return registry.get_sample_value(name, labels)
+
+        self.assertEqual(
+            value("aiowinrm_requests_total", action="Create", status="200"), 1
+        )
+        self.assertEqual(
+            value("aiowinrm_requests_total", action="Create", status="error"),
+            1
+        )
+        self.assertEqual(value("aiowinrm_retries_total", action="Create"), 1)
+        self.assertEqual(
+            value("aiowinrm_request_bytes_total", action="Create"),
+            2 * len(payload)
+        )
@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import aiohttp
+
+from aiowinrm.core import ShellContext
+from aiowinrm.errors import TransferError
+from aiowinrm.transfer import MIN_CHANNEL_SIZE, _split, download, upload
+
+from .mock_server import FakeTransferShell, MockWinRMServer
+
+
+class TestSplit(unittest.TestCase):
+    def test_split(self):
+        # Given
+        size = 5 * MIN_CHANNEL_SIZE + 1
+
+        # When
+        ranges = _split(size, 4)
+
+        # Then
+        self.assertEqual(len(ranges), 4)
+        self.assertEqual(ranges[0], (0, ranges[1][0]))
+        self.assertEqual(sum(count for _, count in ranges), size)
+
+    def test_small(self):
+        # When/Then
+        self.assertEqual(_split(10, 4), [(0, 10)])
+
+
+class TestTransfer(unittest.TestCase):
+    def setUp(self):
+        self.prefix = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.prefix)
+
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def _run(self, func, shell_factory=FakeTransferShell):
+        files = {}
+        server = MockWinRMServer(
+            lambda command, args: shell_factory(files, command, args)
+        )
+
+        async def run():
+            async with server:
+                async with aiohttp.ClientSession() as session:
+                    async with ShellContext(
+                        session, server.url
+                    ) as shell_context:
+                        return await func(shell_context, files)
+
+        return self.loop.run_until_complete(run())
+
+    def test_round_trip(self):
+        # Given
+        data = os.urandom(2 * MIN_CHANNEL_SIZE + 12345)
+        source = os.path.join(self.prefix, "source.bin")
+        target = os.path.join(self.prefix, "target.bin")
+        with open(source, "wb") as fp:
+            fp.write(data)
+
+        async def round_trip(shell_context, files):
+            up = await upload(shell_context, source, "C:\\it's.bin")
+            remote = bytes(files["C:\\it's.bin"])
+            down = await download(shell_context, "C:\\it's.bin", target)
+            return up, remote, down
+
+        # When
+        up, remote, down = self._run(round_trip)
+
+        # Then
+        r_digest = hashlib.sha256(data).hexdigest()
+        self.assertEqual(up, r_digest)
+        self.assertEqual(down, r_digest)
+        self.assertEqual(remote, data)
+        with open(target, "rb") as fp:
+            self.assertEqual(fp.read(), data)
+
+    def test_empty(self):
+        # Given
+        source = os.path.join(self.prefix, "empty.bin")
+        open(source, "wb").close()
+
+        async def empty_upload(shell_context, files):
+            await upload(shell_context, source, "C:\\empty.bin")
+            return files["C:\\empty.bin"]
+
+        # When
+        remote = self._run(empty_upload)
+
+        # Then
+        self.assertEqual(remote, b"")
+
+    def test_checksum_mismatch(self):
+        # Given
+        source = os.path.join(self.prefix, "source.bin")
+        with open(source, "wb") as fp:
+            fp.write(b"data")
+
+        class WrongHashShell(FakeTransferShell):
+            def __init__(self, files, command, args):
+                super(WrongHashShell, self).__init__(files, command, args)
+                if len(self._output) == 64:
+                    self._output = b"0" * 64
+
+        async def upload_file(shell_context, files):
+            await upload(shell_context, source, "C:\\f.bin")
+
+        # When/Then
+        with self.assertRaisesRegex(TransferError, "Checksum mismatch"):
+            self._run(upload_file, shell_factory=WrongHashShell)
@@ -0,0 +1,46 @@
+import unittest
+
+from aiowinrm.tuning import EnvelopeSizeTuner
+
+
+class TestEnvelopeSizeTuner(unittest.TestCase):
+    def test_grow(self):
+        # Given
+        tuner = EnvelopeSizeTuner(initial=1000, maximum=3000)
+
+        # When/Then
+        tuner.update(100)
+        self.assertEqual(tuner.size, 1000)
+
+        tuner.update(900)
+        self.assertEqual(tuner.size, 2000)
+
+        tuner.update(1900)
+        self.assertEqual(tuner.size, 3000)
+
+        tuner.update(2900)
+        self.assertEqual(tuner.size, 3000)
+
+    def test_limit_exceeded(self):
+        # Given
+        tuner = EnvelopeSizeTuner(initial=1000, maximum=8000)
+        tuner.update(1000)
+        tuner.update(2000)
+        self.assertEqual(tuner.size, 4000)
+
+        # When
+        retry = tuner.limit_exceeded()
+
+        # Then
+        self.assertTrue(retry)
+        self.assertEqual(tuner.size, 2000)
+        tuner.update(2000)
+        self.assertEqual(tuner.size, 2000)
+
+        # When
+        tuner.limit_exceeded()
+        retry = tuner.limit_exceeded()
+
+        # Then
+        self.assertFalse(retry)
+        self.assertEqual(tuner.size, 1000)
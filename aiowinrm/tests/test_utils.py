@@ -1,7 +1,8 @@
+import pickle
 import unittest
 
 from aiowinrm.constants import TranportKind
-from aiowinrm.utils import parse_host
+from aiowinrm.utils import Endpoint, parse_endpoint, parse_host
 
 
 class TestParseHost(unittest.TestCase):
@@ -25,3 +26,74 @@ class TestParseHost(unittest.TestCase):
 
         # Then
         self.assertEqual(complete_host, r_complete_host)
+
+    def test_port_and_path(self):
+        # Given
+        host = "HTTPS://host.example.com:1234/wsman"
+
+        # When
+        complete_host = parse_host(host, TranportKind.http)
+
+        # Then
+        self.assertEqual(complete_host, "https://host.example.com:1234/wsman")
+
+    def test_ipv6(self):
+        # Given
+        hosts = ("::1", "[::1]", "http://[::1]/wsman", "[::1]:5985")
+
+        for host in hosts:
+            # When
+            complete_host = parse_host(host, TranportKind.http)
+
+            # Then
+            self.assertEqual(complete_host, "http://[::1]:5985/wsman")
+
+        # When
+        complete_host = parse_host("[fe80::1]:1234")
+
+        # Then
+        self.assertEqual(complete_host, "https://[fe80::1]:1234/wsman")
+
+    def test_invalid(self):
+        # When/Then
+        with self.assertRaises(ValueError):
+            parse_host("host", transport="ftp")
+        with self.assertRaises(ValueError):
+            parse_host("!host")
+
+
+class TestParseEndpoint(unittest.TestCase):
+    def test_simple(self):
+        # When
+        endpoint = parse_endpoint("[2001:db8::1]:1234", TranportKind.http)
+
+        # Then
+        self.assertEqual(endpoint.scheme, "http")
+        self.assertEqual(endpoint.host, "2001:db8::1")
+        self.assertEqual(endpoint.port, 1234)
+        self.assertEqual(endpoint.path, "wsman")
+        self.assertEqual(endpoint.url, "http://[2001:db8::1]:1234/wsman")
+        self.assertEqual(str(endpoint), endpoint.url)
+
+    def test_cached(self):
+        # When
+        endpoint = parse_endpoint("192.168.1.1", TranportKind.http)
+
+        # Then
+        self.assertIs(
+            parse_endpoint("192.168.1.1", TranportKind.http), endpoint
+        )
+        self.assertIsNot(parse_endpoint("192.168.1.1"), endpoint)
+
+    def test_value_semantics(self):
+        # Given
+        endpoint = Endpoint("http", "host", 5985)
+
+        # When/Then
+        self.assertEqual(endpoint, parse_endpoint("host", TranportKind.http))
+        self.assertEqual(
+            len({endpoint, parse_endpoint("http://host:5985/wsman")}), 1
+        )
+        self.assertEqual(pickle.loads(pickle.dumps(endpoint)), endpoint)
+        with self.assertRaises(AttributeError):
+            endpoint.port = 5986
@@ -0,0 +1,251 @@
+""" Instrumentation of WinRM requests.
+
+Every SOAP request goes through a tracer: tracer.start_request is called
+before sending it, and the returned span is finished once the response is
+read. The default tracer, NULL_TRACER, does nothing, so that instrumentation
+costs two method calls per request when disabled.
+
+Tracers built on RecordingTracer get a RequestRecord for every request,
+with the SOAP action, host, timing, sizes and retry count. The OpenTelemetry
+and Prometheus adapters require opentelemetry-api and prometheus_client
+respectively, which are only imported when the adapter is created.
+"""
+import re
+import time
+
+from attr import attributes, attr
+
+from .soap.namespaces import NAMESPACE, NS_ADDRESSING
+
+
+# Prefix of the addressing namespace in the envelopes sent by aiowinrm
+_ADDRESSING_PREFIX = next(
+    prefix for prefix, namespace in NAMESPACE.items()
+    if namespace == NS_ADDRESSING
+)
+_R_ACTION = re.compile(
+    "<{0}:Action[^>]*>([^<]+)</{0}:Action>".format(
+        re.escape(_ADDRESSING_PREFIX)
+    ).encode("ascii")
+)
+
+
+def soap_action(payload):
+    """ Return the short name of the SOAP action of a request payload, e.g.
+    "Receive", or None if it cannot be found.
+    """
+    match = _R_ACTION.search(payload)
+    if match is None:
+        return None
+    return match.group(1).decode("ascii").rpartition("/")[2]
+
+
+@attributes
+class RequestRecord:
+    """ What is known about a finished WinRM request.
+    """
+    host = attr()
+    # Short name of the SOAP action, e.g. "Create" or "Receive"
+    action = attr()
+    request_size = attr()
+    # Number of times the request was sent before, e.g. after an
+    # EncodingLimit fault
+    retry = attr(default=0)
+    # time.time() when the request was sent
+    start_time = attr(default=None)
+    # Seconds between sending the request and reading its response
+    duration = attr(default=None)
+    # HTTP status, None if no response was received
+    status = attr(default=None)
+    response_size = attr(default=0)
+    # Exception raised while sending the request or reading its response
+    error = attr(default=None)
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def finish(self, status=None, response_size=0, error=None):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer(object):
+    """ Base class of tracers, which does nothing.
+    """
+    def start_request(self, host, payload, retry=0):
+        """ Called before sending a request.
+
+        Parameters
+        ----------
+        host : str
+            URL of the WinRM endpoint.
+        payload : bytes
+            Body of the request.
+        retry : int
+            Number of times this request was sent before.
+
+        Returns
+        -------
+        span : object
+            Object whose finish(status=None, response_size=0, error=None)
+            method is called once the response is read, or the request
+            failed.
+        """
+        return _NULL_SPAN
+
+
+NULL_TRACER = Tracer()
+
+
+class _RecordingSpan(object):
+    __slots__ = ("_tracer", "_record", "_started")
+
+    def __init__(self, tracer, record):
+        self._tracer = tracer
+        self._record = record
+        self._started = time.perf_counter()
+
+    def finish(self, status=None, response_size=0, error=None):
+        record = self._record
+        record.duration = time.perf_counter() - self._started
+        record.status = status
+        record.response_size = response_size
+        record.error = error
+        self._tracer.record(record)
+
+
+class RecordingTracer(Tracer):
+    """ Base class of tracers consuming one RequestRecord per request.
+
+    Subclasses implement record.
+    """
+    def start_request(self, host, payload, retry=0):
+        record = RequestRecord(
+            host, soap_action(payload), len(payload), retry,
+            start_time=time.time()
+        )
+        return _RecordingSpan(self, record)
+
+    def record(self, record):
+        raise NotImplementedError()
+
+
+class CallbackTracer(RecordingTracer):
+    """ Tracer calling callback with the RequestRecord of every request, e.g.
+    to log them.
+    """
+    def __init__(self, callback):
+        self.callback = callback
+
+    def record(self, record):
+        self.callback(record)
+
+
+class OpenTelemetryTracer(RecordingTracer):
+    """ Tracer creating an OpenTelemetry client span per request.
+
+    Parameters
+    ----------
+    tracer : opentelemetry.trace.Tracer or None
+        Tracer creating the spans. Defaults to the "aiowinrm" tracer of the
+        global tracer provider.
+    """
+    def __init__(self, tracer=None):
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImportError(
+                "OpenTelemetryTracer requires the opentelemetry-api package"
+            )
+
+        if tracer is None:
+            tracer = trace.get_tracer("aiowinrm")
+        self._tracer = tracer
+        self._trace = trace
+
+    def record(self, record):
+        trace = self._trace
+
+        attributes = {
+            "rpc.system": "winrm",
+            "rpc.method": record.action or "unknown",
+            "url.full": record.host,
+            "http.request.body.size": record.request_size,
+            "http.response.body.size": record.response_size,
+            "winrm.retry": record.retry,
+        }
+        if record.status is not None:
+            attributes["http.response.status_code"] = record.status
+
+        start_time = int(record.start_time * 1e9)
+        span = self._tracer.start_span(
+            "WinRM {}".format(record.action), kind=trace.SpanKind.CLIENT,
+            attributes=attributes, start_time=start_time,
+        )
+        if record.error is not None:
+            span.record_exception(record.error)
+            span.set_status(trace.Status(trace.StatusCode.ERROR))
+        elif record.status != 200:
+            span.set_status(trace.Status(trace.StatusCode.ERROR))
+        span.end(end_time=start_time + int(record.duration * 1e9))
+
+
+class PrometheusTracer(RecordingTracer):
+    """ Tracer updating Prometheus metrics, labelled by SOAP action.
+
+    Hosts are not used as labels, to keep the number of time series bounded
+    when running commands on many hosts.
+
+    Parameters
+    ----------
+    registry : prometheus_client.CollectorRegistry or None
+        Registry of the metrics, the default one if None.
+    namespace : str
+        Prefix of the metric names.
+    """
+    def __init__(self, registry=None, namespace="aiowinrm"):
+        try:
+            from prometheus_client import Counter, Histogram
+        except ImportError:
+            raise ImportError(
+                "PrometheusTracer requires the prometheus_client package"
+            )
+
+        kw = {"namespace": namespace}
+        if registry is not None:
+            kw["registry"] = registry
+
+        self.requests = Counter(
+            "requests", "WinRM requests", ["action", "status"], **kw
+        )
+        self.duration = Histogram(
+            "request_duration_seconds", "Duration of WinRM requests",
+            ["action"], **kw
+        )
+        self.request_bytes = Counter(
+            "request_bytes", "Bytes sent in WinRM requests", ["action"], **kw
+        )
+        self.response_bytes = Counter(
+            "response_bytes", "Bytes received in WinRM responses",
+            ["action"], **kw
+        )
+        self.retries = Counter(
+            "retries", "WinRM requests sent again", ["action"], **kw
+        )
+
+    def record(self, record):
+        action = record.action or "unknown"
+        if record.status is None:
+            status = "error"
+        else:
+            status = str(record.status)
+
+        self.requests.labels(action, status).inc()
+        self.duration.labels(action).observe(record.duration)
+        self.request_bytes.labels(action).inc(record.request_size)
+        self.response_bytes.labels(action).inc(record.response_size)
+        if record.retry:
+            self.retries.labels(action).inc()
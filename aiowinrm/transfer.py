@@ -0,0 +1,272 @@
+""" File transfer over WinRM.
+
+Data goes through the stdin/stdout streams of small PowerShell commands, so
+the only encoding overhead is the base64 of the SOAP envelopes. Files are
+split in ranges transferred by concurrent commands within one shell.
+"""
+import asyncio
+import hashlib
+import mmap
+import os
+
+from .core import CommandContext
+from .errors import TransferError
+from .utils import powershell_command, quote_powershell
+
+
+# Ranges smaller than this are not worth a command of their own
+MIN_CHANNEL_SIZE = 1024 * 1024
+
+# Block size used by the remote scripts
+_REMOTE_BUFFER_SIZE = 65536
+
+_ALLOCATE_SCRIPT = """\
+$ErrorActionPreference = 'Stop'
+$path = {path}
+$length = {length}
+$f = [IO.File]::Open($path, 'Create', 'Write', 'ReadWrite')
+$f.SetLength($length)
+$f.Close()
+"""
+
+_WRITE_RANGE_SCRIPT = """\
+$ErrorActionPreference = 'Stop'
+$path = {path}
+$offset = {offset}
+$count = {count}
+$in = [Console]::OpenStandardInput()
+$f = [IO.File]::Open($path, 'Open', 'Write', 'ReadWrite')
+$f.Seek($offset, 'Begin') | Out-Null
+$buf = New-Object byte[] {buffer_size}
+while ($count -gt 0) {{
+    $n = $in.Read($buf, 0, [Math]::Min($buf.Length, $count))
+    if ($n -le 0) {{ break }}
+    $f.Write($buf, 0, $n)
+    $count -= $n
+}}
+$f.Close()
+if ($count -ne 0) {{ throw "Input ended $count bytes early" }}
+"""
+
+_READ_RANGE_SCRIPT = """\
+$ErrorActionPreference = 'Stop'
+$path = {path}
+$offset = {offset}
+$count = {count}
+$out = [Console]::OpenStandardOutput()
+$f = [IO.File]::Open($path, 'Open', 'Read', 'ReadWrite')
+$f.Seek($offset, 'Begin') | Out-Null
+$buf = New-Object byte[] {buffer_size}
+while ($count -gt 0) {{
+    $n = $f.Read($buf, 0, [Math]::Min($buf.Length, $count))
+    if ($n -le 0) {{ break }}
+    $out.Write($buf, 0, $n)
+    $count -= $n
+}}
+$out.Flush()
+$f.Close()
+"""
+
+_SIZE_SCRIPT = """\
+$ErrorActionPreference = 'Stop'
+$path = {path}
+[Console]::Out.Write((Get-Item -LiteralPath $path).Length)
+"""
+
+_SHA256_SCRIPT = """\
+$ErrorActionPreference = 'Stop'
+$path = {path}
+$f = [IO.File]::Open($path, 'Open', 'Read', 'ReadWrite')
+$hash = [Security.Cryptography.SHA256]::Create().ComputeHash($f)
+$f.Close()
+[Console]::Out.Write([BitConverter]::ToString($hash).Replace('-', ''))
+"""
+
+
+async def upload(shell_context, local_path, remote_path, channels=4):
+    """ Copy a local file to the remote host.
+
+    Parameters
+    ----------
+    shell_context : ShellContext
+        An open shell on the remote host.
+    local_path : str
+        Path of the file to upload.
+    remote_path : str
+        Destination path on the remote host. Overwritten if it exists.
+    channels : int
+        Maximum number of ranges transferred in parallel.
+
+    Returns
+    -------
+    sha256 : str
+        Hex digest of the file, checked against the remote copy.
+    """
+    with open(local_path, "rb") as fp:
+        size = os.fstat(fp.fileno()).st_size
+        await _run_script(
+            shell_context, _ALLOCATE_SCRIPT, path=remote_path, length=size
+        )
+        if size == 0:
+            digest = hashlib.sha256().hexdigest()
+        else:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    await asyncio.gather(*(
+                        _run_script(
+                            shell_context, _WRITE_RANGE_SCRIPT,
+                            stdin=view[offset:offset + count],
+                            path=remote_path, offset=offset, count=count,
+                        )
+                        for offset, count in _split(size, channels)
+                    ))
+                    digest = hashlib.sha256(view).hexdigest()
+                finally:
+                    view.release()
+
+    await _check_remote_digest(shell_context, remote_path, digest)
+    return digest
+
+
+async def download(shell_context, remote_path, local_path, channels=4):
+    """ Copy a remote file to the local host.
+
+    Parameters
+    ----------
+    shell_context : ShellContext
+        An open shell on the remote host.
+    remote_path : str
+        Path of the file on the remote host.
+    local_path : str
+        Local destination path. Overwritten if it exists.
+    channels : int
+        Maximum number of ranges transferred in parallel.
+
+    Returns
+    -------
+    sha256 : str
+        Hex digest of the file, checked against the remote copy.
+    """
+    output = await _run_script(shell_context, _SIZE_SCRIPT, path=remote_path)
+    size = int(output)
+
+    with open(local_path, "w+b") as fp:
+        fp.truncate(size)
+        if size == 0:
+            digest = hashlib.sha256().hexdigest()
+        else:
+            with mmap.mmap(fp.fileno(), size) as mm:
+                view = memoryview(mm)
+                try:
+                    await asyncio.gather(*(
+                        _read_range(
+                            shell_context, remote_path,
+                            view[offset:offset + count], offset
+                        )
+                        for offset, count in _split(size, channels)
+                    ))
+                    digest = hashlib.sha256(view).hexdigest()
+                finally:
+                    view.release()
+
+    await _check_remote_digest(shell_context, remote_path, digest)
+    return digest
+
+
+async def _read_range(shell_context, remote_path, target, offset):
+    count = len(target)
+    position = 0
+    stderr = []
+
+    command_context = _powershell_command(
+        shell_context, _READ_RANGE_SCRIPT,
+        path=remote_path, offset=offset, count=count,
+    )
+    async with command_context:
+        async for stream, chunk in command_context.stream():
+            if stream == "stdout":
+                end = position + len(chunk)
+                if end > count:
+                    raise TransferError(
+                        "Received more than the {} bytes requested".format(
+                            count
+                        )
+                    )
+                target[position:end] = chunk
+                position = end
+            else:
+                stderr.append(chunk)
+
+    _check_return_code(command_context, stderr)
+    if position != count:
+        raise TransferError(
+            "Expected {} bytes at offset {}, got {}".format(
+                count, offset, position
+            )
+        )
+
+
+async def _check_remote_digest(shell_context, remote_path, digest):
+    output = await _run_script(shell_context, _SHA256_SCRIPT, path=remote_path)
+    remote_digest = output.decode("ascii").strip().lower()
+    if remote_digest != digest:
+        raise TransferError(
+            "Checksum mismatch for {!r}: local {}, remote {}".format(
+                remote_path, digest, remote_digest
+            )
+        )
+
+
+async def _run_script(shell_context, script, stdin=None, **params):
+    """ Run a PowerShell script, and return its stdout as bytes.
+    """
+    stdout = []
+    stderr = []
+
+    command_context = _powershell_command(shell_context, script, **params)
+    async with command_context:
+        if stdin is None:
+            output = command_context.stream()
+        else:
+            output = command_context.stream_with_stdin(stdin)
+        async for stream, chunk in output:
+            (stdout if stream == "stdout" else stderr).append(chunk)
+
+    _check_return_code(command_context, stderr)
+    return b"".join(stdout)
+
+
+def _powershell_command(shell_context, script, **params):
+    params = dict(
+        (key, quote_powershell(value) if isinstance(value, str) else value)
+        for key, value in params.items()
+    )
+    command, args = powershell_command(
+        script.format(buffer_size=_REMOTE_BUFFER_SIZE, **params)
+    )
+    return CommandContext.from_shell_context(
+        shell_context, command, args,
+        console_mode_stdin=False, compress_output=False,
+    )
+
+
+def _check_return_code(command_context, stderr):
+    if command_context.return_code != 0:
+        raise TransferError(
+            "Remote command failed with exit code {}: {}".format(
+                command_context.return_code,
+                b"".join(stderr).decode("utf8", "replace"),
+            )
+        )
+
+
+def _split(size, channels):
+    """ Split [0, size) in at most channels (offset, count) ranges.
+    """
+    channels = max(1, min(channels, -(-size // MIN_CHANNEL_SIZE)))
+    step = -(-size // channels)
+    return [
+        (offset, min(step, size - offset))
+        for offset in range(0, size, step)
+    ]
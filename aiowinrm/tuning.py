@@ -0,0 +1,50 @@
+from .constants import DEFAULT_MAX_ENVELOPE_SIZE, MAX_ADAPTIVE_ENVELOPE_SIZE
+
+
+class EnvelopeSizeTuner(object):
+    """ Grow MaxEnvelopeSize while Receive responses fill their envelope.
+
+    A response close to the requested size means the server had more output
+    than fitted, so asking for larger envelopes saves round trips. If the
+    server refuses a size (EncodingLimit fault), the tuner falls back to the
+    previous one and never goes above it again.
+
+    Parameters
+    ----------
+    initial : int
+        First envelope size to ask for, in bytes.
+    maximum : int
+        Largest envelope size to ask for, in bytes.
+    growth : int
+        Factor applied to the size when growing.
+    fill_ratio : float
+        A response at least this full (relative to the envelope size)
+        triggers a growth.
+    """
+    def __init__(self, initial=DEFAULT_MAX_ENVELOPE_SIZE,
+                 maximum=MAX_ADAPTIVE_ENVELOPE_SIZE, growth=2, fill_ratio=0.75):
+        self.size = min(initial, maximum)
+        self.maximum = maximum
+        self.growth = growth
+        self.fill_ratio = fill_ratio
+
+        self._initial = self.size
+
+    def update(self, response_size):
+        """ Account for a Receive response of response_size bytes.
+        """
+        if response_size >= self.size * self.fill_ratio:
+            self.size = min(self.size * self.growth, self.maximum)
+
+    def limit_exceeded(self):
+        """ Account for the server refusing the current size.
+
+        Returns
+        -------
+        retry : bool
+            False if the size cannot be lowered any further.
+        """
+        if self.size <= self._initial:
+            return False
+        self.maximum = self.size = max(self.size // self.growth, self._initial)
+        return True
@@ -1,35 +1,153 @@
+import base64
+import functools
+import ipaddress
 import re
-import urllib.parse
 
 from .constants import TranportKind
 
 
-R_HOST = re.compile("""
-(?i)
-^((?P<scheme>http[s]?)://)?
-(?P<host>[0-9a-z-_.]+)
+R_HOST = re.compile(r"""
+^((?P<scheme>https?)://)?
+(\[(?P<ipv6>[0-9a-f:.]+(%[\w.-]+)?)\]|(?P<host>[0-9a-z-_.]+))
 (:(?P<port>\d+))?
 (?P<path>(/)?(wsman)?)?
-""", re.VERBOSE)
+""", re.VERBOSE | re.IGNORECASE)
+
+# Maximum number of distinct (host, transport) pairs parse_endpoint keeps
+# around.
+ENDPOINT_CACHE_SIZE = 64 * 1024
+
+
+class Endpoint(object):
+    """ A normalized WinRM endpoint.
+
+    Endpoints are immutable, and compare and hash as their url.
+
+    Attributes
+    ----------
+    scheme : str
+        "http" or "https".
+    host : str
+        Host name or IP address, without brackets for IPv6 addresses.
+    port : int
+        TCP port.
+    path : str
+        Path of the URL, without leading slash.
+    url : str
+        Complete URL, e.g. "https://[::1]:5986/wsman".
+    """
+    __slots__ = ("scheme", "host", "port", "path", "url")
+
+    def __init__(self, scheme, host, port, path="wsman"):
+        netloc = "[{}]".format(host) if ":" in host else host
+        url = "{0}://{1}:{2}/{3}".format(scheme, netloc, port, path)
+        for name, value in (
+            ("scheme", scheme), ("host", host), ("port", port),
+            ("path", path), ("url", url),
+        ):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Endpoint objects are immutable")
+
+    def __eq__(self, other):
+        if not isinstance(other, Endpoint):
+            return NotImplemented
+        return self.url == other.url
+
+    def __hash__(self):
+        return hash(self.url)
+
+    def __repr__(self):
+        return "Endpoint({!r})".format(self.url)
+
+    def __str__(self):
+        return self.url
+
+    def __reduce__(self):
+        return Endpoint, (self.scheme, self.host, self.port, self.path)
 
 
 # Adapted from pywinrm
-def parse_host(url, transport=TranportKind.ssl):
-    match = R_HOST.match(url)
-    scheme = match.group('scheme')
-    if not scheme:
-        if transport == TranportKind.http:
-            scheme = "http"
-        elif transport == TranportKind.ssl:
-            scheme = "https"
+@functools.lru_cache(maxsize=ENDPOINT_CACHE_SIZE)
+def parse_endpoint(url, transport=TranportKind.ssl):
+    """ Parse a host as given by users into an Endpoint.
+
+    Parameters
+    ----------
+    url : str
+        Host name or IP address, optionally with a scheme, port and path,
+        e.g. "host", "10.0.0.1:5985", "https://[fe80::1]/wsman". IPv6
+        addresses without port may also be given bare, e.g. "::1".
+    transport : TranportKind
+        Transport giving the scheme and port when url has none.
+
+    Returns
+    -------
+    endpoint : Endpoint
+
+    Notes
+    -----
+    Results are cached, so that parsing the same host for every command of
+    a fan-out costs a dictionary lookup.
+    """
+    if transport == TranportKind.http:
+        default_scheme, default_port = "http", 5985
+    elif transport == TranportKind.ssl:
+        default_scheme, default_port = "https", 5986
+    else:
+        raise ValueError("Invalid transport {!r}".format(transport))
+
+    if ":" in url and "/" not in url and "[" not in url:
+        try:
+            ipaddress.IPv6Address(url.split("%", 1)[0])
+        except ValueError:
+            pass
         else:
-            raise ValueError("Invalid tranport {!r}".format(tranport))
+            url = "[{}]".format(url)
+
+    match = R_HOST.match(url)
+    if match is None:
+        raise ValueError("Invalid host {!r}".format(url))
 
-    host = match.group('host')
+    scheme = (match.group('scheme') or default_scheme).lower()
+    host = match.group('ipv6') or match.group('host')
     port = match.group('port')
-    if not port:
-        port = 5986 if transport == TranportKind.ssl else 5985
+    port = int(port) if port else default_port
     path = match.group('path')
     if not path:
         path = 'wsman'
-    return '{0}://{1}:{2}/{3}'.format(scheme, host, port, path.lstrip('/'))
+    return Endpoint(scheme, host, port, path.lstrip('/'))
+
+
+def parse_host(url, transport=TranportKind.ssl):
+    """ Return the complete URL of a host, as parse_endpoint(...).url.
+    """
+    return parse_endpoint(url, transport).url
+
+
+def codepage_encoding(codepage):
+    """ Return the name of the Python codec for a Windows code page, e.g.
+    "cp437" for 437.
+    """
+    if codepage == 65001:
+        return "utf-8"
+    return "cp{}".format(codepage)
+
+
+def quote_powershell(s):
+    """ Quote s as a PowerShell literal string.
+    """
+    return "'{}'".format(s.replace("'", "''"))
+
+
+def powershell_command(script):
+    """ Return the (command, args) running the given PowerShell script.
+
+    The script is passed base64 encoded, so that it needs no quoting for
+    cmd.exe: its command line is about 2.7 times as long as the script.
+    """
+    encoded = base64.b64encode(script.encode("utf-16-le")).decode("ascii")
+    return "powershell", (
+        "-NoProfile", "-NonInteractive", "-EncodedCommand", encoded
+    )
@@ -0,0 +1,207 @@
+""" End-to-end benchmark of aiowinrm.api and aiowinrm.sync against the mock
+WinRM server.
+
+The server runs in a subprocess, so CPU and memory figures only account
+for the client.
+
+Usage examples:
+
+    python benchmarks/bench_e2e.py --commands 500 --concurrency 20
+    python benchmarks/bench_e2e.py --output-size 1048576 --chunk-size 65536
+    python benchmarks/bench_e2e.py --json current.json --compare baseline.json
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import json
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from aiowinrm import api, sync
+
+
+@contextlib.contextmanager
+def mock_server(latency, output_size, chunk_size):
+    cmd = [
+        sys.executable, "-m", "aiowinrm.tests.mock_server",
+        "--latency", str(latency), "--output-size", str(output_size),
+    ]
+    if chunk_size:
+        cmd.extend(["--chunk-size", str(chunk_size)])
+
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    try:
+        url = p.stdout.readline().decode("ascii").strip()
+        if not url:
+            raise RuntimeError("Mock server failed to start")
+        yield url
+    finally:
+        p.terminate()
+        p.wait()
+
+
+def run_api(url, commands, concurrency):
+    # The mock server does not check credentials
+    auth = None
+    latencies = []
+
+    async def one(semaphore):
+        async with semaphore:
+            start = time.perf_counter()
+            await api.run_cmd(url, auth, "dir")
+            latencies.append(time.perf_counter() - start)
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(one(semaphore) for _ in range(commands)))
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+    return latencies
+
+
+def run_sync(url, commands, concurrency):
+    auth = ("user", "password")
+
+    def one(_):
+        start = time.perf_counter()
+        sync.run_cmd(url, auth, "dir")
+        return time.perf_counter() - start
+
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        return list(executor.map(one, range(commands)))
+
+
+def run_sync_session(url, commands, concurrency):
+    auth = ("user", "password")
+
+    with sync.Session.create(auth, url, pool_maxsize=concurrency) as session:
+        def one(_):
+            start = time.perf_counter()
+            session.run_cmd("dir")
+            return time.perf_counter() - start
+
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+            return list(executor.map(one, range(commands)))
+
+
+CLIENTS = {
+    "api": run_api,
+    "sync": run_sync,
+    "sync-session": run_sync_session,
+}
+
+
+def measure(client, url, commands, concurrency, trace_memory):
+    if trace_memory:
+        tracemalloc.start()
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    latencies = CLIENTS[client](url, commands, concurrency)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    else:
+        peak = None
+
+    latencies.sort()
+    return {
+        "commands_per_sec": commands / elapsed,
+        "p50_ms": _percentile(latencies, 50) * 1e3,
+        "p99_ms": _percentile(latencies, 99) * 1e3,
+        "cpu_ms_per_command": cpu / commands * 1e3,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "traced_peak_kb": None if peak is None else peak // 1024,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """ Return a list of regressions of results against baseline.
+    """
+    regressions = []
+    for client, current in results.items():
+        previous = baseline.get(client)
+        if previous is None:
+            continue
+        checks = (
+            ("commands_per_sec", -1),
+            ("p99_ms", 1),
+            ("cpu_ms_per_command", 1),
+        )
+        for key, direction in checks:
+            change = (current[key] - previous[key]) / previous[key]
+            if change * direction > tolerance:
+                regressions.append("{} {}: {:.3f} -> {:.3f} ({:+.0%})".format(
+                    client, key, previous[key], current[key], change
+                ))
+    return regressions
+
+
+def _percentile(sorted_values, percent):
+    index = int(round((len(sorted_values) - 1) * percent / 100.0))
+    return sorted_values[index]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--client", action="append", choices=sorted(CLIENTS),
+        help="Client to benchmark (default: all)"
+    )
+    parser.add_argument("--commands", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--output-size", type=int, default=1024)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument(
+        "--trace-memory", action="store_true",
+        help="Report the peak of Python allocations (slows the client down)"
+    )
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument(
+        "--compare", help="Fail if results regressed against this JSON file"
+    )
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = {}
+    with mock_server(args.latency, args.output_size, args.chunk_size) as url:
+        for client in args.client or sorted(CLIENTS):
+            result = results[client] = measure(
+                client, url, args.commands, args.concurrency,
+                args.trace_memory
+            )
+            print(
+                "{client:<12} {commands_per_sec:>8.1f} cmd/s  "
+                "p50 {p50_ms:>7.2f} ms  p99 {p99_ms:>7.2f} ms  "
+                "cpu {cpu_ms_per_command:>6.2f} ms/cmd  "
+                "maxrss {max_rss_kb} KB".format(client=client, **result)
+            )
+
+    if args.json:
+        with open(args.json, "wt") as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+""" Compare building Receive envelopes with lxml against the template cache.
+
+Usage: python benchmarks/bench_envelope.py [repeat]
+"""
+import sys
+import timeit
+import uuid
+
+import lxml.etree as etree
+
+from aiowinrm.soap.protocol import command_output
+from aiowinrm.soap.template import envelope_template, render_envelope
+
+
+def main(argv=None):
+    argv = argv or sys.argv[1:]
+    number = int(argv[0]) if argv else 20000
+
+    shell_id = str(uuid.uuid4()).upper()
+    command_id = str(uuid.uuid4()).upper()
+
+    def build():
+        return etree.tostring(command_output(shell_id, command_id))
+
+    def render():
+        return render_envelope(command_output, shell_id, command_id)
+
+    assert len(build()) == len(render())
+    envelope_template.cache_clear()
+
+    for name, func in (("lxml builder", build), ("template", render)):
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print("{:<14} {:>8.2f} us/envelope".format(name, best / number * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+""" Compare Receive round trips per MB of output and throughput for several
+MaxEnvelopeSize and Receive pipelining settings, against the mock WinRM
+server.
+
+Usage: python benchmarks/bench_envelope_size.py [size_mb] [latency]
+"""
+import asyncio
+import sys
+import time
+
+import aiohttp
+
+from aiowinrm.core import CommandContext, ShellContext
+from aiowinrm.tests.mock_server import (
+    ACTION_RECEIVE, MockWinRMServer, generated_output
+)
+
+
+SETTINGS = (
+    ("server default", {}),
+    ("500 KB", {"max_envelope_size": 500 * 1024}),
+    ("adaptive", {"adaptive_envelope_size": True}),
+    ("pipelined x4", {"pipeline_depth": 4}),
+    ("adaptive, x4", {"adaptive_envelope_size": True, "pipeline_depth": 4}),
+)
+
+
+async def bench(size, latency):
+    for name, options in SETTINGS:
+        server = MockWinRMServer(generated_output(size), latency=latency)
+        async with server:
+            async with aiohttp.ClientSession() as session:
+                start = time.perf_counter()
+                async with ShellContext(
+                    session, server.url, **options
+                ) as shell_context:
+                    async with CommandContext.from_shell_context(
+                        shell_context, "type", ("big.log",)
+                    ) as command_context:
+                        received = 0
+                        async for _, chunk in command_context.stream():
+                            received += len(chunk)
+                elapsed = time.perf_counter() - start
+
+        assert received == size
+        receives = server.request_counts[ACTION_RECEIVE]
+        print("{:<15} {:>6.2f} Receive/MB {:>8.1f} MB/s".format(
+            name, receives / (size / 1024 ** 2), size / elapsed / 1024 ** 2
+        ))
+
+
+def main(argv=None):
+    argv = argv or sys.argv[1:]
+    size = int(float(argv[0]) * 1024 ** 2) if argv else 16 * 1024 ** 2
+    latency = float(argv[1]) if len(argv) > 1 else 0.005
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(bench(size, latency))
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+""" Compare parsing Receive responses on the event loop against offloading
+it to a thread or process pool, with the mock WinRM server.
+
+Besides throughput, the lag of the event loop is sampled by a task waking
+up every millisecond: its p99 shows how long other requests would wait
+behind the parsing.
+
+Usage examples:
+
+    python benchmarks/bench_offload.py
+    python benchmarks/bench_offload.py --commands 200 --concurrency 50 \\
+        --output-size 4194304 --chunk-size 262144 --workers 4
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import time
+
+import aiohttp
+
+from aiowinrm.constants import DEFAULT_OFFLOAD_THRESHOLD
+from aiowinrm.core import ShellContext
+from aiowinrm.offload import Offloader
+
+from bench_e2e import _percentile, mock_server
+
+
+MODES = ("inline", "thread", "process")
+
+
+async def _sample_lag(lags, interval=0.001):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def _run(url, commands, concurrency, offloader):
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def one():
+            async with semaphore:
+                async with ShellContext(
+                    session, url, offloader=offloader
+                ) as shell_context:
+                    await shell_context.run("dir")
+
+        await asyncio.gather(*(one() for _ in range(commands)))
+
+
+def measure(mode, url, commands, concurrency, workers, threshold):
+    if mode == "thread":
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+    elif mode == "process":
+        executor = concurrent.futures.ProcessPoolExecutor(workers)
+    else:
+        executor = None
+
+    async def main():
+        offloader = None
+        if executor is not None:
+            offloader = Offloader(executor, threshold=threshold)
+        lags = []
+        sampler = asyncio.ensure_future(_sample_lag(lags))
+        try:
+            start = time.perf_counter()
+            await _run(url, commands, concurrency, offloader)
+            elapsed = time.perf_counter() - start
+        finally:
+            sampler.cancel()
+        return elapsed, lags
+
+    loop = asyncio.new_event_loop()
+    try:
+        elapsed, lags = loop.run_until_complete(main())
+    finally:
+        loop.close()
+        if executor is not None:
+            executor.shutdown()
+
+    lags.sort()
+    return {
+        "commands_per_sec": commands / elapsed,
+        "lag_p50_ms": _percentile(lags, 50) * 1e3,
+        "lag_p99_ms": _percentile(lags, 99) * 1e3,
+        "lag_max_ms": lags[-1] * 1e3,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--mode", action="append", choices=MODES,
+        help="Parsing mode to benchmark (default: all)"
+    )
+    parser.add_argument("--commands", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--output-size", type=int, default=1024 ** 2)
+    parser.add_argument("--chunk-size", type=int, default=100 * 1024)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument(
+        "--threshold", type=int, default=DEFAULT_OFFLOAD_THRESHOLD,
+        help="Responses smaller than this many bytes are parsed inline"
+    )
+    args = parser.parse_args(argv)
+
+    with mock_server(0.0, args.output_size, args.chunk_size) as url:
+        for mode in args.mode or MODES:
+            result = measure(
+                mode, url, args.commands, args.concurrency, args.workers,
+                args.threshold
+            )
+            print(
+                "{mode:<8} {commands_per_sec:>8.1f} cmd/s  "
+                "loop lag p50 {lag_p50_ms:>6.2f} ms  "
+                "p99 {lag_p99_ms:>7.2f} ms  "
+                "max {lag_max_ms:>7.2f} ms".format(mode=mode, **result)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+""" Benchmark aiowinrm.transfer upload/download against a local stand-in
+server.
+
+The stand-in emulates the PowerShell scripts sent by aiowinrm.transfer on
+an in-memory file system, so this measures the client and protocol
+overhead, not Windows disk I/O.
+
+Usage: python benchmarks/bench_transfer.py [size_mb] [channels...]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from aiowinrm.core import ShellContext
+from aiowinrm.tests.mock_server import FakeTransferShell, MockWinRMServer
+from aiowinrm.transfer import download, upload
+
+
+async def bench(size, channels):
+    files = {}
+    server = MockWinRMServer(
+        lambda command, args: FakeTransferShell(files, command, args)
+    )
+
+    with tempfile.TemporaryDirectory() as d:
+        source = os.path.join(d, "source.bin")
+        target = os.path.join(d, "target.bin")
+        with open(source, "wb") as fp:
+            fp.write(os.urandom(size))
+
+        async with server:
+            async with aiohttp.ClientSession() as session:
+                async with ShellContext(session, server.url) as shell_context:
+                    for name, func, args in (
+                        ("upload", upload, (source, "C:\\bench.bin")),
+                        ("download", download, ("C:\\bench.bin", target)),
+                    ):
+                        start = time.perf_counter()
+                        await func(shell_context, *args, channels=channels)
+                        elapsed = time.perf_counter() - start
+                        print("{:<9} channels={:<2} {:>8.1f} MB/s".format(
+                            name, channels, size / elapsed / 1024 ** 2
+                        ))
+
+
+def main(argv=None):
+    argv = argv or sys.argv[1:]
+    size = int(float(argv[0]) * 1024 ** 2) if argv else 32 * 1024 ** 2
+    channels = [int(arg) for arg in argv[1:]] or [1, 4]
+
+    loop = asyncio.new_event_loop()
+    try:
+        for n in channels:
+            loop.run_until_complete(bench(size, n))
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
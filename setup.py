@@ -24,6 +24,7 @@ INSTALL_REQUIRES = (
 
 PACKAGES = (
     "aiowinrm",
+    "aiowinrm.psrp",
     "aiowinrm.soap",
 )
 
@@ -174,12 +175,13 @@ def main():
         author="David Cournapeau",
         author_email="cournape@gmail.com",
         name="aiowinrm",
-        description="A python 3.5+ async library for the WinRM protocol",
+        description="A python 3.8+ async library for the WinRM protocol",
         url="https://github.com/cournape/aio-winrm",
         version=version,
         license="Apache 2.0",
         packages=PACKAGES,
         install_requires=INSTALL_REQUIRES,
+        python_requires=">=3.8",
     )
 
 